@@ -5,11 +5,16 @@
 
 import sys
 import cgi  # to get POST fields from Github
-import json
+import html
 import os
 from crontab import CronTab
 from crontab import CronSlices
 
+# Config validation is shared with frontend entry points
+sys.path.insert(0, os.path.normpath(os.path.dirname(__file__) + '/../frontend'))
+import gcconfig
+import gccron
+
 def main(env):
 
     here = os.path.dirname(__file__)
@@ -32,12 +37,20 @@ def main(env):
     if "config" in post_data:
         # Prevent saving invalid code.
         try:
-            config = json.loads(post_data['config'].value)
-        except ValueError:
-            error += '<center style="color:red;">Config format is invalid!</center>'
+            config = gcconfig.parseConfig(post_data['config'].value)
+        except gcconfig.ConfigError as e:
+            error += '<center style="color:red;">Config format is invalid! (' + html.escape(str(e)) + ')</center>'
         else:
-            # Check and update crontab tasks
+            # Check and update crontab tasks.
+            # If scheduler daemon is active (cron.py --daemon), it runs tasks itself, so crontab tasks are only removed.
+            scheduler_active = config.get("scheduler", {}).get("active", False)
             for cron_task_name, cron_task in config["cron"].items():
+                try:
+                    gccron.CronExpression(cron_task["cron_definition"])
+                except gccron.CronError as e:
+                    error += '<center style="color:red;">' + html.escape(str(e)) + ' (' + cron_task_name + ')!</center>'
+                    continue
+
                 cron = CronTab(user=cron_task["cron_user"])
                 command = "python3 " + root_path + "/frontend/cron.py " + cron_task_name + " >/dev/null 2>&1"
 
@@ -45,6 +58,9 @@ def main(env):
                 old_jobs = cron.find_command(command)
                 for old_job in old_jobs:
                     cron.remove(old_job)
+                if scheduler_active:
+                    cron.write()
+                    continue
                 # Create new job
                 job = cron.new(command=command)
                 job.setall(cron_task["cron_definition"])
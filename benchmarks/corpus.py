@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Corpus of representative Github webhook payloads for benchmarks.
+# Covers every event, handled by GithubChatworkBot, with small, large and pathological bodies.
+
+import json
+import random
+
+# Repository name, used in all payloads
+REPOSITORY = "benchrepo"
+# Body kinds of corpus
+BODY_KINDS = ("small", "large", "pathological")
+
+
+def buildAccountMap(accounts_count):
+    """
+    Build chatwork_github_account_map with designated count of accounts.
+    :param accounts_count: Int - Count of mapped accounts
+    :return: Dict - Account map in config.json format
+    """
+    account_map = {}
+    for i in range(accounts_count):
+        account_map["engineer-" + str(i)] = {
+            "chatwork_account": str(1000000 + i),
+            "chatwork_rooms": [str(50000000 + i)] if i % 10 == 0 else []
+        }
+    return account_map
+
+
+def buildBody(kind, accounts_count, seed=1):
+    """
+    Build issue/comment body.
+    :param kind: String - "small" (short comment), "large" (64 KB description with images and code)
+                          or "pathological" (64 KB of constructions, which are expensive to parse)
+    :param accounts_count: Int - Count of mapped accounts (mentions are taken from them)
+    :param seed: Int - Random seed
+    :return: String - Body contents
+    """
+    rnd = random.Random(seed)
+
+    def mention():
+        return "@engineer-" + str(rnd.randrange(accounts_count))
+
+    if kind == "small":
+        return "Fixed in the latest commit, " + mention() + " please take a look.\nThanks!"
+
+    if kind == "large":
+        parts = ["## Summary\n", "This PR changes the sync logic. cc " + mention() + " " + mention() + "\n\n"]
+        while sum(len(part) for part in parts) < 64 * 1024:
+            parts.append(rnd.choice([
+                "Some paragraph of explanation, which is long enough to be wrapped、そして日本語の説明もあります。\n",
+                "![screenshot](https://user-images.githubusercontent.com/1/" + str(rnd.randrange(10 ** 6)) + ".png)\n",
+                '<img width="400" alt="image" src="https://user-images.githubusercontent.com/1/' + str(rnd.randrange(10 ** 6)) + '.png">\n',
+                "```python\ndef handler(event):\n    return event['action']\n```\n",
+                "- [ ] check " + mention() + "\n",
+                "Traceback line from pasted log: File \"/srv/app/module.py\", line 42, in handler\n",
+            ]))
+        return "".join(parts)
+
+    # Pathological: long lines without cut borders and unclosed constructions
+    parts = [mention() + " "]
+    while sum(len(part) for part in parts) < 64 * 1024:
+        parts.append(rnd.choice(['<img src="', '![', '![a](', '```', 'x' * 64, '@', '@@', mention()]))
+    return "".join(parts)
+
+
+def _user(login):
+    """
+    Build Github user object.
+    :param login: String - Github account name
+    :return: Dict - User object
+    """
+    return {
+        "login": login,
+        "id": sum(ord(char) * 31 ** i for i, char in enumerate(login)) % 10 ** 7,
+        "avatar_url": "https://avatars.githubusercontent.com/u/1?v=4",
+        "url": "https://api.github.com/users/" + login,
+        "html_url": "https://github.com/" + login,
+        "type": "User",
+        "site_admin": False
+    }
+
+
+def _repository():
+    """
+    Build Github repository object.
+    :return: Dict - Repository object
+    """
+    return {
+        "id": 1296269,
+        "name": REPOSITORY,
+        "full_name": "company/" + REPOSITORY,
+        "private": True,
+        "owner": _user("company"),
+        "html_url": "https://github.com/company/" + REPOSITORY,
+        "description": "Benchmark repository",
+        "default_branch": "master"
+    }
+
+
+def _issue(number, body, author, assignees):
+    """
+    Build Github issue object.
+    """
+    return {
+        "url": "https://api.github.com/repos/company/" + REPOSITORY + "/issues/" + str(number),
+        "html_url": "https://github.com/company/" + REPOSITORY + "/issues/" + str(number),
+        "number": number,
+        "title": "Sync fails on large repositories",
+        "user": _user(author),
+        "labels": [],
+        "state": "open",
+        "assignee": _user(assignees[0]) if assignees else None,
+        "assignees": [_user(login) for login in assignees],
+        "comments": 3,
+        "body": body
+    }
+
+
+def _pullRequest(number, body, author, assignees):
+    """
+    Build Github pull request object.
+    """
+    pull_request = _issue(number, body, author, assignees)
+    pull_request["html_url"] = "https://github.com/company/" + REPOSITORY + "/pull/" + str(number)
+    pull_request["title"] = "Speed up sync of large repositories"
+    pull_request["head"] = {"ref": "feature/sync", "sha": "6dcb09b5b57875f334f61aebed695e2e4193db5e", "repo": _repository()}
+    pull_request["base"] = {"ref": "master", "sha": "9049f1265b7d61be4a8904a9a27120d2064dab3b", "repo": _repository()}
+    pull_request["merged"] = False
+    return pull_request
+
+
+def _comment(body, author, html_url):
+    """
+    Build Github comment object.
+    """
+    return {
+        "id": 1,
+        "html_url": html_url + "#issuecomment-1",
+        "user": _user(author),
+        "body": body
+    }
+
+
+def buildCorpus(accounts_count):
+    """
+    Build benchmark corpus.
+    :param accounts_count: Int - Count of mapped accounts
+    :return: List - Corpus entries {"name", "event", "handler", "payload_json", "to_list", "text"}
+    """
+    sender = "engineer-0"
+    author = "engineer-" + str(1 % accounts_count)
+    assignees = ["engineer-" + str(2 % accounts_count), "engineer-" + str(3 % accounts_count)]
+    corpus = []
+
+    for kind in BODY_KINDS:
+        body = buildBody(kind, accounts_count)
+        issue = _issue(1347, body, author, assignees)
+        pull_request = _pullRequest(1348, body, author, assignees)
+        events = [
+            ("issue_opened", "issues", "_buildIssueOpenedMessage",
+             {"action": "opened", "issue": issue}, [], issue["body"]),
+            ("issue_commented", "issue_comment", "_buildIssueCommentedMessage",
+             {"action": "created", "issue": issue, "comment": _comment(body, sender, issue["html_url"])},
+             [author] + assignees, body),
+            ("issue_assigned", "issues", "_buildIssueAssignedMessage",
+             {"action": "assigned", "issue": issue, "assignee": _user(assignees[0])}, [assignees[0]], issue["body"]),
+            ("issue_closed", "issues", "_buildIssueClosedMessage",
+             {"action": "closed", "issue": issue}, [author] + assignees, issue["body"]),
+            ("pr_opened", "pull_request", "_buildPROpenedMessage",
+             {"action": "opened", "number": 1348, "pull_request": pull_request}, [], pull_request["body"]),
+            ("pr_commented", "pull_request_review_comment", "_buildPRCommentedMessage",
+             {"action": "created", "pull_request": pull_request, "comment": _comment(body, sender, pull_request["html_url"])},
+             [author] + assignees, body),
+            ("pr_assigned", "pull_request", "_buildPRAssignedMessage",
+             {"action": "assigned", "number": 1348, "pull_request": pull_request, "assignee": _user(assignees[0])},
+             [assignees[0]], ""),
+            ("pr_closed", "pull_request", "_buildPRClosedMessage",
+             {"action": "closed", "number": 1348, "pull_request": pull_request}, [author] + assignees, ""),
+            ("commit_commented", "commit_comment", "_buildCommitCommentedMessage",
+             {"action": "created", "comment": dict(_comment(body, sender, "https://github.com/company/" + REPOSITORY + "/commit/6dcb09b"), commit_id="6dcb09b5b57875f334f61aebed695e2e4193db5e")},
+             [], body),
+        ]
+        for name, event, handler, payload, to_list, text in events:
+            payload["repository"] = _repository()
+            payload["sender"] = _user(sender)
+            corpus.append({
+                "name": name + "/" + kind,
+                "event": event,
+                "handler": handler,
+                "payload_json": json.dumps(payload),
+                "to_list": to_list,
+                "text": text
+            })
+    return corpus
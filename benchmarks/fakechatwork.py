@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Local stand-in of Chatwork for load tests (see loadtest.py): emulates API endpoints, used by the bot
+# (POST /v1/rooms/<id>/messages, POST /v1/rooms/<id>/tasks), and UI endpoints (POST /login.php, GET / with
+# ACCESS_TOKEN, POST /gateway.php?cmd=send_chat). Faults are injected on demand: response latency, 429 and 5xx
+# responses, rate limit per token, UI sessions, which expire with "NO LOGIN".
+# Delivered messages are counted, load test markers "loadtest-<number>" in message text are recorded with arrival time.
+#
+# Usage (in script root directory):
+#   python3 benchmarks/fakechatwork.py --port 8100 --latency 80 --jitter 40 --error-429 0.01 --session-ttl 60
+# Point the bot to it: GithubChatworkBot.chatwork_api_url = "http://127.0.0.1:8100/v1",
+# ChatworkUI.url = "http://127.0.0.1:8100".
+# Service routes:
+#   GET /_stats     - counters and marker arrival times (JSON)
+#   POST /_reset    - reset counters
+
+import argparse
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+# Load test marker, which loadtest.py puts into titles and comments
+MARKER_PATTERN = re.compile(r'loadtest-(\d+)')
+
+
+class FakeChatwork:
+    """
+    State of fake Chatwork: fault settings, UI sessions, rate limit buckets and counters. Thread-safe.
+    """
+
+    # Response latency and its random addition in seconds
+    latency = 0.0
+    jitter = 0.0
+    # Share of requests, answered with 429 / 500
+    error_429 = 0.0
+    error_500 = 0.0
+    # Requests per token (API) or per UI account during period seconds (0 - not limited)
+    limit = 0
+    period = 300
+    # Seconds, after which UI session expires (0 - session does not expire)
+    session_ttl = 0
+    # Share of UI messages, answered with "NO LOGIN" (session is dropped)
+    expire_rate = 0.0
+
+    def __init__(self, latency=0.0, jitter=0.0, error_429=0.0, error_500=0.0, limit=0, period=300, session_ttl=0, expire_rate=0.0):
+        """
+        :param latency: Float - Response latency in seconds
+        :param jitter: Float - Max random addition to latency in seconds
+        :param error_429: Float - Share of requests, answered with 429
+        :param error_500: Float - Share of requests, answered with 500
+        :param limit: Int - Requests per token during period (0 - not limited)
+        :param period: Int - Rate limit period in seconds
+        :param session_ttl: Float - UI session lifetime in seconds (0 - unlimited)
+        :param expire_rate: Float - Share of UI messages, answered with "NO LOGIN"
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_500 = error_500
+        self.limit = limit
+        self.period = period
+        self.session_ttl = session_ttl
+        self.expire_rate = expire_rate
+        self._lock = threading.Lock()
+        # UI sessions {"cwssid": {"created": timestamp, "access_token": token}}
+        self._sessions = {}
+        # Rate limit windows {"token": (window start, count)}
+        self._windows = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Reset counters (sessions are kept).
+        """
+        with self._lock:
+            self._counters = {
+                "api_requests": 0, "ui_requests": 0, "messages": 0, "tasks": 0, "logins": 0,
+                "rate_limited": 0, "injected_429": 0, "injected_500": 0, "no_login": 0
+            }
+            self._rooms = {}
+            self._markers = {}
+            self._first_message = None
+            self._last_message = None
+
+    def count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def sleep(self):
+        """
+        Emulate response latency.
+        """
+        delay = self.latency + random.random() * self.jitter
+        if delay > 0:
+            time.sleep(delay)
+
+    def fault(self):
+        """
+        Choose injected fault of request.
+        :return: Int - HTTP status (429 or 500) or 0 if request is not failed
+        """
+        chance = random.random()
+        if chance < self.error_429:
+            self.count("injected_429")
+            return 429
+        if chance < self.error_429 + self.error_500:
+            self.count("injected_500")
+            return 500
+        return 0
+
+    def takeBudget(self, key):
+        """
+        Count request in rate limit window of token.
+        :param key: String - Token or UI account id
+        :return: Tuple - (Bool - request is allowed, Dict - X-RateLimit-* headers)
+        """
+        if not self.limit:
+            return True, {}
+        now = time.time()
+        with self._lock:
+            start, count = self._windows.get(key, (now, 0))
+            if now >= start + self.period:
+                start, count = now, 0
+            allowed = count < self.limit
+            if allowed:
+                count += 1
+            self._windows[key] = (start, count)
+            if not allowed:
+                self._counters["rate_limited"] += 1
+        return allowed, {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.limit - count),
+            "X-RateLimit-Reset": str(int(start + self.period))
+        }
+
+    def deliver(self, room_id, text, task=False):
+        """
+        Count delivered message or task and record markers of its text.
+        :param room_id: String - Room id
+        :param text: String - Message text
+        :param task: Bool - Text is task body
+        """
+        now = time.time()
+        with self._lock:
+            self._counters["tasks" if task else "messages"] += 1
+            self._rooms[room_id] = self._rooms.get(room_id, 0) + 1
+            if self._first_message is None:
+                self._first_message = now
+            self._last_message = now
+            for marker in MARKER_PATTERN.findall(text or ""):
+                arrivals = self._markers.setdefault(marker, [now, now, 0])
+                arrivals[1] = now
+                arrivals[2] += 1
+
+    def login(self):
+        """
+        Start UI session.
+        :return: String - cwssid cookie value
+        """
+        cwssid = uuid.uuid4().hex
+        with self._lock:
+            self._counters["logins"] += 1
+            self._sessions[cwssid] = {"created": time.time(), "access_token": ""}
+        return cwssid
+
+    def getAccessToken(self, cwssid):
+        """
+        Issue access token of UI session.
+        :param cwssid: String - Session cookie
+        :return: String - Access token or None, if session is not valid
+        """
+        with self._lock:
+            session = self._sessions.get(cwssid)
+            if session is None:
+                return None
+            if not session["access_token"]:
+                session["access_token"] = uuid.uuid4().hex
+            return session["access_token"]
+
+    def checkSession(self, cwssid, access_token):
+        """
+        Check UI session of message request. Expired session is dropped.
+        :param cwssid: String - Session cookie
+        :param access_token: String - "_t" parameter
+        :return: Bool - True if session is valid
+        """
+        with self._lock:
+            session = self._sessions.get(cwssid)
+            valid = session is not None and session["access_token"] == access_token and \
+                (not self.session_ttl or time.time() - session["created"] < self.session_ttl) and \
+                random.random() >= self.expire_rate
+            if not valid:
+                self._sessions.pop(cwssid, None)
+                self._counters["no_login"] += 1
+            return valid
+
+    def getStats(self):
+        """
+        :return: Dict - Counters {"api_requests", "messages", ...}, "rooms" {"room id": count},
+                 "markers" {"number": [first arrival, last arrival, count]}, "first_message" and "last_message" timestamps
+        """
+        with self._lock:
+            return dict(self._counters, rooms=dict(self._rooms), markers=dict(self._markers),
+                        first_message=self._first_message, last_message=self._last_message)
+
+
+class FakeChatworkHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler. Connections are kept alive, like connections of Chatwork.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Object of class FakeChatwork
+    chatwork = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        """
+        Send response.
+        :param status: Int - HTTP status
+        :param body: String or Dict - Response body (dict is sent as json)
+        :param content_type: String - Content type
+        :param headers: Dict or List - Additional headers
+        """
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers.items() if isinstance(headers, dict) else headers or ()):
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _readForm(self):
+        """
+        Read urlencoded request body.
+        :return: Dict - Form fields
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ""
+        return {name: values[0] for name, values in urllib.parse.parse_qs(body, keep_blank_values=True).items()}
+
+    def _getCookies(self):
+        """
+        :return: Dict - Request cookies
+        """
+        cookies = {}
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name:
+                cookies[name] = value
+        return cookies
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/_stats":
+            return self._send(200, self.chatwork.getStats())
+        if url.path == "/":
+            self.chatwork.count("ui_requests")
+            self.chatwork.sleep()
+            access_token = self.chatwork.getAccessToken(self._getCookies().get("cwssid", ""))
+            if access_token is None:
+                return self._send(302, "", "text/html", {"Location": "/login.php"})
+            return self._send(200, "<html><script>var ACCESS_TOKEN = '" + access_token + "';</script></html>", "text/html")
+        self._send(404, {"errors": ["Not found"]})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        form = self._readForm()
+        if url.path == "/_reset":
+            self.chatwork.reset()
+            return self._send(200, {"result": "ok"})
+
+        if url.path == "/login.php":
+            self.chatwork.count("ui_requests")
+            self.chatwork.sleep()
+            if not form.get("email") or not form.get("password"):
+                return self._send(200, "<html>Login failed</html>", "text/html")
+            return self._send(302, "", "text/html", [
+                ("Location", "/"),
+                ("Set-Cookie", "cwssid=" + self.chatwork.login() + "; path=/"),
+                ("Set-Cookie", "AWSELB=" + uuid.uuid4().hex + "; path=/")
+            ])
+
+        if url.path == "/gateway.php":
+            self.chatwork.count("ui_requests")
+            self.chatwork.sleep()
+            query = {name: values[0] for name, values in urllib.parse.parse_qs(url.query).items()}
+            allowed, headers = self.chatwork.takeBudget("ui:" + query.get("myid", ""))
+            status = self.chatwork.fault() if allowed else 429
+            if status:
+                return self._send(status, "<html>Error</html>", "text/html")
+            if not self.chatwork.checkSession(self._getCookies().get("cwssid", ""), query.get("_t", "")):
+                return self._send(200, {"status": {"success": False, "message": "NO LOGIN"}})
+            if query.get("cmd") != "send_chat":
+                return self._send(200, {"status": {"success": False, "message": "Unknown command"}})
+            pdata = json.loads(form.get("pdata") or "{}")
+            self.chatwork.deliver(str(pdata.get("room_id", "")), pdata.get("text", ""))
+            return self._send(200, {"status": {"success": True}, "result": {"new_message_id": uuid.uuid4().hex}})
+
+        match = re.match(r'^/v1/rooms/(\d+)/(messages|tasks)$', url.path)
+        if match:
+            self.chatwork.count("api_requests")
+            self.chatwork.sleep()
+            token = self.headers.get("X-ChatWorkToken") or ""
+            if not token:
+                return self._send(401, {"errors": ["Invalid API token"]})
+            allowed, headers = self.chatwork.takeBudget(token)
+            if not allowed:
+                return self._send(429, {"errors": ["Rate limit exceeded"]}, headers=dict(headers, **{"Retry-After": "1"}))
+            status = self.chatwork.fault()
+            if status:
+                return self._send(status, {"errors": ["Injected fault"]}, headers=dict(headers, **{"Retry-After": "1"}) if status == 429 else headers)
+            if match.group(2) == "tasks":
+                self.chatwork.deliver(match.group(1), form.get("body", ""), True)
+                return self._send(200, {"task_ids": [random.randrange(10 ** 8)]}, headers=headers)
+            self.chatwork.deliver(match.group(1), form.get("body", ""))
+            return self._send(200, {"message_id": str(random.randrange(10 ** 12))}, headers=headers)
+
+        self._send(404, {"errors": ["Not found"]})
+
+
+def createServer(chatwork, host="127.0.0.1", port=0):
+    """
+    Create threaded HTTP server of fake Chatwork.
+    :param chatwork: Object of class FakeChatwork
+    :param host: String - Listened host
+    :param port: Int - Listened port (0 - any free port)
+    :return: Object of class http.server.ThreadingHTTPServer
+    """
+    handler = type("Handler", (FakeChatworkHandler,), {"chatwork": chatwork})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Chatwork API and UI for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100, help="listened port (0 - any free port)")
+    parser.add_argument("--latency", type=float, default=0, help="response latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0, help="max random addition to latency in milliseconds")
+    parser.add_argument("--error-429", type=float, default=0, help="share of requests, answered with 429")
+    parser.add_argument("--error-500", type=float, default=0, help="share of requests, answered with 500")
+    parser.add_argument("--limit", type=int, default=0, help="requests per token during --period (0 - not limited)")
+    parser.add_argument("--period", type=int, default=300, help="rate limit period in seconds")
+    parser.add_argument("--session-ttl", type=float, default=0, help="UI session lifetime in seconds (0 - unlimited)")
+    parser.add_argument("--expire-rate", type=float, default=0, help='share of UI messages, answered with "NO LOGIN"')
+    args = parser.parse_args()
+
+    chatwork = FakeChatwork(args.latency / 1000.0, args.jitter / 1000.0, args.error_429, args.error_500,
+                            args.limit, args.period, args.session_ttl, args.expire_rate)
+    server = createServer(chatwork, args.host, args.port)
+    # The first line is read by loadtest.py to get the port
+    print("Listening on http://" + args.host + ":" + str(server.server_address[1]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
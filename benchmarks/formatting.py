@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Regression check and benchmark of message formatting: legacy regex formatting (before cwmessage scanners)
+# against ChatworkMessage._formatBody. Output must be identical for every case and generated body.
+# Usage (in script root directory): python3 benchmarks/formatting.py [generated bodies count]
+
+import sys
+import os
+import random
+import re
+import timeit
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '../frontend')))
+import cwmessage
+import corpus
+
+# Bodies with constructions, which formatting must handle exactly as legacy formatting
+CASES = [
+    "![image](https://example.com/a.png)",
+    "![[x]](y)",
+    "![a [b] c](https://example.com/a.png) text ![d](e)",
+    "![a](b) ![c](d)\n![e](f",
+    "![a ![b](c)",
+    "![a](b(c))",
+    "![alt]\n(src)",
+    "```x ![a```](u)",
+    "```\n![a](b)\n```",
+    "![x](```y) z ```",
+    "text ```unclosed ![a](b)\n",
+    "```a``` ```b",
+    '<img src="a"> text <img src="b"> tail',
+    '<img width="400" alt="image" src="https://proxy/1.png" data-canonical-src="https://example.com/1.png">',
+    '<img src="a" > and >',
+    '> quote <img src="a"',
+    '<img src="a>"',
+    '<img alt="x">\n<img src="y">',
+    '```\n<img src="a">\n```',
+    '![<img src="a">](b)',
+    "@user ![](a)、説明。",
+]
+
+
+def legacyFormat(body_contents):
+    """
+    Markdown replacement as it was done in ChatworkMessage._formatBody before cwmessage scanners.
+    :param body_contents: String - Message body
+    :return: String - Formatted body (not cut)
+    """
+    body_contents = re.sub(r'!\[.*?\]\((.*?)\)', r'\g<1>', body_contents)
+    body_contents = re.sub(r'<img.*src="(.*?)".*>', r'\g<1>', body_contents)
+    return re.sub(r'```(.*?)(```|$)', r'[code]\g<1>[/code]', body_contents, flags=re.DOTALL)
+
+
+def currentFormat(body_contents):
+    """
+    Markdown replacement of ChatworkMessage._formatBody.
+    :param body_contents: String - Message body
+    :return: String - Formatted body (not cut)
+    """
+    body_contents = cwmessage._replaceMarkdownImages(body_contents)
+    body_contents = cwmessage._replaceHtmlImages(body_contents)
+    return cwmessage.CODE_PATTERN.sub(r'[code]\g<1>[/code]', body_contents)
+
+
+def buildBody(rnd):
+    """
+    Build short random body of construction fragments.
+    :param rnd: Object of class random.Random
+    :return: String - Message body
+    """
+    fragments = ['![', '](', ')', '[', ']', '(', '<img', ' src="', '"', '>', '```', '\n', 'a', ' ', '、']
+    return "".join(rnd.choice(fragments) for i in range(rnd.randrange(1, 40)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rnd = random.Random(1)
+    bodies = CASES + [buildBody(rnd) for i in range(count)]
+    mismatches = [body for body in bodies if legacyFormat(body) != currentFormat(body)]
+    for body in mismatches[:10]:
+        print("MISMATCH " + repr(body) + ": legacy " + repr(legacyFormat(body)) + ", current " + repr(currentFormat(body)))
+
+    message = cwmessage.ChatworkMessage()
+    lines = ["bodies: " + str(len(bodies)) + " (" + str(len(CASES)) + " cases), mismatches: " + str(len(mismatches))]
+    for kind in corpus.BODY_KINDS:
+        body = corpus.buildBody(kind, 100)
+        duration = min(timeit.repeat(lambda: message._formatBody(body), number=1, repeat=5))
+        lines.append("%-12s body: %9.3f ms (%d chars)" % (kind, duration * 1000, len(body)))
+    print("\n".join(lines))
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Microbenchmark of webhook hot path: replays benchmark corpus (see corpus.py) through GithubChatworkBot
+# with stubbed Chatwork transport and reports events/sec and per-stage timings for several account map sizes.
+#
+# Usage (in script root directory):
+#   python3 benchmarks/hotpath.py                    - run and compare with stored baseline (benchmarks/baseline.json)
+#   python3 benchmarks/hotpath.py --save-baseline    - run and store results as new baseline
+#   python3 benchmarks/hotpath.py --verbose          - also show timings of every corpus entry
+# Exit code is 1 if any stage is slower than baseline by more than --threshold percent.
+# Baseline is machine-dependent: interpreter and CPU are stored with it, and if they differ from the current ones,
+# regressions are only reported (exit code is 0). Store baseline again after changes of the measured path.
+
+import sys
+import os
+import argparse
+import json
+import platform
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(here, '../frontend')))
+import gcbot
+import corpus
+
+# Measured stages:
+#   parse      - payload json decoding (GithubChatworkBot.setPayloadJson)
+#   build      - _build*Message handler, addressee resolution included
+#   addressees - _buildAddresseeList alone
+#   format     - ChatworkMessage.getFormattedContents
+#   route      - _routeWebhookEventToRoom with stubbed transport (formatting included)
+#   total      - setPayloadJson + executeWebhookHandler with stubbed transport
+STAGES = ("parse", "build", "addressees", "format", "route", "total")
+# Account map sizes
+ACCOUNT_MAP_SIZES = (10, 100, 1000)
+baseline_path = os.path.join(here, 'baseline.json')
+
+
+def createBot(account_map, entry):
+    """
+    Create bot with stubbed Chatwork transport.
+    :param account_map: Dict - chatwork_github_account_map
+    :param entry: Dict - Corpus entry
+    :return: Object of class GithubChatworkBot
+    """
+    botInstance = gcbot.GithubChatworkBot()
+    botInstance.logging = False
+    botInstance.chatwork_token = "benchmark"
+    botInstance.chatwork_github_account_map = account_map
+    botInstance.repository_room_map = {corpus.REPOSITORY: ["36410221", "36410222"]}
+    botInstance.chatworkRequest = lambda endpoint, data, deadline=None: True
+    botInstance.setEvent(entry["event"])
+    botInstance.setPayloadJson(entry["payload_json"])
+    return botInstance
+
+
+def getMachine():
+    """
+    Describe machine, which results depend on.
+    :return: Dict - {"python": "CPython 3.11.7", "cpu": "CPU model name"}
+    """
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", 'r') as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except IOError:
+        pass
+    return {"python": platform.python_implementation() + " " + platform.python_version(), "cpu": cpu}
+
+
+def measure(function, min_time=0.02, repeat=3):
+    """
+    Measure function call duration.
+    :param function: Callable - Measured function without arguments
+    :param min_time: Float - Min duration of one measurement in seconds (function is called several times)
+    :param repeat: Int - Count of measurements (the best one is used)
+    :return: Float - Duration of one call in seconds
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 10 ** 6:
+            break
+        number *= 10
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def benchmarkEntry(account_map, entry):
+    """
+    Measure all stages for one corpus entry.
+    :param account_map: Dict - chatwork_github_account_map
+    :param entry: Dict - Corpus entry
+    :return: Dict - Stage durations in seconds {"stage": seconds, ...}
+    """
+    botInstance = createBot(account_map, entry)
+    botInstance.getAccountIndex()
+    build = getattr(botInstance, entry["handler"])
+    message = build()
+    # Stub must send messages, otherwise retry and dead letter path is measured instead
+    if not all(botInstance._routeWebhookEventToRoom(message).values()):
+        raise RuntimeError('Stubbed request of ' + entry["name"] + ' failed, check chatworkRequest stub of createBot()')
+
+    def total():
+        totalInstance = createBot(account_map, entry)
+        totalInstance.executeWebhookHandler()
+
+    return {
+        "parse": measure(lambda: botInstance.setPayloadJson(entry["payload_json"])),
+        "build": measure(build),
+        "addressees": measure(lambda: botInstance._buildAddresseeList(entry["to_list"], entry["text"])),
+        "format": measure(message.getFormattedContents),
+        "route": measure(lambda: botInstance._routeWebhookEventToRoom(message)),
+        "total": measure(total),
+    }
+
+
+def run(verbose=False):
+    """
+    Run benchmark for all account map sizes.
+    :param verbose: Bool - Print timings of every corpus entry
+    :return: Dict - Results {"accounts_N": {"events_per_sec": float, "stages_us": {"stage": float, ...}}, ...}
+    """
+    results = {}
+    for accounts_count in ACCOUNT_MAP_SIZES:
+        account_map = corpus.buildAccountMap(accounts_count)
+        stage_sums = dict.fromkeys(STAGES, 0.0)
+        entries = corpus.buildCorpus(accounts_count)
+        for entry in entries:
+            timings = benchmarkEntry(account_map, entry)
+            for stage in STAGES:
+                stage_sums[stage] += timings[stage]
+            if verbose:
+                print("  %5d accounts %-34s " % (accounts_count, entry["name"]) +
+                      " ".join("%s=%.1fus" % (stage, timings[stage] * 10 ** 6) for stage in STAGES))
+
+        results["accounts_" + str(accounts_count)] = {
+            "events_per_sec": round(len(entries) / stage_sums["total"], 1),
+            "stages_us": {stage: round(stage_sums[stage] / len(entries) * 10 ** 6, 2) for stage in STAGES}
+        }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with baseline.
+    :param results: Dict - Results of run()
+    :param baseline: Dict - Stored results
+    :param threshold: Float - Allowed slowdown in percent
+    :return: List - Regression descriptions
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for stage in STAGES:
+            before = baseline[key]["stages_us"].get(stage)
+            after = result["stages_us"][stage]
+            if before and after > before * (1 + threshold / 100.0):
+                regressions.append("%s %s: %.2fus -> %.2fus (+%.0f%%)" % (key, stage, before, after, (after / before - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook hot path microbenchmark")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as new baseline")
+    parser.add_argument("--threshold", type=float, default=25.0, help="allowed slowdown against baseline, percent")
+    parser.add_argument("--verbose", action="store_true", help="show timings of every corpus entry")
+    args = parser.parse_args()
+
+    results = run(args.verbose)
+
+    print("%-16s %12s " % ("map size", "events/sec") + " ".join("%12s" % (stage + " us") for stage in STAGES))
+    for key, result in results.items():
+        print("%-16s %12.1f " % (key, result["events_per_sec"]) +
+              " ".join("%12.2f" % result["stages_us"][stage] for stage in STAGES))
+
+    machine = getMachine()
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(dict(results, machine=machine), f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Baseline saved to " + baseline_path)
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print("Baseline not found, run with --save-baseline first")
+        return 0
+
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    same_machine = baseline.get("machine") == machine
+    if not same_machine:
+        print("Baseline is stored on other machine (" + json.dumps(baseline.get("machine")) + ", current " +
+              json.dumps(machine) + "), regressions are not failed. Store baseline on this machine to check them.")
+    if regressions:
+        print("Regressions against baseline:")
+        for regression in regressions:
+            print("  " + regression)
+        return 1 if same_machine else 0
+    print("No regressions against baseline (threshold " + str(args.threshold) + "%)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Cold start check of webhook entry point: imports frontend/index.py in fresh interpreters with "-X importtime"
+# and checks, that heavy modules are not imported, that import time fits the budget and that import does not
+# create files (log file and other per-process resources are opened by the first request).
+# Heavy modules (Chatwork UI, Github client, HTTP library) must be imported lazily, by paths, which need them.
+# Repository has no unit tests, so this script is the import time test: run it after changing imports.
+#
+# Usage (in script root directory):
+#   python3 benchmarks/importtime.py                  - check with budget from benchmarks/importtime.json
+#   python3 benchmarks/importtime.py --budget 80      - check with budget in milliseconds
+#   python3 benchmarks/importtime.py --report         - also show the slowest imports
+# Exit code is 1 if heavy module is imported, import creates files or median import time exceeds the budget.
+# Budget is machine-dependent: set it on the same machine, where startup time is checked.
+
+import sys
+import os
+import argparse
+import json
+import re
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+frontend_path = os.path.normpath(os.path.join(here, '../frontend'))
+logs_path = os.path.normpath(os.path.join(here, '../logs'))
+budget_path = os.path.join(here, 'importtime.json')
+# Modules, which must not be imported by webhook entry point
+HEAVY_MODULES = ("requests", "urllib3", "github", "pickledb", "cgi", "asyncio", "concurrent.futures", "cwui", "gcgithub")
+# Imported module
+MODULE = "index"
+
+
+def measure():
+    """
+    Import module in fresh interpreter.
+    :return: Tuple - (cumulative import time of module in microseconds, {"module name": cumulative time, ...})
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + MODULE],
+        cwd=frontend_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = re.match(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$', line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+    return modules[MODULE], modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook entry point import time check")
+    parser.add_argument("--budget", type=float, help="import time budget in milliseconds")
+    parser.add_argument("--runs", type=int, default=7, help="count of measurements (median is used)")
+    parser.add_argument("--report", action="store_true", help="show the slowest imports")
+    args = parser.parse_args()
+
+    budget = args.budget
+    if budget is None and os.path.exists(budget_path):
+        with open(budget_path, 'r') as f:
+            budget = json.load(f)["budget_ms"]
+
+    # The first run warms up file system cache and bytecode cache
+    logs_before = set(os.listdir(logs_path))
+    measure()
+    created = sorted(set(os.listdir(logs_path)) - logs_before)
+    timings = []
+    for _ in range(args.runs):
+        total, modules = measure()
+        timings.append(total)
+    median = sorted(timings)[len(timings) // 2] / 1000.0
+    print("Import time of " + MODULE + ": %.1f ms (median of %d runs)" % (median, args.runs))
+
+    if args.report:
+        for name, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:20]:
+            print("  %8.1f ms  %s" % (cumulative / 1000.0, name))
+
+    failed = False
+    if created:
+        print("Import creates files in logs: " + ", ".join(created))
+        failed = True
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+    if heavy:
+        print("Heavy modules are imported: " + ", ".join(heavy))
+        failed = True
+    if budget is not None:
+        if median > budget:
+            print("Import time exceeds budget %.1f ms" % budget)
+            failed = True
+        else:
+            print("Import time fits budget %.1f ms" % budget)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
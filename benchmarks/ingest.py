@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Peak memory and duration of webhook payload ingestion: legacy path (cgi.FieldStorage, json.loads of full payload,
+# payload re-encoding for log) against streaming ingestion (gcpayload), for form-encoded and json request bodies.
+#
+# Usage (in script root directory):
+#   python3 benchmarks/ingest.py
+#   python3 benchmarks/ingest.py --size 4    - payload size in MB
+
+import sys
+import os
+import argparse
+import io
+import json
+import time
+import tracemalloc
+import urllib.parse
+import warnings
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(here, '../frontend')))
+import gcpayload
+import corpus
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import cgi
+
+
+def buildPayloadJson(size):
+    """
+    Build large pull request payload (like pull request with many commits and nested objects).
+    :param size: Int - Approximate payload size in bytes
+    :return: String - Payload json
+    """
+    entry = [entry for entry in corpus.buildCorpus(100) if entry["name"] == "pr_opened/large"][0]
+    payload = json.loads(entry["payload_json"])
+    payload["commits"] = []
+    while len(json.dumps(payload)) < size:
+        payload["commits"].extend({
+            "id": "6dcb09b5b57875f334f61aebed695e2e4193db5e",
+            "message": "Speed up sync of large repositories " * 20,
+            "author": corpus._user("engineer-1"),
+            "added": ["src/module" + str(i) + ".py" for i in range(20)],
+            "repository": corpus._repository()
+        } for _ in range(50))
+    return json.dumps(payload)
+
+
+def buildEnv(content_type, body):
+    """
+    Build WSGI environment of webhook request.
+    """
+    return {
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": content_type,
+        "CONTENT_LENGTH": str(len(body)),
+        "QUERY_STRING": "",
+        "wsgi.input": io.BytesIO(body)
+    }
+
+
+def legacyIngest(env):
+    """
+    Ingestion before gcpayload: form parsing, full json decoding and re-encoding for log.
+    """
+    post_data = cgi.FieldStorage(fp=env['wsgi.input'], environ=env, keep_blank_values=True)
+    payload_json = post_data['payload'].value
+    payload_json.encode('utf_8')
+    return json.loads(payload_json)
+
+
+def streamingIngest(env):
+    """
+    Ingestion with gcpayload.
+    """
+    content_type = gcpayload.getContentType(env)
+    return gcpayload.parsePayload(gcpayload.extractPayloadJson(content_type, gcpayload.readBody(env)))
+
+
+def measure(function, content_type, body):
+    """
+    Measure peak memory and duration of ingestion.
+    :return: Tuple - (peak memory in bytes, duration in seconds, kept payload size in bytes)
+    """
+    start = time.perf_counter()
+    function(buildEnv(content_type, body))
+    elapsed = time.perf_counter() - start
+
+    # Memory is measured separately, because tracing slows down allocations
+    tracemalloc.start()
+    payload = function(buildEnv(content_type, body))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed, len(json.dumps(payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook payload ingestion benchmark")
+    parser.add_argument("--size", type=float, default=2.0, help="payload size in MB")
+    args = parser.parse_args()
+
+    gcpayload.max_size = 64 * 1024 * 1024
+    payload_json = buildPayloadJson(int(args.size * 1024 * 1024))
+    form_body = ("payload=" + urllib.parse.quote_plus(payload_json)).encode("utf-8")
+    json_body = payload_json.encode("utf-8")
+    print("Payload size: %.2f MB" % (len(json_body) / 1024.0 / 1024))
+
+    print("%-30s %14s %12s %16s" % ("path", "peak memory MB", "duration ms", "kept payload KB"))
+    for name, function, content_type, body in (
+            ("legacy (form)", legacyIngest, gcpayload.FORM_CONTENT_TYPE, form_body),
+            ("streaming (form)", streamingIngest, gcpayload.FORM_CONTENT_TYPE, form_body),
+            ("streaming (json)", streamingIngest, gcpayload.JSON_CONTENT_TYPE, json_body)):
+        # Request body itself is allocated by web server, so it is not counted
+        peak, elapsed, kept = measure(function, content_type, body)
+        print("%-30s %14.2f %12.1f %16.1f" % (name, peak / 1024.0 / 1024, elapsed * 1000, kept / 1024.0))
+
+if __name__ == "__main__":
+    main()
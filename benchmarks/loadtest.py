@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# End-to-end load test: webhook requests are sent to WSGI app of frontend/index.py concurrently with designated rate
+# and event mix, while Chatwork is emulated by local fake server (see fakechatwork.py) with injected latency and faults.
+# Bot code is copied with generated config.json into temporary directory, so logs and databases of the working copy
+# are not touched and real Chatwork is never called. App is served by web server processes with fixed count
+# of request threads (like mod_wsgi daemon processes), or webhooks are queued and drained by worker.py processes.
+#
+# Reported:
+#   response latency  - webhook request scheduled -> response received (queueing in load generator included)
+#   delivery latency  - webhook request scheduled -> the first Chatwork message, which contains its marker
+#   delivered messages/sec (counted by fake Chatwork), HTTP and client errors, deliveries without messages,
+#   injected faults, dead letters and errors of bot log
+#
+# Usage (in script root directory):
+#   python3 benchmarks/loadtest.py                                  - 20 webhooks/sec during 30 seconds
+#   python3 benchmarks/loadtest.py --rate 50 --duration 60 --processes 2 --threads 8
+#   python3 benchmarks/loadtest.py --workers 2                      - webhooks are queued and sent by 2 worker.py processes
+#   python3 benchmarks/loadtest.py --transport ui --session-ttl 20  - messages are sent through UI, sessions expire
+#   python3 benchmarks/loadtest.py --latency 150 --jitter 100 --error-429 0.02 --error-500 0.01 --accounts 3
+#   python3 benchmarks/loadtest.py --mix issue_commented=5,pr_opened=1 --bodies small=9,large=1
+#   python3 benchmarks/loadtest.py --json results.json              - also store results to compare runs
+# Exit code is 1 if any webhook request failed or any accepted delivery has no message.
+
+import sys
+import os
+import argparse
+import http.client
+import json
+import math
+import queue
+import random
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+here = os.path.dirname(os.path.abspath(__file__))
+frontend_path = os.path.normpath(os.path.join(here, '../frontend'))
+sys.path.insert(0, frontend_path)
+import corpus
+
+# Placeholder of delivery marker in payload templates (fake Chatwork finds markers in message text)
+MARKER = "loadtest-{number}"
+# Default event mix (weights of corpus entries): comments prevail, like in active repositories
+DEFAULT_MIX = "issue_commented=35,pr_commented=20,issue_opened=10,pr_opened=10,pr_closed=8,issue_closed=7,issue_assigned=5,pr_assigned=3,commit_commented=2"
+# Default body mix (weights of corpus body kinds)
+DEFAULT_BODIES = "small=95,large=5"
+# Rooms of benchmark repository start from this id
+FIRST_ROOM_ID = 36410221
+
+
+def parseWeights(value, names):
+    """
+    Parse weights argument.
+    :param value: String - Weights in format "name=weight,name=weight"
+    :param names: List - Allowed names
+    :return: Dict - {"name": weight}
+    """
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in names:
+            raise argparse.ArgumentTypeError('Unknown name "' + name + '", use one of: ' + ", ".join(names))
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def buildTemplates(github_accounts):
+    """
+    Build payload templates of corpus entries with marker placeholder in titles and comments.
+    :param github_accounts: Int - Count of mapped Github accounts
+    :return: Dict - {"entry name/body kind": (event, payload json with placeholder)}
+    """
+    templates = {}
+    for entry in corpus.buildCorpus(github_accounts):
+        payload = json.loads(entry["payload_json"])
+        for key in ("issue", "pull_request"):
+            if key in payload:
+                payload[key]["title"] += " " + MARKER
+        if "comment" in payload:
+            payload["comment"]["body"] = MARKER + " " + payload["comment"]["body"]
+        templates[entry["name"]] = (entry["event"], json.dumps(payload))
+    return templates
+
+
+def buildConfig(args):
+    """
+    Build config.json of tested bot.
+    :param args: Object of class argparse.Namespace - Load test arguments
+    :return: Dict - Config
+    """
+    accounts = []
+    for i in range(args.accounts):
+        account = {"name": "loadtest" + str(i), "chatwork_token": "loadtesttoken" + str(i)}
+        if args.transport == "ui":
+            account["ui"] = {"login_email": "loadtest" + str(i) + "@example.com", "login_id": str(1471200 + i), "login_password": "password"}
+        accounts.append(account)
+    return {
+        "accounts": accounts,
+        "github_token": "",
+        "logging": True,
+        "chatwork_github_account_map": corpus.buildAccountMap(args.github_accounts),
+        "repository_room_map": {corpus.REPOSITORY: [str(FIRST_ROOM_ID + i) for i in range(args.rooms)]},
+        "http": {"pool_size": max(args.threads, 10), "timeout": 30},
+        "rate_limit": {"active": bool(args.limit), "limit": args.limit, "period": args.period},
+        "delivery_queue": {"active": bool(args.workers), "poll_interval": args.poll_interval},
+        "log": {"max_bytes": 0, "rotate_interval": 0}
+    }
+
+
+def startServer(command):
+    """
+    Start server process and read its url from the first line of output ("Listening on <url>").
+    :param command: List - Command line
+    :return: Tuple - (Object of class subprocess.Popen, String - url)
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise RuntimeError("Server is not started: " + " ".join(command))
+    return process, line[len("Listening on "):].strip()
+
+
+def stopProcesses(processes, timeout=10):
+    """
+    Stop processes with SIGTERM (workers send buffered messages before exit), kill them after timeout.
+    :param processes: List - Objects of class subprocess.Popen
+    :param timeout: Int - Seconds to wait
+    """
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    deadline = time.time() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def getChatworkStats(chatwork_url):
+    """
+    :param chatwork_url: String - Fake Chatwork url
+    :return: Dict - Counters of fake Chatwork (see FakeChatwork.getStats)
+    """
+    with urllib.request.urlopen(chatwork_url + "/_stats", timeout=10) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def sendWebhook(url, event, payload_json, timeout):
+    """
+    Send webhook request like Github does (new connection, json body, X-GitHub-* headers).
+    :param url: String - Bot url
+    :param event: String - Github event name
+    :param payload_json: String - Payload json
+    :param timeout: Float - Request timeout in seconds
+    :return: Int - HTTP status
+    """
+    parts = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        connection.request("POST", parts.path or "/", payload_json.encode('utf-8'), {
+            "Content-Type": "application/json",
+            "User-Agent": "GitHub-Hookshot/loadtest",
+            "X-GitHub-Event": event,
+            "X-GitHub-Delivery": str(uuid.uuid4())
+        })
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def generateLoad(bot_urls, templates, names, rate, duration, concurrency, timeout):
+    """
+    Send webhooks on fixed schedule (open loop): request is due at its scheduled time, whether previous requests
+    are answered or not. Latency is counted from scheduled time, so waiting for free client thread is included.
+    :param bot_urls: List - Bot urls (requests are spread round-robin)
+    :param templates: Dict - Payload templates (see buildTemplates)
+    :param names: List - Template names of requests in order of sending
+    :param rate: Float - Requests per second
+    :param duration: Float - Seconds
+    :param concurrency: Int - Max count of simultaneous requests
+    :param timeout: Float - Request timeout in seconds
+    :return: Tuple - (Float - start timestamp, List - results {"number", "name", "scheduled", "finished", "status", "error"})
+    """
+    due = queue.Queue()
+    results = []
+    results_lock = threading.Lock()
+
+    def client():
+        while True:
+            request = due.get()
+            if request is None:
+                return
+            number, scheduled = request
+            event, template = templates[names[number]]
+            result = {"number": number, "name": names[number], "scheduled": scheduled, "status": None, "error": None}
+            try:
+                result["status"] = sendWebhook(bot_urls[number % len(bot_urls)], event,
+                                               template.replace(MARKER, "loadtest-" + str(number)), timeout)
+            except Exception as e:
+                result["error"] = type(e).__name__
+            result["finished"] = time.time()
+            with results_lock:
+                results.append(result)
+
+    clients = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+
+    start = time.time()
+    for number in range(len(names)):
+        scheduled = start + number / rate
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        due.put((number, scheduled))
+    for _ in clients:
+        due.put(None)
+    for thread in clients:
+        thread.join()
+    return start, sorted(results, key=lambda result: result["number"])
+
+
+def percentile(values, share):
+    """
+    Nearest-rank percentile.
+    :param values: List - Numbers
+    :param share: Float - Percentile share (0.95 for p95)
+    :return: Float or None, if values are empty
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(share * len(ordered))) - 1)]
+
+
+def summarizeLatency(values):
+    """
+    :param values: List - Latencies in seconds
+    :return: Dict - {"count", "p50", "p95", "p99", "max"} in milliseconds
+    """
+    summary = {"count": len(values)}
+    for name, share in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0)):
+        value = percentile(values, share)
+        summary[name] = round(value * 1000, 1) if value is not None else None
+    return summary
+
+
+def countLogLevels(log_path):
+    """
+    Count log lines of tested bot by level.
+    :param log_path: String - Path to log file (JSON lines)
+    :return: Dict - {"ERROR": count, ...}
+    """
+    levels = {}
+    if not os.path.exists(log_path):
+        return levels
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as log_file:
+        for line in log_file:
+            try:
+                level = json.loads(line).get("level", "")
+            except ValueError:
+                continue
+            levels[level] = levels.get(level, 0) + 1
+    return levels
+
+
+def countDeadLetters(work_path):
+    """
+    :param work_path: String - Root directory of tested bot
+    :return: Dict - {"retry": count, "dead": count}
+    """
+    import cwdeadletter
+    path = os.path.join(work_path, "logs/deadletter.db")
+    if not os.path.exists(path):
+        return {cwdeadletter.RETRY: 0, cwdeadletter.DEAD: 0}
+    return cwdeadletter.DeadLetterStore(path).count()
+
+
+def run(args):
+    """
+    Start fake Chatwork and bot, send load and collect results.
+    :param args: Object of class argparse.Namespace
+    :return: Dict - Results
+    """
+    templates = buildTemplates(args.github_accounts)
+    events = parseWeights(args.mix, sorted(set(name.split("/")[0] for name in templates)))
+    bodies = parseWeights(args.bodies, corpus.BODY_KINDS)
+    rnd = random.Random(args.seed)
+    count = max(1, int(args.rate * args.duration))
+    names = [rnd.choices(list(events), list(events.values()))[0] + "/" + rnd.choices(list(bodies), list(bodies.values()))[0]
+             for _ in range(count)]
+
+    work_path = tempfile.mkdtemp(prefix="gcbot-loadtest-")
+    processes = []
+    try:
+        shutil.copytree(frontend_path, os.path.join(work_path, "frontend"), ignore=shutil.ignore_patterns("__pycache__", "*.db"))
+        os.makedirs(os.path.join(work_path, "logs"))
+        with open(os.path.join(work_path, "config.json"), 'w') as config_file:
+            json.dump(buildConfig(args), config_file, indent=2)
+
+        chatwork, chatwork_url = startServer([
+            sys.executable, os.path.join(here, "fakechatwork.py"), "--port", "0",
+            "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-429", str(args.error_429),
+            "--error-500", str(args.error_500), "--limit", str(args.limit), "--period", str(args.period),
+            "--session-ttl", str(args.session_ttl), "--expire-rate", str(args.expire_rate)
+        ])
+        processes.append(chatwork)
+        bot_urls = []
+        for _ in range(args.processes):
+            bot, bot_url = startServer([
+                sys.executable, os.path.abspath(__file__), "--role", "bot", "--root", work_path,
+                "--chatwork-url", chatwork_url, "--threads", str(args.threads)
+            ])
+            processes.append(bot)
+            bot_urls.append(bot_url)
+        for _ in range(args.workers):
+            processes.append(subprocess.Popen([
+                sys.executable, os.path.abspath(__file__), "--role", "worker", "--root", work_path, "--chatwork-url", chatwork_url
+            ], stdout=subprocess.DEVNULL))
+
+        print("Sending %d webhooks (%.1f/sec during %.0f sec) to %d process(es) x %d thread(s)%s..." % (
+            count, args.rate, args.duration, args.processes, args.threads,
+            ", %d worker(s)" % args.workers if args.workers else ""
+        ), flush=True)
+        start, results = generateLoad(bot_urls, templates, names, args.rate, args.duration, args.concurrency, args.timeout)
+
+        # Wait until every accepted delivery has its message (queued deliveries and retries are still in flight)
+        accepted = [result for result in results if result["status"] == 200]
+        deadline = time.time() + args.drain
+        while True:
+            stats = getChatworkStats(chatwork_url)
+            if all(str(result["number"]) in stats["markers"] for result in accepted) or time.time() >= deadline:
+                break
+            time.sleep(0.5)
+
+        stopProcesses(processes[1:])
+        stats = getChatworkStats(chatwork_url)
+    finally:
+        stopProcesses(processes)
+        dead_letters = countDeadLetters(work_path) if os.path.isdir(work_path) else {}
+        log_levels = countLogLevels(os.path.join(work_path, "logs/log.txt"))
+        if args.keep:
+            print("Bot directory is kept: " + work_path)
+        else:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    delivery_latencies = [stats["markers"][str(result["number"])][0] - result["scheduled"]
+                          for result in accepted if str(result["number"]) in stats["markers"]]
+    finished = max(result["finished"] for result in results)
+    elapsed = max((stats["last_message"] or finished), finished) - start
+    return {
+        "settings": {name: value for name, value in vars(args).items() if name not in ("role", "root", "chatwork_url", "json")},
+        "webhooks": {
+            "sent": len(results),
+            "answered_per_sec": round(len(results) / max(finished - start, 1e-9), 1),
+            "http_errors": sum(1 for result in results if result["status"] not in (None, 200)),
+            "client_errors": sum(1 for result in results if result["error"]),
+            "without_message": len(accepted) - len(delivery_latencies)
+        },
+        "response_latency_ms": summarizeLatency([result["finished"] - result["scheduled"] for result in results if result["status"] == 200]),
+        "delivery_latency_ms": summarizeLatency(delivery_latencies),
+        "chatwork": {
+            "messages": stats["messages"],
+            "tasks": stats["tasks"],
+            "messages_per_sec": round(stats["messages"] / max(elapsed, 1e-9), 1),
+            "api_requests": stats["api_requests"],
+            "ui_requests": stats["ui_requests"],
+            "logins": stats["logins"],
+            "no_login": stats["no_login"],
+            "injected_429": stats["injected_429"],
+            "injected_500": stats["injected_500"],
+            "rate_limited": stats["rate_limited"]
+        },
+        "dead_letters": dead_letters,
+        "log_levels": log_levels
+    }
+
+
+def report(results):
+    """
+    Format results.
+    :param results: Dict - Results, returned by run()
+    :return: String
+    """
+    webhooks = results["webhooks"]
+    chatwork = results["chatwork"]
+
+    def share(value, total):
+        return "%d (%.2f%%)" % (value, 100.0 * value / total if total else 0)
+
+    def latency(summary):
+        if not summary["count"]:
+            return "no data"
+        return "p50 %.1f  p95 %.1f  p99 %.1f  max %.1f ms" % (summary["p50"], summary["p95"], summary["p99"], summary["max"])
+
+    requests_count = chatwork["api_requests"] + chatwork["ui_requests"]
+    return "\n".join([
+        "Webhooks:           %d sent (%.1f/sec), answered %.1f/sec, HTTP errors %s, client errors %s" % (
+            webhooks["sent"], results["settings"]["rate"], webhooks["answered_per_sec"], share(webhooks["http_errors"], webhooks["sent"]),
+            share(webhooks["client_errors"], webhooks["sent"])),
+        "Response latency:   " + latency(results["response_latency_ms"]),
+        "Delivery latency:   " + latency(results["delivery_latency_ms"]),
+        "Delivered:          %d messages (%.1f/sec), %d tasks, deliveries without message %s" % (
+            chatwork["messages"], chatwork["messages_per_sec"], chatwork["tasks"],
+            share(webhooks["without_message"], webhooks["sent"] - webhooks["http_errors"] - webhooks["client_errors"])),
+        "Chatwork requests:  %d API, %d UI; injected 429 %s, 500 %s, rate limited %s, NO LOGIN %d, logins %d" % (
+            chatwork["api_requests"], chatwork["ui_requests"], share(chatwork["injected_429"], requests_count),
+            share(chatwork["injected_500"], requests_count), share(chatwork["rate_limited"], requests_count),
+            chatwork["no_login"], chatwork["logins"]),
+        "Dead letters:       " + ", ".join(status + " " + str(count) for status, count in sorted(results["dead_letters"].items())),
+        "Bot log:            " + ", ".join(level + " " + str(count) for level, count in sorted(results["log_levels"].items()))
+    ])
+
+
+def pointToChatwork(chatwork_url):
+    """
+    Send Chatwork requests of this process to fake Chatwork.
+    :param chatwork_url: String - Fake Chatwork url
+    """
+    import gcbot
+    import cwui
+    gcbot.GithubChatworkBot.chatwork_api_url = chatwork_url + "/v1"
+    cwui.ChatworkUI.url = chatwork_url
+
+
+def serveBot(work_path, chatwork_url, threads):
+    """
+    Serve WSGI app of copied index.py (the same way as mod.wsgi serves POST requests) with fixed count of threads.
+    :param work_path: String - Root directory of tested bot
+    :param chatwork_url: String - Fake Chatwork url
+    :param threads: Int - Count of request threads
+    """
+    import logging
+    import traceback
+    import wsgiref.simple_server
+    sys.path[0] = os.path.join(work_path, "frontend")
+    import index
+    pointToChatwork(chatwork_url)
+
+    def application(env, start_response):
+        try:
+            output = str.encode(index.main(env))
+            status = '200 OK'
+        except (Exception, SystemExit):
+            # Apache answers 500, if script fails
+            logging.error('Webhook request failed: ' + traceback.format_exc())
+            output = b''
+            status = '500 Internal Server Error'
+        start_response(status, [('Content-type', 'text/html'), ('Content-Length', str(len(output)))])
+        return [output]
+
+    class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    class PooledServer(wsgiref.simple_server.WSGIServer):
+        """
+        WSGI server with fixed count of request threads.
+        """
+
+        def process_request(self, request, client_address):
+            requests.put((request, client_address))
+
+    requests = queue.Queue()
+    server = wsgiref.simple_server.make_server("127.0.0.1", 0, application, PooledServer, QuietHandler)
+    server.request_queue_size = 128
+
+    def work():
+        while True:
+            request, client_address = requests.get()
+            try:
+                server.finish_request(request, client_address)
+            except Exception:
+                server.handle_error(request, client_address)
+            finally:
+                server.shutdown_request(request)
+
+    for _ in range(threads):
+        threading.Thread(target=work, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("Listening on http://127.0.0.1:" + str(server.server_address[1]) + "/", flush=True)
+    server.serve_forever()
+
+
+def runWorker(work_path, chatwork_url):
+    """
+    Run copied worker.py.
+    :param work_path: String - Root directory of tested bot
+    :param chatwork_url: String - Fake Chatwork url
+    """
+    sys.path[0] = os.path.join(work_path, "frontend")
+    import worker
+    pointToChatwork(chatwork_url)
+    sys.argv = [os.path.join(work_path, "frontend/worker.py")]
+    worker.main()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of webhook processing with fake Chatwork")
+    parser.add_argument("--rate", type=float, default=20, help="webhooks per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of sending")
+    parser.add_argument("--concurrency", type=int, default=64, help="max simultaneous webhook requests")
+    parser.add_argument("--timeout", type=float, default=60, help="webhook request timeout in seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="event weights: name=weight,... (default: %(default)s)")
+    parser.add_argument("--bodies", default=DEFAULT_BODIES, help="body kind weights: small, large, pathological (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of request sequence")
+    parser.add_argument("--processes", type=int, default=1, help="web server processes")
+    parser.add_argument("--threads", type=int, default=8, help="request threads per web server process")
+    parser.add_argument("--workers", type=int, default=0, help="worker.py processes (webhooks are queued, if set)")
+    parser.add_argument("--poll-interval", type=float, default=1, help="queue poll interval of workers in seconds")
+    parser.add_argument("--accounts", type=int, default=1, help="bot accounts")
+    parser.add_argument("--transport", choices=("api", "ui"), default="api", help="transport of messages")
+    parser.add_argument("--rooms", type=int, default=2, help="rooms of benchmark repository")
+    parser.add_argument("--github-accounts", type=int, default=100, help="mapped Github accounts")
+    parser.add_argument("--latency", type=float, default=50, help="Chatwork response latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=50, help="max random addition to Chatwork latency in milliseconds")
+    parser.add_argument("--error-429", type=float, default=0, help="share of Chatwork requests, answered with 429")
+    parser.add_argument("--error-500", type=float, default=0, help="share of Chatwork requests, answered with 500")
+    parser.add_argument("--limit", type=int, default=0, help="Chatwork rate limit per account during --period (0 - not limited)")
+    parser.add_argument("--period", type=int, default=300, help="Chatwork rate limit period in seconds")
+    parser.add_argument("--session-ttl", type=float, default=0, help="UI session lifetime in seconds (0 - unlimited)")
+    parser.add_argument("--expire-rate", type=float, default=0, help='share of UI messages, answered with "NO LOGIN"')
+    parser.add_argument("--drain", type=float, default=30, help="max seconds to wait for messages after sending")
+    parser.add_argument("--keep", action="store_true", help="keep temporary bot directory (logs, databases)")
+    parser.add_argument("--json", help="store results to file")
+    parser.add_argument("--role", choices=("bot", "worker"), help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    parser.add_argument("--chatwork-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "bot":
+        return serveBot(args.root, args.chatwork_url, args.threads)
+    if args.role == "worker":
+        return runWorker(args.root, args.chatwork_url)
+
+    try:
+        results = run(args)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    print(report(results))
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    webhooks = results["webhooks"]
+    sys.exit(1 if webhooks["http_errors"] or webhooks["client_errors"] or webhooks["without_message"] else 0)
+
+if __name__ == "__main__":
+    main()
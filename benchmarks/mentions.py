@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark of @mention extraction: legacy scan (text.find per mapped account) against gcmention.MentionExtractor.
+# Usage (in script root directory): python3 benchmarks/mentions.py [accounts count] [body size in KB]
+
+import sys
+import os
+import random
+import timeit
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '../frontend')))
+import gcmention
+
+
+def legacyExtract(github_accounts, text):
+    """
+    Mention parsing as it was done in GithubChatworkBot._buildAddresseeList before MentionExtractor.
+    :param github_accounts: List - Github account names
+    :param text: String - Comment body
+    :return: List - Found github account names
+    """
+    found = []
+    for github_account in github_accounts:
+        if text.find(github_account) > -1:
+            found.append(github_account)
+    return found
+
+
+# Texts and accounts, which must be found in them (in order of first mention)
+CASES = [
+    ("hi @arith_tanaka ok", ["arith_tanaka"]),
+    ("@bob_acme", ["bob_acme"]),
+    ("@Arith_Tanaka, @engineer-1.", ["arith_tanaka", "engineer-1"]),
+    ("thanks @bob_acme_", ["bob_acme"]),
+    ("@bob_acmex @engineer-1x @arith", []),
+    ("mail bob_acme@example.com, see medium.com/@bob_acme", []),
+]
+
+
+def checkCases(extractor):
+    """
+    Check mention extraction of CASES.
+    :param extractor: Object of class gcmention.MentionExtractor
+    :return: List - Failure descriptions
+    """
+    failures = []
+    for text, expected in CASES:
+        found = extractor.extract(text)
+        if found != expected:
+            failures.append(repr(text) + ": expected " + repr(expected) + ", found " + repr(found))
+    return failures
+
+
+def buildBody(github_accounts, size, mentions_count=20):
+    """
+    Build comment body of designated size with several mentions and mention-like noise.
+    :param github_accounts: List - Github account names
+    :param size: Int - Body size in characters
+    :param mentions_count: Int - Count of real mentions inside body
+    :return: String - Comment body
+    """
+    rnd = random.Random(1)
+    words = ["fix", "review", "please", "LGTM", "see", "http://example.com/path", "foo@example.com", "レビュー", "お願いします。"]
+    chunks = []
+    length = 0
+    while length < size:
+        if rnd.random() < mentions_count * 8 / size:
+            word = "@" + rnd.choice(github_accounts)
+        else:
+            word = rnd.choice(words)
+        chunks.append(word)
+        length += len(word) + 1
+    return " ".join(chunks)[:size]
+
+
+def main():
+    accounts_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    body_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 64) * 1024
+
+    github_accounts = ["engineer-" + str(i) for i in range(accounts_count)] + ["arith_tanaka", "bob_acme"]
+    body = buildBody(github_accounts, body_size)
+    extractor = gcmention.MentionExtractor(github_accounts)
+    failures = checkCases(extractor)
+
+    runs = 5
+    legacy = min(timeit.repeat(lambda: legacyExtract(github_accounts, body), number=1, repeat=runs))
+    current = min(timeit.repeat(lambda: extractor.extract(body), number=1, repeat=runs))
+    compile_time = min(timeit.repeat(lambda: gcmention.MentionExtractor(github_accounts), number=1, repeat=runs))
+
+    return "\n".join([
+        "accounts: " + str(accounts_count) + ", body: " + str(len(body)) + " chars",
+        "legacy scan:       %9.3f ms (%d matches, substring matches included)" % (legacy * 1000, len(legacyExtract(github_accounts, body))),
+        "MentionExtractor:  %9.3f ms (%d matches)" % (current * 1000, len(extractor.extract(body))),
+        "extractor compile: %9.3f ms (once per account map)" % (compile_time * 1000),
+        "speedup:           %9.1fx" % (legacy / current),
+        "cases:             %d of %d failed" % (len(failures), len(CASES)),
+    ] + failures), 1 if failures else 0
+
+if __name__ == "__main__":
+    report, code = main()
+    print(report)
+    sys.exit(code)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Webhook payload archive tool (see gcarchive.py).
+# Use these commands in script root directory:
+#   python3 frontend/archive.py list [--repository NAME] [--event EVENT] [--since "YYYY-mm-dd HH:MM"] [--until ...] [--limit 50]
+#   python3 frontend/archive.py show DELIVERY_ID      - print payload of delivery
+#   python3 frontend/archive.py stats                 - show archive size
+#   python3 frontend/archive.py prune                 - remove segments, which are older than retention
+# Segments are gzip files, so they can also be read directly: zcat logs/archive/payloads-*.gz
+
+import argparse
+import gcarchive
+import gcconfig
+import os
+import time
+
+here = os.path.dirname(__file__)
+config_path = os.path.normpath(here+'/../config.json')
+root_path = os.path.normpath(here+'/../')
+
+
+def parseTime(value):
+    """
+    Convert local time argument to timestamp.
+    :param value: String - Time in format "YYYY-mm-dd HH:MM" or "YYYY-mm-dd"
+    :return: Float - Timestamp or None, if value is not set
+    """
+    if value is None:
+        return None
+    for time_format in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, time_format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('Time "' + value + '" must be in format "YYYY-mm-dd HH:MM"')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook payload archive")
+    commands = parser.add_subparsers(dest="command")
+    list_parser = commands.add_parser("list", help="show archived deliveries, newest first")
+    list_parser.add_argument("--repository")
+    list_parser.add_argument("--event")
+    list_parser.add_argument("--since", type=parseTime)
+    list_parser.add_argument("--until", type=parseTime)
+    list_parser.add_argument("--limit", type=int, default=50)
+    show_parser = commands.add_parser("show", help="print payload of delivery")
+    show_parser.add_argument("delivery_id")
+    commands.add_parser("stats", help="show archive size")
+    commands.add_parser("prune", help="remove segments, which are older than retention")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return ""
+
+    archive = gcarchive.openArchive(root_path, gcconfig.loadConfig(config_path).get("archive", {}))
+
+    if args.command == "list":
+        return "\n".join(
+            "%s\t%s\t%s\t%s\t%s\t%d bytes" % (
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["received_at"])), entry["delivery_id"] or "-",
+                entry["repository"] or "-", entry["event"] or "-", entry["action"] or "-", entry["size"]
+            ) for entry in archive.find(None, args.repository, args.event, args.since, args.until, args.limit)
+        )
+
+    if args.command == "show":
+        payload = archive.get(args.delivery_id)
+        if payload is None:
+            return "Delivery " + args.delivery_id + " is not archived"
+        return payload.decode('utf-8', 'replace')
+
+    if args.command == "stats":
+        stats = archive.stats()
+        return "Segments: %d, payloads: %d, size: %d bytes (compressed %d bytes)" % (
+            stats["segments"], stats["payloads"], stats["size"], stats["compressed_size"]
+        )
+
+    if args.command == "prune":
+        return "Removed segments: " + str(archive.prune())
+
+if __name__ == "__main__":
+    print(main())
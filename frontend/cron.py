@@ -4,6 +4,8 @@
 # This script is called by cron. You can find crontab config in config.json
 # To view all crontab tasks, use this ssh command: for user in $(cut -f1 -d: /etc/passwd); do crontab -u $user -l; done
 # To execute task directly by ssh, use this command in script root directory: python3 frontend/cron.py taskname
+# To run all tasks by in-process scheduler instead of crontab, start daemon: python3 frontend/cron.py --daemon
+# (set "active" to true in "scheduler" section of config.json, so admin page does not write crontab tasks).
 # You can test cron definition here http://cron.schlitt.info
 # Log is here /var/log/cron
 
@@ -14,10 +16,95 @@
 import sys
 import logging
 import gcbot
-import json
+import gccron
+import cwtransport
+import gcconfig
+import gchttpcache
+import gcmetrics
+import gclog
 import os
+import signal
 import time
 
+here = os.path.dirname(__file__)
+config_path = os.path.normpath(here+'/../config.json')
+root_path = os.path.normpath(here+'/../')
+log_path = os.path.join(here, '../logs/log.txt')
+
+# Github responses cache, shared by task runs of the process
+github_cache = None
+
+
+def loadConfig():
+    """
+    Load config and apply process-wide settings (transport, metrics, rate limit).
+    Config file is parsed again only if it is changed.
+    :return: Object of class ConfigSnapshot
+    """
+    config = gcconfig.loadConfig(config_path)
+    gclog.configure(log_path, config.get("log", {}))
+    cwtransport.configure(config.get("http", {}))
+    # Metrics of single cron run are written on exit, metrics of daemon - every flush_interval
+    if gcconfig.configureMetrics(root_path, config):
+        gcmetrics.flush()
+    gcconfig.configureRateLimit(root_path, config)
+    gcconfig.configureRetry(root_path, config)
+    return config
+
+
+def getGithubCache(config):
+    """
+    Open Github responses cache once per process.
+    :param config: Object of class ConfigSnapshot
+    :return: Object of class HttpCache or None, if cache is disabled
+    """
+    global github_cache
+    cache_config = config.get("github_cache", {})
+    if not cache_config.get("active", True):
+        return None
+    if github_cache is None:
+        github_cache = gchttpcache.HttpCache(
+            os.path.join(root_path, cache_config.get("path", "logs/github_cache.db")),
+            cache_config.get("ttl", 86400),
+            cache_config.get("max_size", 50 * 1024 * 1024)
+        )
+    return github_cache
+
+
+def runTask(config, cron_task_name, cron_task):
+    """
+    Execute cron task.
+    :param config: Object of class ConfigSnapshot
+    :param cron_task_name: String - Task name
+    :param cron_task: Dict - Task params from config
+    :return: Any - Execution result
+    """
+    botInstance = gcbot.GithubChatworkBot()
+    botInstance.setConfig(config)
+    botInstance.github_cache = getGithubCache(config)
+    return botInstance.executeCronTask(cron_task_name, cron_task)
+
+
+def daemon():
+    """
+    Run in-process scheduler until SIGTERM or Ctrl+C.
+    """
+    config = loadConfig()
+    scheduler = gccron.CronScheduler(
+        loadConfig,
+        runTask,
+        os.path.join(root_path, 'logs'),
+        config.get("scheduler", {}).get("max_workers", 2)
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    logging.info('Cron scheduler is started.')
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    cwtransport.close()
+    return "Cron scheduler is stopped"
+
 
 def main():
     # Acquire initialisation variables
@@ -26,32 +113,27 @@ def main():
     except IndexError:
         return "You must define task name as first argument"
 
-    cron_task_name = sys.argv[1]
-
-    here = os.path.dirname(__file__)
-    config_path = os.path.normpath(here+'/../config.json')
-    log_path = os.path.join(here, '../logs/log.txt')
+    gclog.configure(log_path, {})
 
-    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", filename=log_path, filemode="a", level=logging.INFO)
+    if sys.argv[1] == "--daemon":
+        return daemon()
 
-    with open(config_path, 'r') as f:
-        config = json.load(f)
+    cron_task_name = sys.argv[1]
+    config = loadConfig()
 
-    if cron_task_name not in config["cron"].keys():
+    if cron_task_name not in config.get("cron", {}).keys():
         return "Defined task name is not found in configuration file"
 
     # Execute cron task, if current date is not excluded in config
     if time.strftime("%Y.%m.%d") not in config["cron"][cron_task_name]["exclude_days"]:
-        botInstance = gcbot.GithubChatworkBot()
-        botInstance.chatwork_token = config["chatwork_token"]
-        botInstance.github_token = config["github_token"]
-        botInstance.logging = config["logging"]
-        botInstance.chatwork_github_account_map = config["chatwork_github_account_map"]
-        botInstance.repository_room_map = config["repository_room_map"]
-        botInstance.ui_login_email = config["ui"]["login_email"]
-        botInstance.ui_login_id = config["ui"]["login_id"]
-        botInstance.ui_login_password = config["ui"]["login_password"]
-        return botInstance.executeCronTask(cron_task_name, config["cron"][cron_task_name])
+        # Skip run, if previous run or scheduler daemon is still executing the task
+        lock = gccron.TaskLock(os.path.join(root_path, 'logs', 'cron_' + cron_task_name + '.lock'))
+        if not lock.acquire():
+            return "Task is already running"
+        try:
+            return runTask(config, cron_task_name, config["cron"][cron_task_name])
+        finally:
+            lock.release()
 
 if __name__ == "__main__":
     print(main())
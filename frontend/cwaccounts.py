@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of AccountPool class
+import bisect
+import hashlib
+import threading
+import time
+
+# Accounts, which are temporarily not used (throttled or logged out), in format {"account name": (until, reason), ...}
+_unavailable = {}
+_unavailable_lock = threading.Lock()
+
+
+class ChatworkAccount:
+    """
+    Bot account, which sends requests to Chatwork (API token and/or UI login).
+    """
+
+    # Unique account name (key of consistent hash ring)
+    name = ""
+    # Chatwork API token ("" - account can not send API requests)
+    chatwork_token = ""
+    # UI login account email, ID and password ("" - account can not send messages through UI)
+    ui_login_email = ""
+    ui_login_id = ""
+    ui_login_password = ""
+    # Rooms, in which account is a member (None - all rooms)
+    rooms = None
+
+    def __init__(self, name, chatwork_token="", ui_login_email="", ui_login_id="", ui_login_password="", rooms=None):
+        """
+        :param name: String - Unique account name
+        :param chatwork_token: String - Chatwork API token
+        :param ui_login_email: String - UI login account email
+        :param ui_login_id: String - UI login account ID
+        :param ui_login_password: String - UI login password
+        :param rooms: List - Rooms, in which account is a member, or None for all rooms
+        """
+        self.name = name
+        self.chatwork_token = chatwork_token
+        self.ui_login_email = ui_login_email
+        self.ui_login_id = ui_login_id
+        self.ui_login_password = ui_login_password
+        self.rooms = frozenset(str(room_id) for room_id in rooms) if rooms is not None else None
+
+    def getRatelimitKey(self, transport):
+        """
+        Get rate limit bucket key of account (see cwratelimit). Token itself is not stored.
+        :param transport: String - "ui" or "api"
+        :return: String - Bucket key
+        """
+        if transport == "ui":
+            return "ui:" + str(self.ui_login_id)
+        return "api:" + hashlib.sha1(self.chatwork_token.encode('utf-8')).hexdigest()[:16]
+
+    def isMember(self, room_id):
+        """
+        Check if account can send requests to the room.
+        :param room_id: String - Chatwork room id ("" - request is not related to room)
+        :return: Bool
+        """
+        return self.rooms is None or not room_id or str(room_id) in self.rooms
+
+
+class AccountPool:
+    """
+    Immutable pool of bot accounts. Requests are spread across accounts by room with consistent hash ring,
+    so every room has stable sender and adding or removing account moves only rooms of that account.
+    Next accounts on the ring are used as fallback, when account is throttled or logged out (see markUnavailable).
+    """
+
+    # Count of ring points per account (more points - more even distribution)
+    replicas = 64
+    # Seconds, during which account is not used after failure, by failure kind
+    unavailable_timeouts = {"rate_limit": 60, "auth": 300}
+    # Accounts in config order
+    accounts = ()
+
+    def __init__(self, accounts):
+        """
+        Build hash ring.
+        :param accounts: List - Objects of class ChatworkAccount
+        """
+        self.accounts = tuple(accounts)
+        ring = sorted(
+            (self._hash(account.name + "#" + str(replica)), index)
+            for index, account in enumerate(self.accounts) for replica in range(self.replicas)
+        )
+        self._ring_hashes = [point for point, index in ring]
+        self._ring_accounts = [index for point, index in ring]
+
+    @classmethod
+    def fromConfig(cls, config):
+        """
+        Build pool from "accounts" section of config.json. Config without "accounts" section
+        has single account, defined by "chatwork_token" and "ui".
+        :param config: Object of class ConfigSnapshot or Dict - config.json contents
+        :return: Object of class AccountPool
+        """
+        if config.get("accounts") is None:
+            ui = config.get("ui", {})
+            return cls([ChatworkAccount(
+                "default", config.get("chatwork_token", ""), ui.get("login_email", ""), ui.get("login_id", ""),
+                ui.get("login_password", "")
+            )])
+        accounts = []
+        for account in config["accounts"]:
+            ui = account.get("ui", {})
+            rooms = account.get("rooms")
+            accounts.append(ChatworkAccount(
+                account["name"], account.get("chatwork_token", ""), ui.get("login_email", ""), ui.get("login_id", ""),
+                ui.get("login_password", ""), list(rooms) if rooms is not None else None
+            ))
+        return cls(accounts)
+
+    def _hash(self, key):
+        """
+        Get ring point of key.
+        """
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def getAccounts(self, room_id):
+        """
+        Get accounts, which can send requests to the room, in order of preference:
+        accounts on the ring after room point, unavailable accounts last. Accounts, which are not members
+        of the room, are never returned.
+        :param room_id: String - Chatwork room id ("" - request is not related to room)
+        :return: List - Objects of class ChatworkAccount (empty, if no account is a member of the room)
+        """
+        if len(self.accounts) < 2:
+            return [account for account in self.accounts if account.isMember(room_id)]
+
+        ordered = []
+        start = bisect.bisect(self._ring_hashes, self._hash(str(room_id)))
+        for position in range(len(self._ring_accounts)):
+            account = self.accounts[self._ring_accounts[(start + position) % len(self._ring_accounts)]]
+            if account not in ordered:
+                ordered.append(account)
+                if len(ordered) == len(self.accounts):
+                    break
+
+        members = [account for account in ordered if account.isMember(room_id)]
+        now = time.time()
+        with _unavailable_lock:
+            available = [account for account in members if _unavailable.get(account.name, (0, ""))[0] <= now]
+        return available + [account for account in members if account not in available]
+
+    def markUnavailable(self, account, reason):
+        """
+        Do not use account for a while (requests are sent by other accounts).
+        :param account: Object of class ChatworkAccount
+        :param reason: String - Failure kind ("rate_limit" or "auth", see cwretry)
+        """
+        with _unavailable_lock:
+            _unavailable[account.name] = (time.time() + self.unavailable_timeouts.get(reason, 60), reason)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of DeadLetterStore class
+import json
+import sqlite3
+import threading
+import time
+
+# Dead letter statuses: scheduled for retry and not retried anymore
+RETRY = "retry"
+DEAD = "dead"
+
+
+class DeadLetterStore:
+    """
+    Store of Chatwork requests, which were not sent (SQLite database in WAL mode), shared by all processes.
+    Requests with transient failures are scheduled for retry (see claim()), requests, which can not be sent
+    without intervention (or exhausted max_attempts), are kept as dead until they are redriven or purged.
+    """
+
+    # Path to SQLite database file
+    path = ""
+    # Count of scheduled attempts, after which request is marked as dead
+    max_attempts = 10
+    # Seconds, during which claimed request is invisible for other processes
+    lease_timeout = 300
+
+    def __init__(self, path, max_attempts=10):
+        """
+        Open (and create if needed) store database.
+        :param path: String - Path to SQLite database file
+        :param max_attempts: Int - Count of scheduled attempts, after which request is marked as dead
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS letters ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "endpoint TEXT NOT NULL, "
+            "data TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "error TEXT NOT NULL DEFAULT '', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "status TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "available_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS letters_available ON letters (status, available_at)")
+
+    def _toDict(self, row):
+        """
+        Convert database row to dead letter dictionary.
+        """
+        keys = ("id", "endpoint", "data", "kind", "error", "attempts", "status", "created_at", "updated_at", "available_at")
+        letter = dict(zip(keys, row))
+        letter["data"] = json.loads(letter["data"])
+        return letter
+
+    def put(self, endpoint, data, kind, error, delay=None):
+        """
+        Store request, which was not sent.
+        :param endpoint: String - Chatwork API endpoint
+        :param data: Dict - Request data
+        :param kind: String - Failure kind (see cwretry)
+        :param error: String - Error description
+        :param delay: Float - Seconds before retry or None, if request is not retried
+        :return: Int - Dead letter id
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO letters (endpoint, data, kind, error, status, created_at, updated_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (endpoint, json.dumps(data), kind, str(error), DEAD if delay is None else RETRY, now, now,
+                 now + (delay or 0))
+            )
+        return cursor.lastrowid
+
+    def claim(self, limit=10):
+        """
+        Take requests, which are due for retry, and hide them from other processes for lease_timeout seconds.
+        :param limit: Int - Max count of requests
+        :return: List - Dead letters {"id", "endpoint", "data", "kind", "error", "attempts", ...}
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._connection.execute(
+                    "SELECT * FROM letters WHERE status = ? AND available_at <= ? ORDER BY available_at, id LIMIT ?",
+                    (RETRY, now, limit)
+                ).fetchall()
+                self._connection.executemany(
+                    "UPDATE letters SET available_at = ? WHERE id = ?", [(now + self.lease_timeout, row[0]) for row in rows]
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return [self._toDict(row) for row in rows]
+
+    def ack(self, letter_id):
+        """
+        Remove request, which is sent.
+        :param letter_id: Int - Dead letter id
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM letters WHERE id = ?", (letter_id,))
+
+    def fail(self, letter_id, kind, error, delay=None):
+        """
+        Schedule next retry of request or mark it as dead, if it is not retried or max_attempts is exceeded.
+        :param letter_id: Int - Dead letter id
+        :param kind: String - Failure kind
+        :param error: String - Error description
+        :param delay: Float - Seconds before retry or None, if request is not retried
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE letters SET attempts = attempts + 1, kind = ?, error = ?, updated_at = ?, available_at = ?, "
+                "status = CASE WHEN ? OR attempts + 1 >= ? THEN ? ELSE ? END WHERE id = ?",
+                (kind, str(error), now, now + (delay or 0), delay is None, self.max_attempts, DEAD, RETRY, letter_id)
+            )
+
+    def get(self, letter_id):
+        """
+        Get dead letter.
+        :param letter_id: Int - Dead letter id
+        :return: Dict - Dead letter or None, if it is not found
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM letters WHERE id = ?", (letter_id,)).fetchone()
+        return self._toDict(row) if row else None
+
+    def list(self, status=None, limit=50):
+        """
+        Get stored requests, newest first.
+        :param status: String - RETRY, DEAD or None for all
+        :param limit: Int - Max count of requests
+        :return: List - Dead letters
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM letters WHERE ? IS NULL OR status = ? ORDER BY id DESC LIMIT ?", (status, status, limit)
+            ).fetchall()
+        return [self._toDict(row) for row in rows]
+
+    def count(self):
+        """
+        Count stored requests by status.
+        :return: Dict - {"retry": count, "dead": count}
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM letters GROUP BY status").fetchall()
+        counts = {RETRY: 0, DEAD: 0}
+        counts.update(rows)
+        return counts
+
+    def redrive(self, letter_ids=None):
+        """
+        Schedule requests for immediate retry with reset attempts count.
+        :param letter_ids: List - Dead letter ids or None for all dead requests
+        :return: Int - Count of redriven requests
+        """
+        now = time.time()
+        with self._lock:
+            if letter_ids is None:
+                cursor = self._connection.execute(
+                    "UPDATE letters SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE status = ?",
+                    (RETRY, now, now, DEAD)
+                )
+            else:
+                cursor = self._connection.executemany(
+                    "UPDATE letters SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE id = ?",
+                    [(RETRY, now, now, letter_id) for letter_id in letter_ids]
+                )
+        return cursor.rowcount
+
+    def purge(self, letter_ids=None, status=None, before=None):
+        """
+        Remove stored requests.
+        :param letter_ids: List - Dead letter ids or None for all
+        :param status: String - Remove only requests with status (RETRY, DEAD or None for all)
+        :param before: Float - Remove only requests, created before timestamp
+        :return: Int - Count of removed requests
+        """
+        condition = "(? IS NULL OR status = ?) AND (? IS NULL OR created_at < ?)"
+        with self._lock:
+            if letter_ids is None:
+                cursor = self._connection.execute(
+                    "DELETE FROM letters WHERE " + condition, (status, status, before, before)
+                )
+            else:
+                cursor = self._connection.executemany(
+                    "DELETE FROM letters WHERE id = ? AND " + condition,
+                    [(letter_id, status, status, before, before) for letter_id in letter_ids]
+                )
+        return cursor.rowcount
@@ -4,6 +4,70 @@
 # Dependencies of Message class
 import re
 
+# Markdown constructions, converted to Chatwork format, in the same order and with the same result as
+# re.sub('!\[.*?\]\((.*?)\)'), re.sub('<img.*src="(.*?)".*>') and re.sub('```(.*?)(```|$)', re.DOTALL).
+# Image tags are found by str.find instead of these patterns, so unclosed tags can not make regex backtrack
+# over the whole line.
+# Code block ```code``` (or unclosed ```code till the end) -> [code]code[/code]
+CODE_PATTERN = re.compile(r'```(.*?)(```|$)', re.DOTALL)
+# Characters, which are used as cut border of too long message
+CUT_BORDERS = "\n 。　、"
+
+
+def _replaceMarkdownImages(text):
+    """
+    Replace Github image tags ![alt](src) with plain url. Alt ends at the first "](" of the line, src at the first ")".
+    :param text: String - Message body
+    :return: String - Message body with urls instead of image tags
+    """
+    parts = []
+    position = 0
+    start = text.find('![')
+    while start != -1:
+        line_end = text.find('\n', start)
+        if line_end == -1:
+            line_end = len(text)
+        alt_end = text.find('](', start + 2, line_end)
+        src_end = text.find(')', alt_end + 2, line_end) if alt_end != -1 else -1
+        if src_end == -1:
+            # Other tags of this line can not be closed either
+            start = text.find('![', line_end)
+            continue
+        parts.append(text[position:start])
+        parts.append(text[alt_end + 2:src_end])
+        position = src_end + 1
+        start = text.find('![', position)
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def _replaceHtmlImages(text):
+    """
+    Replace Github image tags <img ... src="src" ...> with plain url. Part of the line from the first "<img"
+    to the last ">" is replaced with the last src (Github puts original url into data-canonical-src after proxied src).
+    :param text: String - Message body
+    :return: String - Message body with urls instead of image tags
+    """
+    if '<img' not in text:
+        return text
+    lines = text.split('\n')
+    for index, line in enumerate(lines):
+        start = line.find('<img')
+        if start == -1:
+            continue
+        tag_end = line.rfind('>')
+        if tag_end < start:
+            continue
+        src = line.rfind('src="', start + 4, tag_end)
+        while src != -1:
+            quote = line.find('"', src + 5, tag_end)
+            if quote != -1:
+                lines[index] = line[:start] + line[src + 5:quote] + line[tag_end + 1:]
+                break
+            src = line.rfind('src="', start + 4, src)
+    return '\n'.join(lines)
+
+
 class ChatworkMessage:
     """
     Contains chatwork message data and methods for its transformation.
@@ -15,8 +79,16 @@ class ChatworkMessage:
     _body = ""
     # Addressee chatwork accounts list (example: [645385, 836492])
     _addressee_list = []
+    # Identifier of issue/PR/commit, which message is about (used to merge messages, see gccoalesce)
+    _thread_key = ""
+    # Title of issue/PR/commit, which message is about
+    _thread_title = ""
     # Chatwork message max length (to prevent flooding)
     _chatwork_message_max_len = 200
+    # Max count of raw body characters, which are formatted (the rest is dropped before formatting,
+    # so formatting cost does not depend on body size). Must be much larger than _chatwork_message_max_len,
+    # because formatting makes text shorter (image tags are replaced with urls).
+    _format_window = 8192
 
     def setTitle(self, title):
         """
@@ -42,6 +114,32 @@ class ChatworkMessage:
 
         self._addressee_list = addressee_list
 
+    def setThread(self, thread_key, thread_title):
+        """
+        Thread setter.
+        :param thread_key: String - Identifier of issue/PR/commit, which message is about (example: issue url)
+        :param thread_title: String - Title of issue/PR/commit
+        """
+
+        self._thread_key = thread_key
+        self._thread_title = thread_title
+
+    def getThreadKey(self):
+        """
+        Thread key getter.
+        :return: String - Identifier of issue/PR/commit, which message is about, or "" if not set.
+        """
+
+        return self._thread_key
+
+    def getThreadTitle(self):
+        """
+        Thread title getter.
+        :return: String - Title of issue/PR/commit, which message is about.
+        """
+
+        return self._thread_title
+
     def getRawBody(self):
         """
         Body getter.
@@ -70,25 +168,27 @@ class ChatworkMessage:
             addressee_string += '[To:' + str(addressee) + '] '
         return addressee_string
 
-    def _cutBody(self, body_contents):
+    def _cutBody(self, body_contents, truncated=False):
         """
         Cut message body to designated length and add "..." at the end.
         :param body_contents: String - Body (inner contents) of the message.
+        :param truncated: Bool - True if body is already truncated before formatting.
         :return: String - Trimmed inner content of the message
         """
         body_contents = str(body_contents)
 
         # adding dots at the end of contents if contents length too large
         dots = ''
-        if len(body_contents) > self._chatwork_message_max_len:
+        if truncated or len(body_contents) > self._chatwork_message_max_len:
             dots = '\n...'
 
         # Cut to chatwork_message_max_len.
         body_contents = body_contents[:self._chatwork_message_max_len]
-        # Use /n, whitespace,、 and 。as cut border.
-        trimmed_body_contents = "".join(re.split("([\n 。　、]+)", body_contents)[:-1])
-        if trimmed_body_contents and dots:
-            body_contents = trimmed_body_contents
+        # Use /n, whitespace,、 and 。as cut border (cut right after the last border).
+        if dots:
+            border = max(body_contents.rfind(char) for char in CUT_BORDERS)
+            if border > -1:
+                body_contents = body_contents[:border + 1]
         # Cut excessive newlines at the end
         body_contents = body_contents.strip('\n')
 
@@ -106,19 +206,26 @@ class ChatworkMessage:
         """
         body_contents = str(body_contents)
 
-        # Replace github image tag ![alt](src) with plain url
-        p = re.compile('!\[.*?\]\((.*?)\)')
-        body_contents = p.sub('\g<1>', body_contents)
+        # Drop everything, that can not get into message anyway
+        window = max(self._format_window, self._chatwork_message_max_len * 4)
+        truncated = len(body_contents) > window
+        if truncated:
+            body_contents = body_contents[:window]
 
-        # Replace github image tag <img> with plain url
-        p = re.compile('<img.*src="(.*?)".*>')
-        body_contents = p.sub('\g<1>', body_contents)
+        # Replace github image tags ![alt](src) and <img> with plain url (inside code blocks too), ``` with [code] tag
+        body_contents = _replaceMarkdownImages(body_contents)
+        body_contents = _replaceHtmlImages(body_contents)
+        body_contents = CODE_PATTERN.sub(r'[code]\g<1>[/code]', body_contents)
 
-        # Replace ``` with [code] tag
-        p = re.compile('```(.*?)(```|$)', re.DOTALL)
-        body_contents = p.sub('[code]\g<1>[/code]', body_contents)
+        return self._cutBody(body_contents, truncated)
 
-        return self._cutBody(body_contents)
+    def getFormattedSection(self):
+        """
+        Format title and body without addressee string and [info] tag (to be included into combined message).
+        :return: String - Compiled title and body.
+        """
+
+        return self._title + '\n' + self._formatBody(self._body)
 
     def getFormattedContents(self):
         """
@@ -129,3 +236,42 @@ class ChatworkMessage:
         return self._buildAddresseeString(self._addressee_list) + \
             '[info][title]' + self._title + '[/title]' + \
             self._formatBody(self._body) + '[/info]'
+
+
+class CombinedChatworkMessage(ChatworkMessage):
+    """
+    Several messages about the same issue/PR, merged into one [info] block.
+    Addressees of all messages are merged without duplicates.
+    """
+
+    # Merged messages (objects of class ChatworkMessage)
+    _messages = []
+
+    def __init__(self, messages):
+        """
+        :param messages: List - Objects of class ChatworkMessage with the same thread key
+        """
+        self._messages = list(messages)
+        self.setAddresseeList(list(dict.fromkeys(
+            addressee for message in self._messages for addressee in message.getAddresseeList()
+        )))
+        self.setThread(self._messages[0].getThreadKey(), self._messages[0].getThreadTitle())
+        self.setTitle(str(len(self._messages)) + ' updates: ' + self._thread_title)
+
+    def getRawBody(self):
+        """
+        Body getter.
+        :return: String - Raw bodies of merged messages.
+        """
+
+        return '\n\n'.join(message.getRawBody() for message in self._messages)
+
+    def getFormattedContents(self):
+        """
+        Format merged messages to a string, which will be sent to Chatwork later
+        :return: String - Compiled message contents.
+        """
+
+        return self._buildAddresseeString(self._addressee_list) + \
+            '[info][title]' + self._title + '[/title]' + \
+            '[hr]'.join(message.getFormattedSection() for message in self._messages) + '[/info]'
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Token bucket scheduler for outbound Chatwork requests.
+# Chatwork limits requests per token (API) and per account (UI), limit is shared by all web server processes,
+# worker and cron runs, so bucket state is kept in shared SQLite database (see configure()).
+# Without configure() requests are not paced.
+#
+# Bucket is refilled continuously (limit requests per period). Part of bucket (priority_reserve) can be spent
+# only by priority requests (messages with [To:] mentions), so they are still sent, when budget is tight.
+# Bucket is corrected by X-RateLimit-Remaining / X-RateLimit-Reset response headers of Chatwork API.
+#
+# Usage:
+#   cwratelimit.acquire("api:" + key, priority=True)
+#   response = ...
+#   cwratelimit.update("api:" + key, response.headers, response.status_code)
+
+import sqlite3
+import threading
+import time
+import cwretry
+import gcmetrics
+
+# Path to shared SQLite database ("" - requests are not paced)
+path = ""
+# Count of requests, allowed per period (Chatwork API: 300 requests per 5 minutes)
+limit = 300
+# Period in seconds
+period = 300
+# Share of bucket, which is reserved for priority requests
+priority_reserve = 0.2
+# Max seconds to wait for budget. Request is sent after this time anyway (Chatwork will answer 429, if limit is hit).
+max_wait = 60
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def configure(ratelimit_path, ratelimit_config):
+    """
+    Set shared database and apply "rate_limit" section of config.json.
+    :param ratelimit_path: String - Path to SQLite database file
+    :param ratelimit_config: Dict - Settings {"limit": 300, "period": 300, "priority_reserve": 0.2, "max_wait": 60}
+    """
+    global path, limit, period, priority_reserve, max_wait, _connection
+    limit = ratelimit_config.get("limit", 300)
+    period = ratelimit_config.get("period", 300)
+    priority_reserve = ratelimit_config.get("priority_reserve", 0.2)
+    max_wait = ratelimit_config.get("max_wait", 60)
+    with _connection_lock:
+        if ratelimit_path != path:
+            path = ratelimit_path
+            if _connection is not None:
+                _connection.close()
+            _connection = None
+
+
+def _connect():
+    """
+    Open shared database once per process (caller must hold _connection_lock).
+    :return: Object of class sqlite3.Connection
+    """
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, reset_at REAL NOT NULL DEFAULT 0)"
+        )
+    return _connection
+
+
+def _refill(row, now):
+    """
+    Calculate current bucket state.
+    :param row: Tuple - Stored bucket (tokens, updated_at, reset_at) or None
+    :param now: Float - Current time
+    :return: Tuple - (tokens, reset_at)
+    """
+    if row is None:
+        return float(limit), 0.0
+    tokens, updated_at, reset_at = row
+    if reset_at:
+        # Budget is exhausted according to Chatwork, wait for reset
+        if now < reset_at:
+            return tokens, reset_at
+        return float(limit), 0.0
+    return min(float(limit), tokens + (now - updated_at) * limit / period), 0.0
+
+
+def _take(key, priority):
+    """
+    Take one token from bucket, if budget allows.
+    :param key: String - Bucket key
+    :param priority: Bool - Request is allowed to use reserved part of bucket
+    :return: Float - 0 if token is taken, otherwise seconds to wait before next try
+    """
+    now = time.time()
+    with _connection_lock:
+        connection = _connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated_at, reset_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, reset_at = _refill(row, now)
+            required = 1.0 if priority else 1.0 + limit * priority_reserve
+            if tokens >= required:
+                tokens -= 1
+                wait = 0.0
+            elif reset_at:
+                wait = reset_at - now
+            else:
+                wait = (required - tokens) * period / limit
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, reset_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, reset_at)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    return wait
+
+
+def acquire(key, priority=False, request_deadline=None):
+    """
+    Wait until request is allowed by bucket (but not longer than max_wait).
+    :param key: String - Bucket key (for example, "api:<token hash>" or "ui:<login id>")
+    :param priority: Bool - Request is important (message with [To:] mentions)
+    :param request_deadline: Float - Timestamp of request deadline (see cwretry.getDeadline())
+    :return: Float - Seconds waited
+    :raise cwretry.ChatworkError: RATE_LIMIT, if budget is not restored before request deadline
+    """
+    if not path:
+        return 0.0
+
+    start = time.time()
+    wait_limit = max_wait if request_deadline is None else min(max_wait, request_deadline - start)
+    while True:
+        try:
+            wait = _take(key, priority)
+        except sqlite3.Error:
+            # Pacing must not prevent messages from being sent
+            return time.time() - start
+        waited = time.time() - start
+        if not wait:
+            break
+        if waited >= wait_limit:
+            if wait_limit < max_wait:
+                gcmetrics.observe("gcbot_chatwork_ratelimit_wait_seconds", waited, {"priority": str(bool(priority)).lower()})
+                raise cwretry.ChatworkError(cwretry.RATE_LIMIT, 'Rate limit budget of ' + key + ' is not restored before request deadline')
+            break
+        time.sleep(max(0.0, min(wait, wait_limit - waited, 5)))
+
+    gcmetrics.observe("gcbot_chatwork_ratelimit_wait_seconds", waited, {"priority": str(bool(priority)).lower()})
+    return waited
+
+
+def tryAcquire(key, priority=False):
+    """
+    Take request budget only if it is available now (for choosing between several accounts).
+    :param key: String - Bucket key
+    :param priority: Bool - Request is important (message with [To:] mentions)
+    :return: Bool - True if budget is taken
+    """
+    if not path:
+        return True
+    try:
+        return not _take(key, priority)
+    except sqlite3.Error:
+        return True
+
+
+def update(key, headers, status_code=200):
+    """
+    Correct bucket by Chatwork response headers.
+    :param key: String - Bucket key
+    :param headers: Dict - Response headers (X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Reset)
+    :param status_code: Int - Response status code (429 means that budget is exhausted)
+    """
+    if not path:
+        return
+
+    try:
+        remaining = float(headers.get("X-RateLimit-Remaining", ""))
+    except ValueError:
+        remaining = None
+    try:
+        reset = float(headers.get("X-RateLimit-Reset", ""))
+    except ValueError:
+        reset = 0.0
+    if remaining is None and status_code != 429:
+        return
+
+    now = time.time()
+    if status_code == 429:
+        remaining = 0.0
+    # Without reset time wait for one refilled token
+    reset_at = max(reset, now + float(period) / limit) if not remaining else 0.0
+
+    try:
+        with _connection_lock:
+            connection = _connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT tokens, updated_at, reset_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, current_reset_at = _refill(row, now)
+                # Other processes may have already spent part of remaining budget
+                tokens = min(tokens, remaining)
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, reset_at) VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, reset_at or current_reset_at)
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+    except sqlite3.Error:
+        pass
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Retries of outbound Chatwork requests.
+# Failure is classified (timeout, connection, server, rate_limit, auth, client, error) and transient failures
+# (timeout, connection, server, rate_limit) are retried with jittered exponential backoff. Retries inside
+# the request are limited by max_wait seconds in total, so transient Chatwork blip does not hold up worker.
+# Whole request (rate limit waits, tries of every account, retries and transport timeouts) is bounded by
+# one deadline (see getDeadline()): request, which is not sent before it, fails with TIMEOUT kind.
+# Request, which is still not sent, is moved to dead letter store (see cwdeadletter.py): transient failures are
+# scheduled for later retry (worker.py sends due requests), other failures are kept for inspection
+# and manual redrive (see deadletter.py). Without configure() requests are retried, but not stored.
+#
+# Usage:
+#   deadline = cwretry.getDeadline()
+#   try:
+#       response = cwretry.call(lambda: send(endpoint, data, deadline), deadline)
+#   except Exception as e:
+#       cwretry.deadLetter(endpoint, data, cwretry.classify(e), repr(e))
+
+import random
+import sys
+import threading
+import time
+import cwdeadletter
+import gcmetrics
+
+# Failure kinds
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER = "server"
+RATE_LIMIT = "rate_limit"
+AUTH = "auth"
+CLIENT = "client"
+ERROR = "error"
+# Failure kinds, which are retried
+RETRYABLE = (TIMEOUT, CONNECTION, SERVER, RATE_LIMIT)
+
+# Count of attempts inside request (1 - request is not retried)
+max_attempts = 3
+# Backoff base in seconds (delay before retry N is random value between 0 and base_delay * 2 ^ N)
+base_delay = 1
+# Max backoff delay in seconds
+max_delay = 300
+# Max seconds, spent on retries inside request. Retry, which does not fit, is scheduled in dead letter store.
+max_wait = 10
+# Max seconds, spent on request in total (must be shorter than lease of delivery queue)
+deadline = 60
+# Path to dead letter store ("" - failed requests are not stored)
+dead_letter_path = ""
+# Count of scheduled attempts, after which request is not retried anymore
+dead_letter_max_attempts = 10
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class ChatworkError(Exception):
+    """
+    Chatwork request failed with known failure kind.
+    """
+
+    def __init__(self, kind, message):
+        """
+        :param kind: String - Failure kind (see RETRYABLE)
+        :param message: String - Error description
+        """
+        super().__init__(message)
+        self.kind = kind
+
+
+def configure(path, retry_config):
+    """
+    Set dead letter store and apply "retry" section of config.json.
+    :param path: String - Path to SQLite database file of dead letter store
+    :param retry_config: Dict - Settings {"active": true, "max_attempts": 3, "base_delay": 1, "max_delay": 300,
+                         "max_wait": 10, "deadline": 60, "dead_letter_max_attempts": 10}
+    """
+    global max_attempts, base_delay, max_delay, max_wait, deadline, dead_letter_path, dead_letter_max_attempts, _store
+    active = retry_config.get("active", True)
+    max_attempts = retry_config.get("max_attempts", 3) if active else 1
+    base_delay = retry_config.get("base_delay", 1)
+    max_delay = retry_config.get("max_delay", 300)
+    max_wait = retry_config.get("max_wait", 10)
+    deadline = retry_config.get("deadline", 60)
+    dead_letter_max_attempts = retry_config.get("dead_letter_max_attempts", 10)
+    if not active:
+        path = ""
+    if path != dead_letter_path:
+        dead_letter_path = path
+        _store = None
+
+
+def getDeadLetterStore():
+    """
+    Open dead letter store once per process.
+    :return: Object of class DeadLetterStore or None, if store is not configured
+    """
+    global _store
+    if not dead_letter_path:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = cwdeadletter.DeadLetterStore(dead_letter_path, dead_letter_max_attempts)
+        return _store
+
+
+def getDeadline():
+    """
+    Get deadline of request, which starts now.
+    :return: Float - Timestamp
+    """
+    return time.time() + deadline
+
+
+def getRemaining(request_deadline):
+    """
+    Get time, which is left before request deadline.
+    :param request_deadline: Float - Timestamp, returned by getDeadline()
+    :return: Float - Seconds
+    :raise ChatworkError: TIMEOUT, if deadline is passed
+    """
+    remaining = request_deadline - time.time()
+    if remaining <= 0:
+        raise ChatworkError(TIMEOUT, 'Request deadline is exceeded')
+    return remaining
+
+
+def classify(exception):
+    """
+    Get failure kind of exception, raised by Chatwork request.
+    :param exception: Object of class Exception
+    :return: String - Failure kind
+    """
+    if isinstance(exception, ChatworkError):
+        return exception.kind
+    # requests module is imported by transport only when request is sent
+    requests = sys.modules.get("requests")
+    if requests is not None:
+        if isinstance(exception, requests.exceptions.Timeout):
+            return TIMEOUT
+        if isinstance(exception, requests.exceptions.ConnectionError):
+            return CONNECTION
+        if isinstance(exception, requests.exceptions.HTTPError) and exception.response is not None:
+            status_code = exception.response.status_code
+            if status_code == 429:
+                return RATE_LIMIT
+            if status_code == 401:
+                return AUTH
+            if status_code >= 500:
+                return SERVER
+            return CLIENT
+    if isinstance(exception, TimeoutError):
+        return TIMEOUT
+    if isinstance(exception, ConnectionError):
+        return CONNECTION
+    return ERROR
+
+
+def getRetryAfter(exception):
+    """
+    Get delay, requested by Chatwork (Retry-After or X-RateLimit-Reset header of response).
+    :param exception: Object of class Exception
+    :return: Float - Seconds or 0, if delay is not requested
+    """
+    response = getattr(exception, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, float(response.headers.get("X-RateLimit-Reset", "")) - time.time())
+    except ValueError:
+        return 0.0
+
+
+def getDelay(attempt, minimum=0.0):
+    """
+    Get backoff delay before retry ("full jitter": random value up to exponentially growing limit,
+    so retries of several processes do not hit Chatwork at the same moment).
+    :param attempt: Int - Count of failed attempts
+    :param minimum: Float - Delay, requested by Chatwork
+    :return: Float - Seconds
+    """
+    return max(minimum, random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def call(function, request_deadline=None):
+    """
+    Call function, which sends Chatwork request, and retry it on transient failures.
+    :param function: Callable - Function without arguments
+    :param request_deadline: Float - Timestamp, after which request is not retried (see getDeadline())
+    :return: Any - Function result
+    :raise Exception: Last exception of function, if request is not sent
+    """
+    waited = 0.0
+    attempt = 1
+    while True:
+        try:
+            return function()
+        except Exception as e:
+            kind = classify(e)
+            if kind not in RETRYABLE or attempt >= max_attempts:
+                raise
+            delay = getDelay(attempt, getRetryAfter(e))
+            if waited + delay > max_wait or (request_deadline is not None and time.time() + delay >= request_deadline):
+                raise
+        gcmetrics.inc("gcbot_chatwork_retries_total", {"kind": kind})
+        time.sleep(delay)
+        waited += delay
+        attempt += 1
+
+
+def deadLetter(endpoint, data, kind, error):
+    """
+    Move request, which is not sent, to dead letter store.
+    Request with transient failure is scheduled for retry, others are kept for manual redrive.
+    :param endpoint: String - Chatwork API endpoint (for example, "/rooms/12345/messages")
+    :param data: Dict - Request data
+    :param kind: String - Failure kind
+    :param error: String - Error description
+    :return: Int - Dead letter id or None, if store is not configured
+    """
+    store = getDeadLetterStore()
+    if store is None:
+        return None
+    gcmetrics.inc("gcbot_chatwork_dead_letters_total", {"kind": kind})
+    return store.put(endpoint, data, kind, error, getDelay(max_attempts) if kind in RETRYABLE else None)
+
+
+def retryDeadLetters(send, limit=10):
+    """
+    Send scheduled requests of dead letter store, which are due.
+    :param send: Callable - Function (endpoint, data), which sends request and raises exception on failure
+    :param limit: Int - Max count of sent requests
+    :return: Tuple - (count of sent requests, count of failed requests)
+    """
+    store = getDeadLetterStore()
+    if store is None:
+        return 0, 0
+    sent = failed = 0
+    for letter in store.claim(limit):
+        try:
+            send(letter["endpoint"], letter["data"])
+        except Exception as e:
+            kind = classify(e)
+            delay = getDelay(max_attempts + letter["attempts"], getRetryAfter(e)) if kind in RETRYABLE else None
+            store.fail(letter["id"], kind, repr(e), delay)
+            failed += 1
+        else:
+            store.ack(letter["id"])
+            sent += 1
+    return sent, failed
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of SessionStore class
+import contextlib
+import fcntl
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Stored session values
+SESSION_KEYS = ("cwssid", "AWSELB", "access_token")
+
+
+class SessionStore:
+    """
+    Store of Chatwork UI sessions (cookies and access token) per login account, shared by all processes.
+
+    Sessions are kept in SQLite database (WAL mode): every update is one atomic transaction, so concurrent
+    processes never see partially written or empty store. Read sessions are cached in memory of the process,
+    so warm process does not read disk until session is changed by itself or reloaded (see reload()).
+    Every update increments session version, so process can find out, that other process has already
+    replaced expired session.
+    """
+
+    # Path to SQLite database file
+    path = ""
+
+    def __init__(self, path):
+        """
+        Open (and create if needed) session database.
+        :param path: String - Path to SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # Re-authentication locks in format {"login id": threading.Lock, ...}
+        self._account_locks = {}
+        # Cached sessions in format {"login id": {"cwssid", "AWSELB", "access_token", "version"}, ...}
+        self._cache = {}
+        # Legacy store is already checked by this process
+        self._legacy_imported = False
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "account TEXT PRIMARY KEY, cwssid TEXT NOT NULL DEFAULT '', awselb TEXT NOT NULL DEFAULT '', "
+            "access_token TEXT NOT NULL DEFAULT '', version INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+
+    def get(self, account):
+        """
+        Get session of account (from memory, if it is already read by this process).
+        :param account: String - Login account id
+        :return: Dict - Session {"cwssid", "AWSELB", "access_token", "version"} (values are empty if not stored)
+        """
+        with self._lock:
+            session = self._cache.get(account)
+        if session is None:
+            session = self.reload(account)
+        return dict(session)
+
+    def reload(self, account):
+        """
+        Read session of account from database (for example, when cached session is expired).
+        :param account: String - Login account id
+        :return: Dict - Session {"cwssid", "AWSELB", "access_token", "version"}
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT cwssid, awselb, access_token, version FROM sessions WHERE account = ?", (str(account),)
+            ).fetchone()
+            session = dict(zip(SESSION_KEYS + ("version",), row or ("", "", "", 0)))
+            self._cache[account] = session
+        return dict(session)
+
+    def update(self, account, values):
+        """
+        Save session values of account.
+        :param account: String - Login account id
+        :param values: Dict - Changed values (keys from SESSION_KEYS)
+        :return: Dict - Updated session
+        """
+        values = {key: values[key] for key in SESSION_KEYS if key in values}
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT INTO sessions (account, updated_at) VALUES (?, ?) ON CONFLICT (account) DO NOTHING",
+                    (str(account), time.time())
+                )
+                self._connection.execute(
+                    "UPDATE sessions SET " + "".join(
+                        ("awselb" if key == "AWSELB" else key) + " = ?, " for key in values
+                    ) + "version = version + 1, updated_at = ? WHERE account = ?",
+                    tuple(values.values()) + (time.time(), str(account))
+                )
+                row = self._connection.execute(
+                    "SELECT cwssid, awselb, access_token, version FROM sessions WHERE account = ?", (str(account),)
+                ).fetchone()
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            session = dict(zip(SESSION_KEYS + ("version",), row))
+            self._cache[account] = session
+        return dict(session)
+
+    @contextlib.contextmanager
+    def lock(self, account):
+        """
+        Exclusive lock of account session (for re-authentication): only one thread of the process
+        and only one process of the host hold it at the same time (lock file is locked with flock).
+        Usage: with store.lock(account): ...
+        :param account: String - Login account id
+        """
+        with self._lock:
+            account_lock = self._account_locks.setdefault(account, threading.Lock())
+        with account_lock:
+            lock_path = self.path + "." + re.sub(r'[^0-9A-Za-z_-]', '_', str(account)) + ".lock"
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def importLegacyStore(self, account, legacy_path):
+        """
+        Import session from legacy cwui.db file (json, written by pickledb), if account has no session yet.
+        Legacy store is checked once per process.
+        :param account: String - Login account id
+        :param legacy_path: String - Path to legacy store
+        """
+        with self._lock:
+            if self._legacy_imported:
+                return
+            self._legacy_imported = True
+        if not os.path.exists(legacy_path) or self.get(account)["version"]:
+            return
+        try:
+            with open(legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except (IOError, ValueError):
+            return
+        if isinstance(legacy, dict) and legacy.get("cwssid"):
+            self.update(account, {key: str(legacy.get(key) or "") for key in SESSION_KEYS})
+
+
+# Opened stores in format {"database path": SessionStore, ...}
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def getSessionStore(path):
+    """
+    Open session store once per process.
+    :param path: String - Path to SQLite database file
+    :return: Object of class SessionStore
+    """
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SessionStore(path)
+        return _stores[path]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Shared HTTP transport for Chatwork UI, Chatwork API and Github requests.
+# Keeps one keep-alive requests.Session (connection pool) per host, so TCP+TLS handshake is done once per process
+# and reused across messages, rooms and tasks. Sessions do not store cookies: every caller passes its own cookies,
+# so accounts can not leak into each other's requests.
+# requests module is imported with the first session, so processes, which do not send requests
+# (for example, webhook entry point in delivery queue mode), do not spend time on its import.
+
+import threading
+import urllib.parse
+
+# Max count of kept-alive connections per host
+pool_size = 10
+# Default request timeout in seconds (connect and read), used if caller does not define it
+default_timeout = 30
+
+# Sessions in dictionary format {"host": requests.Session, ...}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def configure(http_config):
+    """
+    Apply "http" section of config.json. Affects sessions, created after this call.
+    :param http_config: Dict - Transport settings {"pool_size": 10, "timeout": 30}
+    """
+    global pool_size, default_timeout
+    pool_size = http_config.get("pool_size", pool_size)
+    default_timeout = http_config.get("timeout", default_timeout)
+
+
+def getSession(url):
+    """
+    Get pooled session for host of the url (session is created on first call).
+    :param url: String - Request url
+    :return: Object of class requests.Session
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        if host not in _sessions:
+            import http.cookiejar
+            import requests
+            import requests.adapters
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            # Do not keep response cookies inside shared session
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send request through pooled session.
+    :param method: String - HTTP method ("GET", "POST", ...)
+    :param url: String - Request url
+    :param timeout: Int - Request timeout in seconds (default_timeout if not specified)
+    :param kwargs: Any - Other arguments of requests.Session.request (data, headers, cookies etc)
+    :return: Object of class requests.Response
+    """
+    if timeout is None:
+        timeout = default_timeout
+    return getSession(url).request(method, url, timeout=timeout, **kwargs)
+
+
+def close():
+    """
+    Close all pooled connections (for long-running processes on shutdown).
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
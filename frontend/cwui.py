@@ -7,9 +7,10 @@ import socket
 import json
 import logging
 import re
-import requests
-import pickledb
 import os
+import cwsession
+import cwtransport
+import gcmetrics
 
 
 class ChatworkUI:
@@ -25,6 +26,8 @@ class ChatworkUI:
     cookies = {}
     # Access token (GET parameter "_t")
     access_token = ""
+    # Version of stored session, which cookies and access_token belong to
+    session_version = 0
     # Request timeout in seconds
     request_timeout = 10
     # Login account email
@@ -33,37 +36,69 @@ class ChatworkUI:
     login_id = ""
     # Login password
     login_password = ""
-    # Storage exemplar
-    storage = ""
-
-    def __init__(self, login_email, login_id, login_password, logging=True):
+    # Session store exemplar (object of class SessionStore), shared by all instances of the process
+    storage = None
+    # Path to session store, shared by all processes
+    storage_path = os.path.normpath(os.path.dirname(__file__) + '/../logs/cwui_sessions.db')
+    # Path to legacy pickledb store (its session is imported once)
+    legacy_storage_path = os.path.dirname(__file__) + '/cwui.db'
+
+    def __init__(self, login_email, login_id, login_password, logging=True, legacy=False):
         """
         Initialize class properties
         :param login_email: String - Login account email
         :param login_id: Int - Login account ID
         :param login_password: String - Login password
+        :param legacy: Bool - Account is top-level "ui" account of config.json, its session may be in legacy store
         :return: void
         """
         self.logging = logging
         self.login_email = login_email
         self.login_id = login_id
         self.login_password = login_password
+        self.cookies = {}
 
-        # Get cookies and access_token from external storage.
-        # If external storage is empty or values expired, it will be requested from Chatwork later.
-        self.storage = pickledb.load(os.path.dirname(__file__) + '/cwui.db', True)
-        if self.storage.get("cwssid"):
-            self.cookies["cwssid"] = self.storage.get("cwssid")
-        if self.storage.get("AWSELB"):
-            self.cookies["AWSELB"] = self.storage.get("AWSELB")
-        if self.storage.get("access_token"):
-            self.access_token = self.storage.get("access_token")
+        # Get cookies and access_token from session store (warm process takes them from memory).
+        # If store is empty or values expired, it will be requested from Chatwork later.
+        self.storage = cwsession.getSessionStore(self.storage_path)
+        if legacy:
+            self.storage.importLegacyStore(self.login_id, self.legacy_storage_path)
+        self._applySession(self.storage.get(self.login_id))
 
         # Request cookies and access_token from Chatwork
-        if not self.cookies:
-            if not self._login():
-                self._log("Login failed!", 'CRITICAL')
-        if not self.access_token:
+        if not self.cookies or not self.access_token:
+            self._authenticate()
+
+    def _applySession(self, session):
+        """
+        Use cookies and access_token of stored session.
+        :param session: Dict - Session, returned by SessionStore
+        """
+        self.cookies = {}
+        if session["cwssid"]:
+            self.cookies["cwssid"] = session["cwssid"]
+        if session["AWSELB"]:
+            self.cookies["AWSELB"] = session["AWSELB"]
+        self.access_token = session["access_token"]
+        self.session_version = session["version"]
+
+    def _authenticate(self):
+        """
+        Replace expired session (single-flight): only one caller per account logs in, while others wait
+        for the lock and reuse the session, stored by it.
+        """
+        expired_version = self.session_version
+        with self.storage.lock(self.login_id):
+            session = self.storage.reload(self.login_id)
+            if session["version"] != expired_version and session["cwssid"] and session["access_token"]:
+                # Session is already replaced by other thread or process
+                self._applySession(session)
+                return
+            if not session["cwssid"] or session["version"] == expired_version:
+                if not self._login():
+                    self._log("Login failed!", 'CRITICAL')
+            else:
+                self._applySession(session)
             if not self._getAccessToken():
                 self._log("ACCESS_TOKEN not found!", 'CRITICAL')
 
@@ -84,10 +119,11 @@ class ChatworkUI:
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.10; rv:45.0) Gecko/20100101 Firefox/45.0"
         }
 
+        # Connections are pooled and kept alive by cwtransport (one pool per host)
         if post_parameters:
-            req = requests.post(self.url + query_string, post_parameters, headers=headers, cookies=self.cookies, allow_redirects=False, timeout=self.request_timeout)
+            req = cwtransport.request("POST", self.url + query_string, self.request_timeout, data=post_parameters, headers=headers, cookies=self.cookies, allow_redirects=False)
         else:
-            req = requests.get(self.url + query_string, headers=headers, cookies=self.cookies, allow_redirects=False, timeout=self.request_timeout)
+            req = cwtransport.request("GET", self.url + query_string, self.request_timeout, headers=headers, cookies=self.cookies, allow_redirects=False)
         return req
 
     def _login(self):
@@ -103,16 +139,13 @@ class ChatworkUI:
             "password": self.login_password
         }
 
-        req = self._request("/login.php?lang=ja&args=", post)
+        with gcmetrics.timer("gcbot_chatwork_login_duration_seconds", {"step": "login"}):
+            req = self._request("/login.php?lang=ja&args=", post)
 
-        try:
-            req.cookies["cwssid"]
-        except IndexError:
+        if not req.cookies.get("cwssid"):
             self._log("Login failed: can't get cwssid cookie", 'INFO')
             return False
-        try:
-            req.cookies["AWSELB"]
-        except IndexError:
+        if not req.cookies.get("AWSELB"):
             self._log("Login failed: can't get AWSELB cookie", 'INFO')
             return False
 
@@ -121,8 +154,10 @@ class ChatworkUI:
             "AWSELB": req.cookies["AWSELB"]
         }
 
-        self.storage.set('cwssid', req.cookies["cwssid"])
-        self.storage.set('AWSELB', req.cookies["AWSELB"])
+        # New cookies invalidate access token of previous session
+        session = self.storage.update(self.login_id, {"cwssid": req.cookies["cwssid"], "AWSELB": req.cookies["AWSELB"], "access_token": ""})
+        self.access_token = ""
+        self.session_version = session["version"]
 
         return self.cookies
 
@@ -131,13 +166,14 @@ class ChatworkUI:
         Parse ACCESS_TOKEN from page content
         :return: String - ACCESS_TOKEN or False if failed
         """
-        req = self._request("")
+        with gcmetrics.timer("gcbot_chatwork_login_duration_seconds", {"step": "access_token"}):
+            req = self._request("")
         response_data = req.text
         if response_data:
             match = re.search("ACCESS_TOKEN = '([a-z0-9]+)'", response_data)
             if match:
                 self.access_token = match.group(1)
-                self.storage.set('access_token', self.access_token)
+                self.session_version = self.storage.update(self.login_id, {"access_token": self.access_token})["version"]
                 return self.access_token
 
         self._log("Request failed: ACCESS_TOKEN not found", 'INFO')
@@ -159,8 +195,9 @@ class ChatworkUI:
         Send message with [text] content to [room_id] room
         :param text: String - Message content
         :param room_id: Int - Room id, to which post will be send.
-        :param tries: Int - Message post tries before False is returned.
+        :param tries: Int - Message post tries (with new session, if session is expired) before False is returned.
         :return: Bool - True if message post is succeeded or False otherwise.
+        :raise requests.HTTPError: on server errors and rate limit (request is retried by caller, see cwretry)
         """
 
         # last_chat_id is dummy (better to be real last sended message id, though it is not necessary for post)
@@ -176,21 +213,19 @@ class ChatworkUI:
             "pdata": json.dumps(pdata)
         }
 
-        response = self.request("/gateway.php?cmd=send_chat&myid=" + self.login_id + "&_v=1.80a&_av=4&ln=ja", post)
-        response_json = json.loads(response)
-
-        if response_json["status"]["success"]:
-            return True
-        if response_json["status"]["message"] == "NO LOGIN":
-            # Cookies expired, try to login again
-            if not self._login():
-                self._log("Login failed!", 'CRITICAL')
-            if not self._getAccessToken():
-                self._log("ACCESS_TOKEN not found!", 'CRITICAL')
-
-        tries -= 1
-        if tries:
-            return self.message(text, room_id, tries)
+        for _ in range(tries):
+            response = self._request("/gateway.php?cmd=send_chat&myid=" + self.login_id + "&_v=1.80a&_av=4&ln=ja&_t=" + self.access_token, post)
+            if response.status_code == 429 or response.status_code >= 500:
+                response.raise_for_status()
+            response_json = json.loads(response.text)
+
+            if response_json["status"]["success"]:
+                return True
+            if response_json["status"]["message"] != "NO LOGIN":
+                self._log("Message post failed: " + str(response_json["status"]["message"]), 'INFO')
+                return False
+            # Session expired: login again or wait for caller, which is already logging in, and retry with new session
+            self._authenticate()
 
         return False
 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dead letter store tool: Chatwork requests, which were not sent (see cwretry.py).
+# Use these commands in script root directory:
+#   python3 frontend/deadletter.py list [--status dead|retry] [--limit 50]   - show stored requests
+#   python3 frontend/deadletter.py show ID                                   - show request data and last error
+#   python3 frontend/deadletter.py redrive [ID ...]                          - send requests again (all dead, if ID is not set)
+#   python3 frontend/deadletter.py retry                                     - send requests, which are due for retry
+#   python3 frontend/deadletter.py purge (ID ... | --all) [--status dead|retry] [--older-than DAYS] - remove requests
+# Requests, scheduled for retry, are sent by worker.py automatically. If delivery queue is not used,
+# add "retry" command to crontab.
+
+import argparse
+import json
+import gcbot
+import cwdeadletter
+import cwretry
+import cwtransport
+import gcconfig
+import gclog
+import os
+import time
+
+here = os.path.dirname(__file__)
+config_path = os.path.normpath(here+'/../config.json')
+root_path = os.path.normpath(here+'/../')
+log_path = os.path.join(here, '../logs/log.txt')
+
+
+def loadConfig():
+    """
+    Load config and apply settings of Chatwork requests (transport, rate limit, retries).
+    :return: Object of class ConfigSnapshot
+    """
+    config = gcconfig.loadConfig(config_path)
+    gclog.configure(log_path, config.get("log", {}))
+    cwtransport.configure(config.get("http", {}))
+    gcconfig.configureRateLimit(root_path, config)
+    gcconfig.configureRetry(root_path, config)
+    return config
+
+
+def formatLetter(letter):
+    """
+    Format dead letter as one line.
+    :param letter: Dict - Dead letter
+    :return: String
+    """
+    return "%d\t%s\t%s\t%s\tattempts: %d\t%s" % (
+        letter["id"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(letter["created_at"])), letter["status"],
+        letter["kind"], letter["attempts"], letter["endpoint"]
+    )
+
+
+def send(config, limit):
+    """
+    Send requests, which are due for retry.
+    :param config: Object of class ConfigSnapshot
+    :param limit: Int - Max count of sent requests
+    :return: String - Result
+    """
+    botInstance = gcbot.GithubChatworkBot()
+    botInstance.setConfig(config)
+    sent, failed = cwretry.retryDeadLetters(botInstance.strictChatworkRequest, limit)
+    return "Sent: " + str(sent) + ", failed: " + str(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dead letter store of Chatwork requests")
+    commands = parser.add_subparsers(dest="command")
+    list_parser = commands.add_parser("list", help="show stored requests")
+    list_parser.add_argument("--status", choices=(cwdeadletter.RETRY, cwdeadletter.DEAD))
+    list_parser.add_argument("--limit", type=int, default=50)
+    show_parser = commands.add_parser("show", help="show request data and last error")
+    show_parser.add_argument("id", type=int)
+    redrive_parser = commands.add_parser("redrive", help="send requests again")
+    redrive_parser.add_argument("ids", type=int, nargs="*")
+    commands.add_parser("retry", help="send requests, which are due for retry")
+    purge_parser = commands.add_parser("purge", help="remove requests")
+    purge_parser.add_argument("ids", type=int, nargs="*")
+    purge_parser.add_argument("--all", action="store_true")
+    purge_parser.add_argument("--status", choices=(cwdeadletter.RETRY, cwdeadletter.DEAD))
+    purge_parser.add_argument("--older-than", type=float, metavar="DAYS")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return ""
+
+    gclog.configure(log_path, {})
+
+    config = loadConfig()
+    store = cwretry.getDeadLetterStore()
+    if store is None:
+        return "Dead letter store is disabled in config"
+
+    if args.command == "list":
+        counts = store.count()
+        lines = [formatLetter(letter) for letter in store.list(args.status, args.limit)]
+        lines.append("Scheduled for retry: " + str(counts[cwdeadletter.RETRY]) + ", dead: " + str(counts[cwdeadletter.DEAD]))
+        return "\n".join(lines)
+
+    if args.command == "show":
+        letter = store.get(args.id)
+        if letter is None:
+            return "Dead letter " + str(args.id) + " is not found"
+        return formatLetter(letter) + "\nError: " + letter["error"] + "\nData: " + json.dumps(letter["data"], ensure_ascii=False, indent=2)
+
+    if args.command == "redrive":
+        redriven = store.redrive(args.ids or None)
+        return "Redriven: " + str(redriven) + ". " + send(config, max(redriven, 1))
+
+    if args.command == "retry":
+        return send(config, store.count()[cwdeadletter.RETRY])
+
+    if args.command == "purge":
+        if not args.ids and not args.all:
+            return "Define dead letter ids or --all"
+        before = time.time() - args.older_than * 86400 if args.older_than is not None else None
+        return "Removed: " + str(store.purge(args.ids or None, args.status, before))
+
+if __name__ == "__main__":
+    print(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Delivery queue tool: webhook deliveries, which worker.py failed to process max_attempts times (see gcqueue.py).
+# Use these commands in script root directory:
+#   python3 frontend/deliveries.py list [--limit 50]                      - show failed deliveries
+#   python3 frontend/deliveries.py show ID                                - show delivery payload and last error
+#   python3 frontend/deliveries.py requeue [ID ...]                       - return deliveries to queue (all failed, if ID is not set)
+#   python3 frontend/deliveries.py purge (ID ... | --all) [--older-than DAYS] - remove failed deliveries
+# Failed deliveries older than "failed_retention_days" are removed by worker.py automatically.
+
+import argparse
+import gcconfig
+import gclog
+import gcqueue
+import os
+import time
+
+here = os.path.dirname(__file__)
+config_path = os.path.normpath(here+'/../config.json')
+root_path = os.path.normpath(here+'/../')
+log_path = os.path.join(here, '../logs/log.txt')
+
+
+def formatDelivery(delivery):
+    """
+    Format delivery as one line.
+    :param delivery: Dict - Delivery
+    :return: String
+    """
+    return "%d\t%s\t%s\tattempts: %d\t%s" % (
+        delivery["id"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(delivery["created_at"])),
+        delivery["event"] or "-", delivery["attempts"], delivery["last_error"].strip().split("\n")[-1]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Failed deliveries of delivery queue")
+    commands = parser.add_subparsers(dest="command")
+    list_parser = commands.add_parser("list", help="show failed deliveries")
+    list_parser.add_argument("--limit", type=int, default=50)
+    show_parser = commands.add_parser("show", help="show delivery payload and last error")
+    show_parser.add_argument("id", type=int)
+    requeue_parser = commands.add_parser("requeue", help="return deliveries to queue")
+    requeue_parser.add_argument("ids", type=int, nargs="*")
+    purge_parser = commands.add_parser("purge", help="remove failed deliveries")
+    purge_parser.add_argument("ids", type=int, nargs="*")
+    purge_parser.add_argument("--all", action="store_true")
+    purge_parser.add_argument("--older-than", type=float, metavar="DAYS")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return ""
+
+    gclog.configure(log_path, {})
+
+    config = gcconfig.loadConfig(config_path)
+    queue_config = config.get("delivery_queue", {})
+    queue = gcqueue.DeliveryQueue(
+        os.path.join(root_path, queue_config.get("path", "logs/queue.db")),
+        queue_config.get("lease_timeout", 300),
+        queue_config.get("max_attempts", 5)
+    )
+
+    if args.command == "list":
+        counts = queue.count()
+        lines = [formatDelivery(delivery) for delivery in queue.listFailed(args.limit)]
+        lines.append("Pending: " + str(counts[queue.PENDING]) + ", failed: " + str(counts[queue.FAILED]))
+        return "\n".join(lines)
+
+    if args.command == "show":
+        delivery = queue.get(args.id)
+        if delivery is None:
+            return "Delivery " + str(args.id) + " is not found"
+        return formatDelivery(delivery) + "\nStatus: " + delivery["status"] + "\nError: " + delivery["last_error"] + \
+            "\nPayload: " + delivery["payload"]
+
+    if args.command == "requeue":
+        return "Requeued: " + str(queue.requeue(args.ids or None))
+
+    if args.command == "purge":
+        if not args.ids and not args.all:
+            return "Define delivery ids or --all"
+        before = time.time() - args.older_than * 86400 if args.older_than is not None else None
+        return "Removed: " + str(queue.purgeFailed(args.ids or None, before))
+
+if __name__ == "__main__":
+    print(main())
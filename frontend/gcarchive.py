@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of PayloadArchive class
+import atexit
+import calendar
+import fcntl
+import gzip
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+# Segment file name: payloads-<period start (UTC)>.<part>.gz
+SEGMENT_PATTERN = re.compile(r'^payloads-(\d{8}-\d{6})\.(\d+)\.gz$')
+
+
+class PayloadArchive:
+    """
+    Archive of raw webhook payloads, shared by all processes.
+
+    Payloads are appended to compressed segment files, every payload is a separate gzip member, so segment is
+    a valid .gz file (zcat shows all its payloads) and one payload can be read without decompressing the rest.
+    New segment is started every segment_interval seconds and when segment exceeds segment_max_size.
+    Index (SQLite database in WAL mode) maps delivery id, repository, event and time to segment offsets.
+    Segments, which are older than retention seconds, are removed with their index entries: any process,
+    which appends payload, prunes the archive once per segment_interval (time of the last pruning is kept in index).
+    Webhook requests use appendLater(), so compression and writes are done by background thread.
+    """
+
+    # Archive directory
+    path = ""
+    # Seconds, after which new segment is started
+    segment_interval = 3600
+    # Max segment size in bytes
+    segment_max_size = 64 * 1024 * 1024
+    # Seconds, during which payloads are kept
+    retention = 30 * 86400
+    # Gzip compression level (1 - fastest, 9 - smallest)
+    compression_level = 6
+
+    def __init__(self, path, segment_interval=3600, segment_max_size=64 * 1024 * 1024, retention=30 * 86400, compression_level=6):
+        """
+        Open (and create if needed) archive directory and index.
+        :param path: String - Archive directory
+        :param segment_interval: Int - Seconds, after which new segment is started
+        :param segment_max_size: Int - Max segment size in bytes
+        :param retention: Int - Seconds, during which payloads are kept
+        :param compression_level: Int - Gzip compression level
+        """
+        self.path = path
+        self.segment_interval = segment_interval
+        self.segment_max_size = segment_max_size
+        self.retention = retention
+        self.compression_level = compression_level
+        # Current segment period and part of this process
+        self._period = None
+        self._part = 0
+        # Time, before which pruning is surely not due (saves index reads of warm process)
+        self._next_prune = 0
+        self._lock = threading.Lock()
+        # Payloads, waiting for background writer, and writer thread
+        self._pending = queue.Queue()
+        self._writer = None
+        os.makedirs(path, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(path, "index.db"), timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS payloads ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "delivery_id TEXT NOT NULL, "
+            "repository TEXT NOT NULL, "
+            "event TEXT NOT NULL, "
+            "action TEXT NOT NULL, "
+            "received_at REAL NOT NULL, "
+            "segment TEXT NOT NULL, "
+            "offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, "
+            "size INTEGER NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS payloads_delivery ON payloads (delivery_id)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS payloads_repository ON payloads (repository, received_at)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS payloads_event ON payloads (event, received_at)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS payloads_received ON payloads (received_at)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS payloads_segment ON payloads (segment)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    def _getSegment(self, moment, size):
+        """
+        Choose segment file for new payload (segment of current period, which has space for it).
+        :param moment: Float - Timestamp of payload
+        :param size: Int - Compressed payload size
+        :return: String - Segment file name
+        """
+        period = time.strftime("%Y%m%d-%H%M%S", time.gmtime(moment - moment % self.segment_interval))
+        if period != self._period:
+            self._period = period
+            self._part = 0
+        while True:
+            name = "payloads-" + period + "." + str(self._part) + ".gz"
+            try:
+                segment_size = os.path.getsize(os.path.join(self.path, name))
+            except OSError:
+                return name
+            if not segment_size or segment_size + size <= self.segment_max_size:
+                return name
+            self._part += 1
+
+    def append(self, payload, delivery_id="", event="", repository="", action=""):
+        """
+        Append payload to current segment and index it.
+        :param payload: String or Bytes - Raw payload json
+        :param delivery_id: String - Github delivery id (X-GitHub-Delivery header)
+        :param event: String - Github event name (X-GitHub-Event header)
+        :param repository: String - Repository name
+        :param action: String - Event action
+        :return: Dict - Index entry {"segment", "offset", "length"}
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        member = gzip.compress(payload, self.compression_level, mtime=0)
+        now = time.time()
+        with self._lock:
+            segment = self._getSegment(now, len(member))
+            # Several processes append to the same segment: offset is taken and payload is written under lock
+            with open(os.path.join(self.path, segment), "ab") as segment_file:
+                fcntl.flock(segment_file, fcntl.LOCK_EX)
+                try:
+                    offset = os.fstat(segment_file.fileno()).st_size
+                    segment_file.write(member)
+                    segment_file.flush()
+                finally:
+                    fcntl.flock(segment_file, fcntl.LOCK_UN)
+            self._connection.execute(
+                "INSERT INTO payloads (delivery_id, repository, event, action, received_at, segment, offset, length, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (delivery_id, repository, event, action, now, segment, offset, len(member), len(payload))
+            )
+        self._pruneIfDue(now)
+        return {"segment": segment, "offset": offset, "length": len(member)}
+
+    def appendLater(self, payload, delivery_id="", event="", repository="", action=""):
+        """
+        Queue payload for background writer thread and return immediately (see append() for parameters).
+        Queued payloads are written before process exit.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="gcarchive-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+        self._pending.put((payload, delivery_id, event, repository, action))
+
+    def _write(self):
+        """
+        Background writer: append queued payloads.
+        """
+        while True:
+            payload, delivery_id, event, repository, action = self._pending.get()
+            try:
+                self.append(payload, delivery_id, event, repository, action)
+            except Exception as e:
+                logging.error('Payload ' + delivery_id + ' is not archived: ' + repr(e))
+            finally:
+                self._pending.task_done()
+
+    def flush(self):
+        """
+        Wait until queued payloads are written.
+        """
+        if self._writer is not None:
+            self._pending.join()
+
+    def _pruneIfDue(self, now):
+        """
+        Prune archive, if it was not pruned by any process during the last segment_interval.
+        :param now: Float - Current timestamp
+        :return: Int - Count of removed segments
+        """
+        if now < self._next_prune:
+            return 0
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute("SELECT value FROM meta WHERE key = 'pruned_at'").fetchone()
+                due = row is None or now - row[0] >= self.segment_interval
+                if due:
+                    self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pruned_at', ?)", (now,))
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._next_prune = (now if due else row[0]) + self.segment_interval
+        return self.prune(now) if due else 0
+
+    def find(self, delivery_id=None, repository=None, event=None, since=None, until=None, limit=100):
+        """
+        Search index, newest payloads first.
+        :param delivery_id: String - Github delivery id
+        :param repository: String - Repository name
+        :param event: String - Github event name
+        :param since: Float - Received not earlier than timestamp
+        :param until: Float - Received earlier than timestamp
+        :param limit: Int - Max count of entries
+        :return: List - Index entries {"id", "delivery_id", "repository", "event", "action", "received_at",
+                 "segment", "offset", "length", "size"}
+        """
+        conditions = []
+        params = []
+        for column, operator, value in (("delivery_id", "=", delivery_id), ("repository", "=", repository),
+                                        ("event", "=", event), ("received_at", ">=", since), ("received_at", "<", until)):
+            if value is not None:
+                conditions.append(column + " " + operator + " ?")
+                params.append(value)
+        keys = ("id", "delivery_id", "repository", "event", "action", "received_at", "segment", "offset", "length", "size")
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT " + ", ".join(keys) + " FROM payloads" + (" WHERE " + " AND ".join(conditions) if conditions else "") +
+                " ORDER BY received_at DESC, id DESC LIMIT ?", params + [limit]
+            ).fetchall()
+        return [dict(zip(keys, row)) for row in rows]
+
+    def read(self, entry):
+        """
+        Read payload of index entry (only its gzip member is decompressed).
+        :param entry: Dict - Index entry, returned by find()
+        :return: Bytes - Raw payload json or None, if segment is already removed
+        """
+        try:
+            with open(os.path.join(self.path, entry["segment"]), "rb") as segment_file:
+                segment_file.seek(entry["offset"])
+                return gzip.decompress(segment_file.read(entry["length"]))
+        except FileNotFoundError:
+            return None
+
+    def get(self, delivery_id):
+        """
+        Get payload of delivery (the latest one, if delivery was redelivered).
+        :param delivery_id: String - Github delivery id
+        :return: Bytes - Raw payload json or None, if it is not archived
+        """
+        entries = self.find(delivery_id=delivery_id, limit=1)
+        return self.read(entries[0]) if entries else None
+
+    def getSegments(self):
+        """
+        Get segment files, oldest first.
+        :return: List - Tuples (file name, period start timestamp)
+        """
+        segments = []
+        for name in os.listdir(self.path):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append((name, calendar.timegm(time.strptime(match.group(1), "%Y%m%d-%H%M%S"))))
+        return sorted(segments, key=lambda segment: (segment[1], segment[0]))
+
+    def prune(self, now=None):
+        """
+        Remove segments, which are older than retention, with their index entries.
+        :param now: Float - Current timestamp (for testing)
+        :return: Int - Count of removed segments
+        """
+        cutoff = (now or time.time()) - self.retention
+        removed = 0
+        for name, period_start in self.getSegments():
+            if period_start + self.segment_interval > cutoff:
+                continue
+            with self._lock:
+                self._connection.execute("DELETE FROM payloads WHERE segment = ?", (name,))
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            removed += 1
+        return removed
+
+    def stats(self):
+        """
+        Get archive size.
+        :return: Dict - {"segments", "payloads", "compressed_size", "size"}
+        """
+        with self._lock:
+            payloads, size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM payloads").fetchone()
+        segments = self.getSegments()
+        compressed_size = sum(os.path.getsize(os.path.join(self.path, name)) for name, period_start in segments)
+        return {"segments": len(segments), "payloads": payloads, "compressed_size": compressed_size, "size": size}
+
+
+def openArchive(root_path, archive_config):
+    """
+    Open archive with settings of "archive" section of config.json.
+    :param root_path: String - Script root directory
+    :param archive_config: Dict - Settings {"path": "logs/archive", "segment_interval": 3600, "segment_max_size": 67108864,
+                           "retention_days": 30, "compression_level": 6}
+    :return: Object of class PayloadArchive
+    """
+    return PayloadArchive(
+        os.path.join(root_path, archive_config.get("path", "logs/archive")),
+        archive_config.get("segment_interval", 3600),
+        archive_config.get("segment_max_size", 64 * 1024 * 1024),
+        archive_config.get("retention_days", 30) * 86400,
+        archive_config.get("compression_level", 6)
+    )
@@ -1,20 +1,65 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-# Dependencies of GithubChatworkBot class
+# Dependencies of GithubChatworkBot class.
+# Modules, which are needed only by some paths (UI transport, Github client of cron tasks, task deadlines,
+# sending to several rooms), are imported inside methods, so webhook entry point starts faster.
 import sys
-import urllib
-import urllib.request
-import socket
-import cgi  # to get POST fields from Github
-import json  # to convert payload from json to dictionary
 import logging  # log handling
 import re
-from github import Github
 import time
-import datetime
-import cwui
+import cwaccounts
 import cwmessage
+import cwtransport
+import cwratelimit
+import cwretry
+import gcindex
+import gcpayload
+import gcmetrics
+
+# Webhook handlers in format {("X-GitHub-Event header value", "action"): "handler method name", ...}
+WEBHOOK_HANDLERS = {}
+
+
+class ExecutionError(SystemExit):
+    """
+    Execution is stopped, because event can not be processed (error is logged with CRITICAL level).
+    Process exit code is 0 like before, so callers, which catch SystemExit, stop the same way,
+    but worker can tell it from execution, which is stopped on purpose (see executeWebhookHandler()).
+    """
+
+    def __init__(self, message):
+        """
+        :param message: String - Logged error
+        """
+        super().__init__(0)
+        self.message = message
+
+
+def webhookHandler(event, action):
+    """
+    Decorator, which registers message builder method as handler of Github event.
+    :param event: String - Github event name (X-GitHub-Event header value, for example "issues")
+    :param action: String - Payload action (for example "opened")
+    """
+    def register(method):
+        WEBHOOK_HANDLERS[(event, action)] = method.__name__
+        return method
+    return register
+
+
+def isHandledEvent(event, action=None):
+    """
+    Check if event is handled by any handler (for rejection before payload is parsed).
+    :param event: String - Github event name or "", if unknown
+    :param action: String - Payload action or None, if unknown
+    :return: Bool - False if event is not handled for sure
+    """
+    for handler_event, handler_action in WEBHOOK_HANDLERS:
+        if (not event or event == handler_event) and (action is None or action == handler_action):
+            return True
+    return False
+
 
 class GithubChatworkBot:
     """
@@ -24,7 +69,7 @@ class GithubChatworkBot:
     # Before using class you must get Chatwork API Key, add bot account to all designated Chatwork rooms and configure Github webhooks.
     # Webhook config (go to Github repository configuration page and open "Webhooks & Services" tab):
     #   - Payload url - set to url, where GithubChatworkBot.execute() method is called;
-    #   - Content type - application/x-www-form-urlencoded
+    #   - Content type - application/json (application/x-www-form-urlencoded is also supported)
     #   - Select individual events - Commit comment, Issues, Pull Request, Issue comment, Pull Request review comment
     # To start cgi http server execute this in server home folder (i.e. folder, that contains "cgi-bin" folder):
     #   python3 -m http.server --cgi
@@ -69,10 +114,24 @@ class GithubChatworkBot:
     repository_room_map = {}
     # Chatwork API token
     chatwork_token = ''
+    # Chatwork API url
+    chatwork_api_url = 'https://api.chatwork.com/v1'
+    # Chatwork API request timeout in seconds
+    chatwork_api_timeout = 30
     # Github API token
     github_token = ''
+    # Github API url
+    github_api_url = 'https://api.github.com'
+    # Cache of Github responses for conditional requests of cron tasks (object of class HttpCache) or None
+    github_cache = None
     # Payload, that comes from Github. For internal usage.
     _payload = {}
+    # Github event name (X-GitHub-Event header). For internal usage (see setEvent).
+    _event = ""
+    # Compiled lookup index of chatwork_github_account_map. For internal usage (see getAccountIndex).
+    _account_index = None
+    # Pool of Chatwork bot accounts. For internal usage (see getAccountPool).
+    _account_pool = None
     # True for send requests to UI, False for API
     ui_active = True
     # UI login account email
@@ -81,6 +140,33 @@ class GithubChatworkBot:
     ui_login_id = ""
     # UI login password
     ui_login_password = ""
+    # Max count of Chatwork rooms, to which one message is sent simultaneously
+    max_send_workers = 4
+    # Burst coalescer (object of class MessageCoalescer). If set, messages about issues/PRs are buffered by it.
+    coalescer = None
+    # Id of processed delivery inside delivery queue (set by worker.py)
+    delivery_queue_id = None
+    # Github delivery id (X-GitHub-Delivery header), if known. Used in log lines.
+    delivery_id = ""
+
+    def setConfig(self, config):
+        """
+        Set properties according to config.json contents.
+        :param config: Object of class ConfigSnapshot (see gcconfig.loadConfig) or Dictionary - config.json contents
+        """
+        self.chatwork_token = config.get("chatwork_token", "")
+        self.github_token = config.get("github_token", "")
+        self.logging = config["logging"]
+        self.chatwork_github_account_map = config["chatwork_github_account_map"]
+        self.repository_room_map = config["repository_room_map"]
+        ui = config.get("ui", {})
+        self.ui_login_email = ui.get("login_email", "")
+        self.ui_login_id = ui.get("login_id", "")
+        self.ui_login_password = ui.get("login_password", "")
+        # Snapshot has precompiled account index and account pool
+        if getattr(config, "account_index", None) is not None:
+            self._account_index = config.account_index
+        self._account_pool = getattr(config, "account_pool", None) or cwaccounts.AccountPool.fromConfig(config)
 
     def setPayload(self, github_post_data):
         """
@@ -94,8 +180,48 @@ class GithubChatworkBot:
         except KeyError:
             self._log('Payload format is wrong.', 'CRITICAL')
 
-        self._log(github_post_data['payload'].value.encode('utf_8'), 'INFO')
-        self._payload = json.loads(github_post_data['payload'].value)
+        self.setPayloadJson(github_post_data['payload'].value)
+
+    def setEvent(self, event):
+        """
+        Set Github event name, which is used to choose handler (see WEBHOOK_HANDLERS).
+        If event is not set, it is guessed by payload keys.
+        :param event: String - X-GitHub-Event header value (for example, "issue_comment")
+        """
+        self._event = event
+
+    def setPayloadJson(self, payload_json):
+        """
+        Set payload property from raw payload json (for example, taken from delivery queue).
+        Only keys, used by handlers, are kept (see gcpayload.PAYLOAD_KEYS).
+        :param payload_json: String or Bytes - Payload json, incoming from Github
+        """
+        with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "parse"}):
+            try:
+                payload = gcpayload.parsePayload(payload_json)
+            except gcpayload.PayloadError as e:
+                self._log(str(e), 'CRITICAL')
+        self.setPayloadData(payload)
+
+    def setPayloadData(self, payload):
+        """
+        Set payload property from already parsed payload (see gcpayload.parsePayload).
+        :param payload: Dict - Parsed payload
+        """
+        self._payload = payload
+        repository = payload.get('repository') or {}
+        sender = payload.get('sender') or {}
+        self._log('Payload: action "' + str(payload.get('action', '')) + '", repository "' +
+                  str(repository.get('name', '')) + '", sender "' + str(sender.get('login', '')) + '".', 'INFO')
+
+    def getAccountIndex(self):
+        """
+        Get lookup index of chatwork_github_account_map. Index is compiled once and compiled again only if map is replaced.
+        :return: Object of class AccountIndex
+        """
+        if self._account_index is None or self._account_index.source is not self.chatwork_github_account_map:
+            self._account_index = gcindex.getAccountIndex(self.chatwork_github_account_map)
+        return self._account_index
 
     def _getChatworkUsericonByGithubName(self, github_account):
         """
@@ -103,10 +229,7 @@ class GithubChatworkBot:
         :param github_account: String
         :return: String - "icon+username" code [piconname:123]
         """
-        for map_github_account, account_settings in self.chatwork_github_account_map.items():
-            if github_account == map_github_account:
-                return '[piconname:' + account_settings['chatwork_account'] + ']'
-        return "unknown (" + github_account + ")"
+        return self.getAccountIndex().usericon_by_github.get(github_account, "unknown (" + github_account + ")")
 
     def _getChatworkUserIdByGithubName(self, github_account):
         """
@@ -114,10 +237,7 @@ class GithubChatworkBot:
         :param github_account: String - Github account name
         :return: Integer - Chatwork user id or 0, if user not found
         """
-        for map_github_account, account_settings in self.chatwork_github_account_map.items():
-            if github_account == map_github_account:
-                return account_settings['chatwork_account']
-        return 0
+        return self.getAccountIndex().chatwork_id_by_github.get(github_account, 0)
 
     def _buildAddresseeList(self, guthub_addressee_list, text=""):
         """
@@ -125,30 +245,40 @@ class GithubChatworkBot:
         :param guthub_addressee_list: List - List of github addressee, if present.
         :param text: String - Contents of comment on github, if present (need for additional parsing, such as @username).
         """
+        with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "addressees"}):
+            return self._resolveAddressees(guthub_addressee_list, text)
+
+    def _resolveAddressees(self, guthub_addressee_list, text):
+        """
+        Convert github addressee list and @username mentions to chatwork addressee list (see _buildAddresseeList).
+        :param guthub_addressee_list: List - List of github addressee.
+        :param text: String - Contents of comment on github.
+        :return: List - Chatwork account ids
+        """
         chatwork_addressee_list = []
-        addressee_string = ''
+        account_index = self.getAccountIndex()
+        chatwork_id_by_github = account_index.chatwork_id_by_github
 
         # Parsing @username from github comment text. If found, add this username as chatwork addressee.
-        for github_account, account_settings in self.chatwork_github_account_map.items():
-            if text.find(github_account) > -1:
-                chatwork_addressee_list.append(account_settings['chatwork_account'])
+        for github_account in account_index.mention_extractor.extract(text):
+            chatwork_addressee_list.append(chatwork_id_by_github[github_account])
 
         # Converting guthub_addressee_list to chatwork_addressee_list.
-        for github_account, account_settings in self.chatwork_github_account_map.items():
-            if github_account in guthub_addressee_list:
-                chatwork_addressee_list.append(account_settings['chatwork_account'])
+        for github_account in guthub_addressee_list:
+            if github_account in chatwork_id_by_github:
+                chatwork_addressee_list.append(chatwork_id_by_github[github_account])
 
-        # Remove duplicates.
-        chatwork_addressee_list = list(set(chatwork_addressee_list))
+        # Remove duplicates (keep order).
+        chatwork_addressee_list = list(dict.fromkeys(chatwork_addressee_list))
 
         # Remove event sender account from list. He already knows about event.
-        for github_account, account_settings in self.chatwork_github_account_map.items():
-            if github_account == self._payload['sender']['login']:
-                if account_settings['chatwork_account'] in chatwork_addressee_list:
-                    chatwork_addressee_list.remove(account_settings['chatwork_account'])
+        sender_chatwork_account = chatwork_id_by_github.get(self._payload['sender']['login'])
+        if sender_chatwork_account in chatwork_addressee_list:
+            chatwork_addressee_list.remove(sender_chatwork_account)
 
         return chatwork_addressee_list
 
+    @webhookHandler("issue_comment", "created")
     def _buildIssueCommentedMessage(self):
         """
         Build message, corresponding to github "Issue commented" event.
@@ -162,6 +292,7 @@ class GithubChatworkBot:
                 to_list.append(assignee['login'])
 
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['issue']['html_url'], self._payload['issue']['title'])
         message.setAddresseeList(self._buildAddresseeList(to_list, self._payload['comment']['body']))
         message.setTitle('Issue Commented by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
                          self._payload['issue']['title'] + '\n' + \
@@ -170,6 +301,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("issues", "opened")
     def _buildIssueOpenedMessage(self):
         """
         Build message content, corresponding to github "Issue opened" event
@@ -177,6 +309,7 @@ class GithubChatworkBot:
         :return: Object of class ChatworkMessage
         """
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['issue']['html_url'], self._payload['issue']['title'])
         message.setAddresseeList(self._buildAddresseeList([], self._payload['issue']['body']))
         message.setTitle('Issue Opened by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
             self._payload['issue']['html_url'])
@@ -185,6 +318,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("issues", "assigned")
     def _buildIssueAssignedMessage(self):
         """
         Build message content, corresponding to github "Issue assigned" event.
@@ -194,6 +328,7 @@ class GithubChatworkBot:
         to_list = [self._payload['assignee']['login']]
 
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['issue']['html_url'], self._payload['issue']['title'])
         message.setAddresseeList(self._buildAddresseeList(to_list, self._payload['issue']['body']))
         message.setTitle('Issue Assigned to ' + self._getChatworkUsericonByGithubName(self._payload['assignee']['login']) + \
             ' by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
@@ -202,6 +337,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("issues", "closed")
     def _buildIssueClosedMessage(self):
         """
         Build message content, corresponding to github "Issue closed" event.
@@ -215,6 +351,7 @@ class GithubChatworkBot:
                 to_list.append(assignee['login'])
 
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['issue']['html_url'], self._payload['issue']['title'])
         message.setAddresseeList(self._buildAddresseeList(to_list, self._payload['issue']['body']))
         message.setTitle('Issue Closed by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
             self._payload['issue']['html_url'])
@@ -222,6 +359,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("pull_request", "opened")
     def _buildPROpenedMessage(self):
         """
         Build message content, corresponding to github "PR opened" event.
@@ -229,6 +367,7 @@ class GithubChatworkBot:
         :return: Object of class ChatworkMessage
         """
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['pull_request']['html_url'], self._payload['pull_request']['title'])
         message.setAddresseeList(self._buildAddresseeList([], self._payload['pull_request']['body']))
         message.setTitle('PR Opened by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
             self._payload['pull_request']['html_url'])
@@ -237,6 +376,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("pull_request", "closed")
     def _buildPRClosedMessage(self):
         """
         Build message content, corresponding to github "PR closed" event.
@@ -250,6 +390,7 @@ class GithubChatworkBot:
                 to_list.append(assignee['login'])
 
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['pull_request']['html_url'], self._payload['pull_request']['title'])
         message.setAddresseeList(self._buildAddresseeList(to_list))
         message.setTitle('PR Closed by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
             self._payload['pull_request']['html_url'])
@@ -257,6 +398,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("pull_request_review_comment", "created")
     def _buildPRCommentedMessage(self):
         """
         Build message content, corresponding to github "PR commented" event.
@@ -270,6 +412,7 @@ class GithubChatworkBot:
                 to_list.append(assignee['login'])
 
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['pull_request']['html_url'], self._payload['pull_request']['title'])
         message.setAddresseeList(self._buildAddresseeList(to_list, self._payload['comment']['body']))
         message.setTitle('PR Commented by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
                          self._payload['pull_request']['title'] + '\n' + \
@@ -278,6 +421,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("commit_comment", "created")
     def _buildCommitCommentedMessage(self):
         """
         Build message content, corresponding to github "Commit commented" event.
@@ -285,6 +429,7 @@ class GithubChatworkBot:
         :return: Object of class ChatworkMessage
         """
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['comment']['html_url'].split('#')[0], 'Commit ' + self._payload['comment']['commit_id'][:7])
         message.setAddresseeList(self._buildAddresseeList([], self._payload['comment']['body']))
         message.setTitle('Commit Commented by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
             self._payload['comment']['html_url'])
@@ -292,6 +437,7 @@ class GithubChatworkBot:
 
         return message
 
+    @webhookHandler("pull_request", "assigned")
     def _buildPRAssignedMessage(self):
         """
         Build message content, corresponding to github "Issue assigned" event.
@@ -301,6 +447,7 @@ class GithubChatworkBot:
         to_list = [self._payload['assignee']['login']]
 
         message = cwmessage.ChatworkMessage()
+        message.setThread(self._payload['pull_request']['html_url'], self._payload['pull_request']['title'])
         message.setAddresseeList(self._buildAddresseeList(to_list))
         message.setTitle('PR Assigned to ' + self._getChatworkUsericonByGithubName(self._payload['assignee']['login']) + \
             ' by ' + self._getChatworkUsericonByGithubName(self._payload['sender']['login']) + '\n' + \
@@ -312,103 +459,308 @@ class GithubChatworkBot:
     def _routeWebhookEventToRoom(self, message):
         """
         Route webhook event message (such as new issues, comments etc) to corresponding Chatwork room.
+        Message is sent to all rooms simultaneously (see max_send_workers).
         :param message: Object of class ChatworkMessage, that will be sent to Chatwork
+        :return: Dict - Sending result for each room {"room id": True if message is sent (or buffered by coalescer)
+                        or False otherwise, ...}
         """
-        # Route message by repository name
+        # Route message by repository name.
+        # Copy room list, otherwise rooms of addressees are added to repository_room_map itself.
         room_ids = []
         if self._payload['repository']['name']  in self.repository_room_map.keys():
-            room_ids = self.repository_room_map[self._payload['repository']['name']]
+            room_ids = list(self.repository_room_map[self._payload['repository']['name']])
 
         # Route message by addressee
-        addressee_list = message.getAddresseeList()
-        for addressee in addressee_list:
-            for github_account, account_settings in self.chatwork_github_account_map.items():
-                if addressee == account_settings['chatwork_account']:
-                    room_ids += account_settings['chatwork_rooms']
+        rooms_by_chatwork_id = self.getAccountIndex().rooms_by_chatwork_id
+        for addressee in message.getAddresseeList():
+            room_ids += rooms_by_chatwork_id.get(addressee, ())
+
+        # Remove duplicates (keep routing order)
+        room_ids = list(dict.fromkeys(str(room_id) for room_id in room_ids))
+
+        # Buffer message to merge it with other messages about the same issue/PR
+        if self.coalescer is not None and message.getThreadKey():
+            return {room_id: self.coalescer.add(room_id, message, self.delivery_queue_id) for room_id in room_ids}
 
         # Send message
-        for room_id in room_ids:
-            endpoint = '/rooms/' + str(room_id) + '/messages'
-            data = {"body": message.getFormattedContents()}
-            self.chatworkRequest(endpoint, data)
+        with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "format"}):
+            body = message.getFormattedContents()
+        return self._sendMessageToRooms(room_ids, body)
 
-    def chatworkRequest(self, endpoint, data):
+    def _sendMessageToRooms(self, room_ids, body):
         """
-        Send POST request to Chatwork
+        Send the same message to several Chatwork rooms simultaneously.
+        :param room_ids: List - Chatwork room ids without duplicates
+        :param body: String - Formatted message contents
+        :return: Dict - Sending result for each room {"room id": True if message is sent or False otherwise, ...}
+        """
+        if len(room_ids) < 2 or self.max_send_workers < 2:
+            return {room_id: self.sendMessageToRoom(room_id, body) for room_id in room_ids}
+
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_send_workers, len(room_ids))) as executor:
+            results = executor.map(lambda room_id: self.sendMessageToRoom(room_id, body), room_ids)
+            return dict(zip(room_ids, results))
+
+    def sendMessageToRoom(self, room_id, body):
+        """
+        Send message to one Chatwork room. Errors are logged and not raised, so other rooms are not affected.
+        :param room_id: String - Chatwork room id
+        :param body: String - Formatted message contents
+        :return: Bool - True if message is sent or False otherwise
+        """
+        return self.reliableChatworkRequest('/rooms/' + room_id + '/messages', {"body": body}) is not False
+
+    def reliableChatworkRequest(self, endpoint, data):
+        """
+        Send POST request to Chatwork and retry it on transient failures (see cwretry).
+        Request, which is not sent, is logged and moved to dead letter store, so it can be sent later.
         :param endpoint: String - Chatwork API endpoint (for example, "/rooms/12345/messages")
         :param data: Dictionary - Post data, that will be sent to Chatwork API
-        :return: String - response from Chatwork API
+        :return: String - Response from Chatwork or False if request failed
+        """
+        # Rate limit waits, tries of every account and retries share one deadline
+        deadline = cwretry.getDeadline()
+        try:
+            return cwretry.call(lambda: self.strictChatworkRequest(endpoint, data, deadline), deadline)
+        except Exception as e:
+            kind = cwretry.classify(e)
+            self._log('Request to ' + endpoint + ' failed (' + kind + '): ' + repr(e), 'ERROR')
+            cwretry.deadLetter(endpoint, data, kind, repr(e))
+            return False
+
+    def strictChatworkRequest(self, endpoint, data, deadline=None):
+        """
+        Send POST request to Chatwork, failure is raised as exception (see cwretry.classify).
+        :param endpoint: String - Chatwork API endpoint (for example, "/rooms/12345/messages")
+        :param data: Dictionary - Post data, that will be sent to Chatwork API
+        :param deadline: Float - Timestamp, before which request must be sent (see cwretry.getDeadline())
+        :return: String - Response from Chatwork
+        """
+        response = self.chatworkRequest(endpoint, data, deadline)
+        if response is False:
+            raise cwretry.ChatworkError(cwretry.CLIENT, 'Chatwork UI rejected request')
+        return response
+
+    def getAccountPool(self):
+        """
+        Get pool of Chatwork bot accounts (see cwaccounts). If config is not set, pool has single account,
+        defined by chatwork_token and ui_login_* properties.
+        :return: Object of class AccountPool
+        """
+        if self._account_pool is None:
+            self._account_pool = cwaccounts.AccountPool([cwaccounts.ChatworkAccount(
+                "default", self.chatwork_token, self.ui_login_email, self.ui_login_id, self.ui_login_password
+            )])
+        return self._account_pool
+
+    def _getTransport(self, account, endpoint):
+        """
+        Choose transport of request: message requests are sent through UI, all other requests through API.
+        :param account: Object of class ChatworkAccount
+        :param endpoint: String - Chatwork API endpoint
+        :return: String - "ui", "api" or "" if account can not send the request
         """
+        if self.ui_active and account.ui_login_id and re.search("/rooms/([0-9]+)/messages", endpoint):
+            return "ui"
+        return "api" if account.chatwork_token else ""
 
+    def chatworkRequest(self, endpoint, data, deadline=None):
+        """
+        Send POST request to Chatwork.
+        Request is sent by account of the pool, which is chosen by room (see cwaccounts). Account with free rate limit
+        budget is preferred. If account is throttled or logged out, request is sent by next account of the room.
+        Rate limit waits and transport timeouts of all accounts are bounded by deadline.
+        :param endpoint: String - Chatwork API endpoint (for example, "/rooms/12345/messages")
+        :param data: Dictionary - Post data, that will be sent to Chatwork API
+        :param deadline: Float - Timestamp, before which request must be sent (see cwretry.getDeadline())
+        :return: String - response from Chatwork API
+        :raise cwretry.ChatworkError: TIMEOUT, if request is not sent before deadline
+        """
+        deadline = deadline or cwretry.getDeadline()
+
+        # Messages with mentions are sent first, when rate limit budget is tight
+        priority = "[To:" in data.get("body", "")
+
+        match = re.search("/rooms/([0-9]+)/", endpoint)
+        room_id = match.group(1) if match else ""
+        pool = self.getAccountPool()
+        accounts = pool.getAccounts(room_id)
+        if not accounts:
+            # Request would be rejected anyway, so it is not retried
+            raise cwretry.ChatworkError(cwretry.CLIENT, 'No Chatwork account is a member of room ' + room_id +
+                                        ' ("rooms" of "accounts" section), request to ' + endpoint + ' is not sent')
+        accounts = [account for account in accounts if self._getTransport(account, endpoint)]
+        if not accounts:
+            raise cwretry.ChatworkError(cwretry.AUTH, 'No Chatwork account can send request to ' + endpoint)
+
+        while True:
+            # Take budget of the first account, which has it. If all accounts are busy, wait for the first one.
+            account = None
+            if len(accounts) > 1:
+                account = next((account for account in accounts if cwratelimit.tryAcquire(
+                    account.getRatelimitKey(self._getTransport(account, endpoint)), priority)), None)
+            acquired = account is not None
+            account = account or accounts[0]
+            accounts.remove(account)
+            try:
+                return self._chatworkRequestAs(account, endpoint, data, priority, acquired, bool(accounts), deadline)
+            except Exception as e:
+                kind = cwretry.classify(e)
+                if kind not in (cwretry.RATE_LIMIT, cwretry.AUTH) or not accounts or time.time() >= deadline:
+                    raise
+                pool.markUnavailable(account, kind)
+                self._log('Chatwork account ' + account.name + ' is unavailable (' + kind + '), request to ' + endpoint +
+                          ' is sent by account ' + accounts[0].name + '.', 'WARNING')
+
+    def _chatworkRequestAs(self, account, endpoint, data, priority, acquired=False, failover=False, deadline=None):
+        """
+        Send POST request to Chatwork by the account.
+        :param account: Object of class ChatworkAccount
+        :param endpoint: String - Chatwork API endpoint
+        :param data: Dictionary - Post data
+        :param priority: Bool - Request may use rate limit budget, reserved for messages with mentions
+        :param acquired: Bool - Rate limit budget of account is already taken
+        :param failover: Bool - Other account can send request, so rate limit error is not waited out
+        :param deadline: Float - Timestamp, before which request must be sent (see cwretry.getDeadline())
+        :return: String - response from Chatwork or False if UI rejected message
+        """
+        deadline = deadline or cwretry.getDeadline()
         # Send message requests through UI
-        if self.ui_active:
-            match = re.search("/rooms/([0-9]+)/messages", endpoint)
-            if match:
-                room_id = match.group(1)
-                cwuiInstance = cwui.ChatworkUI(self.ui_login_email, self.ui_login_id, self.ui_login_password)
-                return cwuiInstance.message(data["body"], room_id)
+        if self._getTransport(account, endpoint) == "ui":
+            room_id = re.search("/rooms/([0-9]+)/messages", endpoint).group(1)
+            if not acquired:
+                cwratelimit.acquire(account.getRatelimitKey("ui"), priority, deadline)
+            with gcmetrics.timer("gcbot_chatwork_request_duration_seconds", {"transport": "ui", "room": room_id}):
+                import cwui
+                try:
+                    # Only top-level "ui" account had session in legacy store
+                    cwuiInstance = cwui.ChatworkUI(account.ui_login_email, account.ui_login_id, account.ui_login_password,
+                                                   legacy=account.ui_login_id == self.ui_login_id)
+                    cwuiInstance.request_timeout = min(cwuiInstance.request_timeout, cwretry.getRemaining(deadline))
+                    result = cwuiInstance.message(data["body"], room_id)
+                except SystemExit:
+                    # ChatworkUI stops execution, if login fails
+                    gcmetrics.inc("gcbot_chatwork_requests_total", {"transport": "ui", "account": account.name, "result": "failure"})
+                    raise cwretry.ChatworkError(cwretry.AUTH, 'Chatwork UI login of account ' + account.name + ' failed')
+            gcmetrics.inc("gcbot_chatwork_requests_total", {"transport": "ui", "account": account.name, "result": "success" if result else "failure"})
+            return result
 
         # Send all other requests through API
-        return self.chatworkApiRequest(endpoint, data)
+        return self.chatworkApiRequest(endpoint, data, priority, account, acquired, 1 if failover else 2, deadline)
 
-    def chatworkApiRequest(self, endpoint, data):
+    def chatworkApiRequest(self, endpoint, data, priority=False, account=None, acquired=False, tries=2, deadline=None):
         """
         Send POST request to Chatwork
         :param endpoint: String - Chatwork API endpoint (for example, "/rooms/12345/messages")
         :param data: Dictionary - Post data, that will be sent to Chatwork API
+        :param priority: Bool - Request may use rate limit budget, reserved for messages with mentions
+        :param account: Object of class ChatworkAccount (the first account of the pool, if not set)
+        :param acquired: Bool - Rate limit budget of account is already taken
+        :param tries: Int - Count of tries, if request is rejected because of rate limit
+        :param deadline: Float - Timestamp, before which request must be sent (see cwretry.getDeadline())
         :return: String - response from Chatwork API
         """
-        response_data = False
-        socket.setdefaulttimeout(30)
-        url = 'https://api.chatwork.com/v1'
-        headers = {"X-ChatWorkToken": self.chatwork_token}
-        data = urllib.parse.urlencode(data)
-        data = data.encode('utf-8') # data should be bytes
-        req = urllib.request.Request(url + endpoint, data, headers)
-        with urllib.request.urlopen(req) as response:
-            response_data = response.read()
-        return response_data
+        deadline = deadline or cwretry.getDeadline()
+        account = account or self.getAccountPool().accounts[0]
+        headers = {"X-ChatWorkToken": account.chatwork_token}
+        # Rate limit is counted per token (token itself is not stored)
+        ratelimit_key = account.getRatelimitKey("api")
+        match = re.search("/rooms/([0-9]+)/", endpoint)
+        labels = {"transport": "api", "room": match.group(1) if match else ""}
+        result = "failure"
+        try:
+            # Request, rejected because of rate limit, is repeated after budget is restored
+            for attempt in range(tries):
+                if attempt or not acquired:
+                    cwratelimit.acquire(ratelimit_key, priority, deadline)
+                # Connections are pooled and kept alive by cwtransport, timeout is set per request
+                timeout = min(self.chatwork_api_timeout, cwretry.getRemaining(deadline))
+                with gcmetrics.timer("gcbot_chatwork_request_duration_seconds", labels):
+                    response = cwtransport.request("POST", self.chatwork_api_url + endpoint, timeout, data=data, headers=headers)
+                cwratelimit.update(ratelimit_key, response.headers, response.status_code)
+                if response.status_code != 429 or attempt == tries - 1:
+                    break
+                self._log('Chatwork rate limit is exceeded, request to ' + endpoint + ' is delayed.', 'WARNING')
+            response.raise_for_status()
+            result = "success"
+        finally:
+            gcmetrics.inc("gcbot_chatwork_requests_total", {"transport": "api", "account": account.name, "result": result})
+        return response.content
 
     def executeWebhookHandler(self):
         """
         Setting event handlers and executing POST process.
+        :return: Dict - Sending result for each room {"room id": True if message is sent or False otherwise, ...}
         """
         if not self._payload:
             self._log('Execution failed: payload is empty.', 'CRITICAL')
         if not self.repository_room_map:
             self._log('Execution failed: repository-room map not set.', 'CRITICAL')
-        if not self.chatwork_token:
-            self._log('Execution failed: chatwork token not set.', 'CRITICAL')
-
-        message = ''
-        if self._payload['action'] == 'created' and 'issue' in self._payload.keys():
-            message = self._buildIssueCommentedMessage()
-        elif self._payload['action'] == 'opened' and 'issue' in self._payload.keys():
-            message = self._buildIssueOpenedMessage()
-        elif self._payload['action'] == 'assigned' and 'issue' in self._payload.keys():
-            message = self._buildIssueAssignedMessage()
-        elif self._payload['action'] == 'closed' and 'issue' in self._payload.keys():
-            message = self._buildIssueClosedMessage()
-        elif self._payload['action'] == 'opened' and 'pull_request' in self._payload.keys():
-            message = self._buildPROpenedMessage()
-        elif self._payload['action'] == 'closed' and 'pull_request' in self._payload.keys():
-            message = self._buildPRClosedMessage()
-        elif self._payload['action'] == 'created' and 'pull_request' in self._payload.keys():
-            message = self._buildPRCommentedMessage()
-        elif self._payload['action'] == 'assigned' and 'pull_request' in self._payload.keys():
-            message = self._buildPRAssignedMessage()
-        elif self._payload['action'] == 'created' and 'comment' in self._payload.keys():
-            message = self._buildCommitCommentedMessage()
-        else:
-            self._log('Execution failed: event handler is not set.', 'CRITICAL')
-
-        if isinstance(message, str):
-            self._log('"message" is string', 'CRITICAL')
-
-        # Check if message content includes special constructions and execute required actions
-        self._processSpecialConstruction("create_chatwork_task", message)
-
-        self._routeWebhookEventToRoom(message)
+        if not self.getAccountPool().accounts:
+            self._log('Execution failed: chatwork accounts not set.', 'CRITICAL')
+
+        handler = self.getWebhookHandler()
+        if handler is None:
+            self._log('Event "' + (self._event or self._guessEvent()) + '" with action "' +
+                      str(self._payload.get('action', '')) + '" is not handled, skipped.', 'INFO')
+            return {}
+
+        # Event type for metrics labels, for example "IssueCommented"
+        event_type = handler.__name__[len('_build'):-len('Message')]
+        result = "failure"
+        start = time.time()
+        room_results = {}
+        try:
+            with gcmetrics.timer("gcbot_webhook_duration_seconds", {"event": event_type}):
+                with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "dispatch", "event": event_type}):
+                    message = handler()
+
+                # Check if message content includes special constructions and execute required actions
+                self._processSpecialConstruction("create_chatwork_task", message)
+
+                room_results = self._routeWebhookEventToRoom(message)
+            result = "success" if all(room_results.values()) else "partial_failure"
+        except SystemExit as e:
+            # Execution is stopped on error or on purpose (for example, chatwork task is created instead of message)
+            result = "failure" if isinstance(e, ExecutionError) else "stopped"
+            raise
+        finally:
+            gcmetrics.inc("gcbot_webhook_events_total", {"event": event_type, "result": result})
+            self._log('Webhook event is processed.', 'INFO', {
+                "handler": event_type, "result": result, "rooms": len(room_results),
+                "duration_ms": round((time.time() - start) * 1000, 1)
+            })
+
+        return room_results
+
+    def getWebhookHandler(self):
+        """
+        Get handler of current event from WEBHOOK_HANDLERS.
+        :return: Callable - Message builder method or None, if event is not handled
+        """
+        name = WEBHOOK_HANDLERS.get((self._event or self._guessEvent(), self._payload.get('action')))
+        if name is None:
+            return None
+        return getattr(self, name)
+
+    def _guessEvent(self):
+        """
+        Guess Github event name by payload keys (if X-GitHub-Event header is unknown, for example,
+        for deliveries, queued without it, or payloads, set without setEvent).
+        :return: String - Github event name or "", if event can not be guessed
+        """
+        if 'comment' in self._payload:
+            if 'issue' in self._payload:
+                return 'issue_comment'
+            if 'pull_request' in self._payload:
+                return 'pull_request_review_comment'
+            return 'commit_comment'
+        if 'issue' in self._payload:
+            return 'issues'
+        if 'pull_request' in self._payload:
+            return 'pull_request'
+        return ''
 
     def _processSpecialConstruction(self, construction_type, message):
         """
@@ -438,6 +790,7 @@ class GithubChatworkBot:
                 if match.group(2) is None:
                     chatwork_deadline = int(time.time())
                 else:
+                    import datetime
                     dt = datetime.datetime.strptime(match.group(2), '%Y.%m.%d')
                     chatwork_deadline = int(time.mktime(dt.timetuple()))
 
@@ -452,30 +805,46 @@ class GithubChatworkBot:
 
                 # Create new chatwork task
                 for chatwork_room in chatwork_rooms:
-                    self.chatworkRequest(
+                    self.reliableChatworkRequest(
                         '/rooms/' + chatwork_room + '/tasks',
                         {"body": text, "limit": chatwork_deadline, "to_ids": ",".join(chatwork_assignees)}
                     )
                 sys.exit(0)
 
-    def _log(self, text, level):
+    def _getLogFields(self):
+        """
+        Get fields, which are added to every log line of processed delivery (see gclog).
+        :return: Dict - Fields {"event", "delivery_id", "queue_id", "repository"} (empty ones are omitted)
+        """
+        repository = self._payload.get('repository') or {}
+        fields = {
+            "event": self._event,
+            "delivery_id": self.delivery_id,
+            "queue_id": self.delivery_queue_id,
+            "repository": repository.get('name') if isinstance(repository, dict) else None,
+        }
+        return {key: value for key, value in fields.items() if value}
+
+    def _log(self, text, level, fields=None):
         """
         Logger. Wrapper for python "logging" module.
         :param text: String - Text, that will be logged.
         :param level: String - Level of severity. Similar to logging module level of severity (see python logging documentation).
+        :param fields: Dict - Structured fields of log line (delivery fields are added automatically)
         """
         if self.logging:
+            extra = {"fields": dict(self._getLogFields(), **(fields or {}))}
             if level == 'DEBUG':
-                logging.debug(text)
+                logging.debug(text, extra=extra)
             if level == 'INFO':
-                logging.info(text)
+                logging.info(text, extra=extra)
             if level == 'WARNING':
-                logging.warning(text)
+                logging.warning(text, extra=extra)
             if level == 'ERROR':
-                logging.error(text)
+                logging.error(text, extra=extra)
             if level == 'CRITICAL':
-                logging.critical(text)
-                sys.exit(0)
+                logging.critical(text, extra=extra)
+                raise ExecutionError(text)
 
     def executeCronTask(self, cron_task_name, params):
         """
@@ -487,36 +856,42 @@ class GithubChatworkBot:
         """
 
         # Send list of ready PRs to designated Chatwork room, if present.
+        with gcmetrics.timer("gcbot_cron_task_duration_seconds", {"task": cron_task_name}):
+            return self._executeCronTask(cron_task_name, params)
+
+    def _executeCronTask(self, cron_task_name, params):
+        """
+        Execute cron task (see executeCronTask).
+        :param cron_task_name: String - identifier of cron task, that will be executed.
+        :param params: Array - Additional parameters (vary from task to task).
+        :return: Any - Execution result.
+        """
         if cron_task_name == "ready_pr":
-            # Setup Github object
+            # Setup Github client
             if not self.github_token:
                 return "Github API key not found"
-            github = Github(self.github_token)
-
-            repository_str = ""
-            result = []
-
-            for repository in params["repositories"]:
-                repository_str += " repo:" + repository
-            # Search for PRs with title containing search_patterns, defined in config
-            for search_pattern in params["search_patterns"]:
-                pull_requests = {}
-
-                for pr in github.search_issues(search_pattern + " state:open type:pr in:title " + repository_str):
-                    pull_request = pr
-                    """:type: github.Issue.Issue"""
-                    pull_requests[pull_request.html_url] = pull_request.title + "\n" + pull_request.html_url
-
-                if pull_requests:
-                    prs = sorted(pull_requests.items(), key=lambda x: x[0])
-                    for number, body in prs:
-                        result.append(body)
+            import gcgithub
+            github = gcgithub.GithubClient(self.github_token, self.github_api_url, metric_labels={"task": cron_task_name},
+                                           cache=self.github_cache)
+            start = time.time()
+
+            # Search for PRs with title containing search_patterns, defined in config.
+            # Patterns are combined into the fewest queries, found PRs are deduplicated by url.
+            qualifiers = "state:open type:pr in:title " + " ".join("repo:" + repository for repository in params["repositories"])
+            queries = github.buildSearchQueries(params["search_patterns"], qualifiers)
+            pull_requests = github.searchIssues(queries)
+            result = [pull_request["title"] + "\n" + pull_request["html_url"] for pull_request in pull_requests]
+            self._log('Cron task ' + cron_task_name + ': ' + str(len(result)) + ' PRs found by ' + str(len(queries)) +
+                      ' queries (' + str(github.calls) + ' Github requests) in ' + '%.2f' % (time.time() - start) + ' s.', 'INFO')
+            if self.github_cache is not None:
+                self._log('Github cache: ' + str(self.github_cache.hits) + ' hits, ' + str(self.github_cache.misses) + ' misses.', 'INFO')
 
             # Send notification to Chatwork
+            body = ""
             if result:
                 body = '[hr]'.join(result)
                 body = "[info][title]Ready PR is found[/title]" + body + "[/info]"
-                self.chatworkRequest('/rooms/' + params["room_id"] + '/messages', {"body": body})
+                self.sendMessageToRoom(params["room_id"], body)
             return body
         else:
             return "Cron task handler not found"
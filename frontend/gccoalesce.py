@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of MessageCoalescer class
+import threading
+import time
+import cwmessage
+
+
+class MessageCoalescer:
+    """
+    Burst coalescing of messages per Chatwork room.
+    Messages about the same issue/PR (see ChatworkMessage.setThread), which come to the same room within window
+    seconds, are merged into one CombinedChatworkMessage, so review session with dozens of comments
+    becomes several Chatwork posts instead of dozens. Addressees of merged messages are kept.
+
+    Buffer is flushed when window (counted from the first buffered message) expires or when max_messages
+    messages are buffered. Buffered messages live in memory, so coalescer is used by long-running worker.py only.
+    Every message can be added with token (delivery queue id), flush methods return tokens,
+    all messages of which are sent, so delivery is acknowledged only after its messages leave the buffer.
+    """
+
+    # Seconds, during which messages about the same issue/PR are merged
+    window = 60
+    # Buffer is flushed immediately, when this count of messages is reached
+    max_messages = 10
+
+    def __init__(self, send, window=60, max_messages=10):
+        """
+        :param send: Callable - Function (room_id, formatted_contents) -> Bool, which sends message to room
+        :param window: Int - Seconds, during which messages about the same issue/PR are merged
+        :param max_messages: Int - Buffer size, at which it is flushed immediately
+        """
+        self.send = send
+        self.window = window
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        # Buffers in format {(room id, thread key): {"created": time, "messages": [...], "tokens": [...]}, ...}
+        self._buffers = {}
+        # Count of buffers, which contain messages of token, in format {token: count, ...}
+        self._token_buffers = {}
+        # Tokens, released by flushes inside add(), which are not returned by flush methods yet
+        self._released = []
+
+    def add(self, room_id, message, token=None):
+        """
+        Buffer message for the room. Messages without thread key are sent immediately.
+        :param room_id: String - Chatwork room id
+        :param message: Object of class ChatworkMessage
+        :param token: Any - Identifier of message source (for example, delivery queue id), returned by flush methods
+        :return: Bool - True if message is buffered or sent, False if sending failed
+        """
+        if not message.getThreadKey():
+            return self.send(room_id, message.getFormattedContents())
+
+        key = (room_id, message.getThreadKey())
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = {"created": time.time(), "messages": [], "tokens": []}
+                self._buffers[key] = buffer
+            buffer["messages"].append(message)
+            if token is not None and token not in buffer["tokens"]:
+                buffer["tokens"].append(token)
+                self._token_buffers[token] = self._token_buffers.get(token, 0) + 1
+            full = len(buffer["messages"]) >= self.max_messages
+            if full:
+                del self._buffers[key]
+
+        if full:
+            released = self._flushBuffer(room_id, buffer)
+            with self._lock:
+                self._released += released
+        return True
+
+    def isPending(self, token):
+        """
+        Check if messages of token are still buffered.
+        :param token: Any - Token, passed to add()
+        :return: Bool - True if at least one message of token is not sent yet
+        """
+        with self._lock:
+            return token in self._token_buffers
+
+    def flushDue(self):
+        """
+        Send buffers, which window is expired.
+        :return: List - Tokens, all messages of which are sent
+        """
+        deadline = time.time() - self.window
+        return self._flush(lambda buffer: buffer["created"] <= deadline)
+
+    def flushAll(self):
+        """
+        Send all buffers (on worker shutdown).
+        :return: List - Tokens, all messages of which are sent
+        """
+        return self._flush(lambda buffer: True)
+
+    def _flush(self, condition):
+        """
+        Send buffers, which satisfy condition.
+        :param condition: Callable - Function (buffer) -> Bool
+        :return: List - Tokens, all messages of which are sent
+        """
+        with self._lock:
+            keys = [key for key, buffer in self._buffers.items() if condition(buffer)]
+            buffers = [(key[0], self._buffers.pop(key)) for key in keys]
+            released = self._released
+            self._released = []
+
+        for room_id, buffer in buffers:
+            released += self._flushBuffer(room_id, buffer)
+        return released
+
+    def _flushBuffer(self, room_id, buffer):
+        """
+        Send buffered messages as one message.
+        :param room_id: String - Chatwork room id
+        :param buffer: Dict - Buffer {"created", "messages", "tokens"}
+        :return: List - Tokens, all messages of which are sent
+        """
+        messages = buffer["messages"]
+        if len(messages) == 1:
+            self.send(room_id, messages[0].getFormattedContents())
+        else:
+            self.send(room_id, cwmessage.CombinedChatworkMessage(messages).getFormattedContents())
+
+        released = []
+        with self._lock:
+            for token in buffer["tokens"]:
+                self._token_buffers[token] -= 1
+                if not self._token_buffers[token]:
+                    del self._token_buffers[token]
+                    released.append(token)
+        return released
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Config loader, shared by webhook (index.py, worker.py), cron (cron.py) and admin (backend/index.py) entry points.
+# Parsed and validated config.json is kept in memory as immutable snapshot and is loaded again only when
+# file mtime, inode or size is changed. If changed file is malformed, error is logged and last good snapshot is used.
+
+import json
+import logging
+import os
+import threading
+import types
+import cwaccounts
+import cwratelimit
+import cwretry
+import gcindex
+import gcmetrics
+
+
+class ConfigError(Exception):
+    """
+    Config file is malformed or does not correspond to expected format.
+    """
+    pass
+
+
+class ConfigSnapshot:
+    """
+    Immutable parsed config.json. Dictionaries are converted to read-only mappings and lists to tuples.
+    Supports read access like dictionary: config["chatwork_token"], config.get("cron", {}).
+    """
+
+    # Path to config file
+    path = ""
+    # File state (mtime, inode, size), from which snapshot is loaded
+    file_state = None
+    # Read-only config contents
+    data = types.MappingProxyType({})
+    # Compiled lookup index of chatwork_github_account_map (object of class AccountIndex)
+    account_index = None
+    # Pool of Chatwork bot accounts (object of class AccountPool)
+    account_pool = None
+
+    def __init__(self, path, file_state, config):
+        """
+        :param path: String - Path to config file
+        :param file_state: Tuple - File state (mtime, inode, size)
+        :param config: Dict - Parsed and validated config contents
+        """
+        self.path = path
+        self.file_state = file_state
+        self.data = _freeze(config)
+        self.account_index = gcindex.AccountIndex(self.data["chatwork_github_account_map"])
+        self.account_pool = cwaccounts.AccountPool.fromConfig(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+
+def _freeze(value):
+    """
+    Convert parsed json to immutable structure.
+    :param value: Any - Parsed json value
+    :return: Any - Read-only mapping, tuple or scalar value
+    """
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _check(condition, error):
+    """
+    Raise ConfigError if condition is false.
+    :param condition: Bool - Validation result
+    :param error: String - Error description
+    """
+    if not condition:
+        raise ConfigError(error)
+
+
+def _checkUi(ui, name):
+    """
+    Check UI login settings.
+    :param ui: Dict - Settings {"login_email", "login_id", "login_password"}
+    :param name: String - Settings name for error description
+    """
+    _check(isinstance(ui, dict), name + '" must be object')
+    for key in ("login_email", "login_id", "login_password"):
+        _check(isinstance(ui.get(key), str), name + '.' + key + '" must be string')
+
+
+def validateConfig(config):
+    """
+    Check config structure.
+    :param config: Dict - Parsed config.json contents
+    :return: Dict - The same config
+    :raise ConfigError: if config is invalid
+    """
+    _check(isinstance(config, dict), 'Config must be json object')
+    # Config without "accounts" section has single bot account, defined by "chatwork_token" and "ui"
+    accounts = config.get("accounts")
+    if accounts is None or "chatwork_token" in config:
+        _check(isinstance(config.get("chatwork_token"), str), '"chatwork_token" must be string')
+    _check(isinstance(config.get("github_token", ""), str), '"github_token" must be string')
+    _check(isinstance(config.get("logging"), bool), '"logging" must be true or false')
+
+    account_map = config.get("chatwork_github_account_map")
+    _check(isinstance(account_map, dict), '"chatwork_github_account_map" must be object')
+    for github_account, account_settings in account_map.items():
+        _check(isinstance(account_settings, dict), 'Settings of account "' + github_account + '" must be object')
+        _check(isinstance(account_settings.get("chatwork_account"), (str, int)),
+               '"chatwork_account" of account "' + github_account + '" must be string')
+        _check(isinstance(account_settings.get("chatwork_rooms", []), list),
+               '"chatwork_rooms" of account "' + github_account + '" must be list')
+
+    room_map = config.get("repository_room_map")
+    _check(isinstance(room_map, dict), '"repository_room_map" must be object')
+    for repository, room_ids in room_map.items():
+        _check(isinstance(room_ids, list), 'Rooms of repository "' + repository + '" must be list')
+
+    if accounts is None or "ui" in config:
+        _checkUi(config.get("ui"), '"ui')
+
+    if accounts is not None:
+        _check(isinstance(accounts, list) and accounts, '"accounts" must be non-empty list')
+        names = set()
+        for account in accounts:
+            _check(isinstance(account, dict), 'Account of "accounts" must be object')
+            name = account.get("name")
+            _check(isinstance(name, str) and name, '"name" of every account must be non-empty string')
+            _check(name not in names, 'Account name "' + name + '" is not unique')
+            names.add(name)
+            _check(isinstance(account.get("chatwork_token", ""), str), '"chatwork_token" of account "' + name + '" must be string')
+            if "ui" in account:
+                _checkUi(account["ui"], '"accounts.' + name + '.ui')
+            _check(account.get("chatwork_token") or "ui" in account, 'Account "' + name + '" must have "chatwork_token" or "ui"')
+            _check(isinstance(account.get("rooms", []), list), '"rooms" of account "' + name + '" must be list')
+
+    for section in ("http", "delivery_queue", "metrics", "coalesce", "rate_limit", "deduplication", "ingest", "github_cache", "scheduler", "retry", "log", "archive"):
+        _check(isinstance(config.get(section, {}), dict), '"' + section + '" must be object')
+
+    cron = config.get("cron", {})
+    _check(isinstance(cron, dict), '"cron" must be object')
+    for cron_task_name, cron_task in cron.items():
+        _check(isinstance(cron_task, dict), 'Cron task "' + cron_task_name + '" must be object')
+        _check(isinstance(cron_task.get("cron_definition"), str), '"cron_definition" of task "' + cron_task_name + '" must be string')
+        _check(isinstance(cron_task.get("exclude_days"), list), '"exclude_days" of task "' + cron_task_name + '" must be list')
+
+    return config
+
+
+def parseConfig(contents):
+    """
+    Parse and validate config.json contents.
+    :param contents: String - Config file contents
+    :return: Dict - Parsed config
+    :raise ConfigError: if config is not valid json or has invalid structure
+    """
+    try:
+        config = json.loads(contents)
+    except ValueError as e:
+        raise ConfigError('Config is not valid json: ' + str(e))
+    return validateConfig(config)
+
+
+# Loaded snapshots in format {"config path": ConfigSnapshot, ...}
+_snapshots = {}
+# States of malformed files, which are already reported, in format {"config path": (mtime, inode, size), ...}
+_rejected_states = {}
+_load_lock = threading.Lock()
+
+
+def loadConfig(path):
+    """
+    Get config snapshot. File is parsed again only if it is changed since last call.
+    :param path: String - Path to config.json
+    :return: Object of class ConfigSnapshot
+    :raise ConfigError: if file is malformed and there is no previously loaded snapshot
+    """
+    stat = os.stat(path)
+    file_state = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+    snapshot = _snapshots.get(path)
+    if snapshot is not None and (snapshot.file_state == file_state or _rejected_states.get(path) == file_state):
+        return snapshot
+
+    with _load_lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is not None and snapshot.file_state == file_state:
+            return snapshot
+
+        try:
+            with open(path, 'r') as f:
+                snapshot = ConfigSnapshot(path, file_state, parseConfig(f.read()))
+        except ConfigError as e:
+            if _rejected_states.get(path) != file_state:
+                logging.error('Config ' + path + ' is not loaded: ' + str(e))
+                _rejected_states[path] = file_state
+            if path in _snapshots:
+                return _snapshots[path]
+            raise
+
+        _snapshots[path] = snapshot
+        _rejected_states.pop(path, None)
+        return snapshot
+
+
+def configureMetrics(root_path, config):
+    """
+    Set shared metrics database, if "metrics" section is present in config.
+    :param root_path: String - Script root directory
+    :param config: Object of class ConfigSnapshot
+    :return: Bool - True if shared database is set
+    """
+    metrics_config = config.get("metrics")
+    if not metrics_config:
+        return False
+    gcmetrics.configure(
+        os.path.join(root_path, metrics_config.get("path", "logs/metrics.db")),
+        metrics_config.get("flush_interval", 5)
+    )
+    return True
+
+
+def configureRateLimit(root_path, config):
+    """
+    Set shared rate limit database (Chatwork requests are paced, unless "rate_limit" is disabled in config).
+    :param root_path: String - Script root directory
+    :param config: Object of class ConfigSnapshot
+    """
+    ratelimit_config = config.get("rate_limit", {})
+    if ratelimit_config.get("active", True):
+        cwratelimit.configure(os.path.join(root_path, ratelimit_config.get("path", "logs/ratelimit.db")), ratelimit_config)
+
+
+def configureRetry(root_path, config):
+    """
+    Apply "retry" section of config and set dead letter store.
+    :param root_path: String - Script root directory
+    :param config: Object of class ConfigSnapshot
+    """
+    retry_config = config.get("retry", {})
+    cwretry.configure(os.path.join(root_path, retry_config.get("dead_letter_path", "logs/deadletter.db")), retry_config)
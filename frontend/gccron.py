@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# In-process cron scheduler (see "python3 frontend/cron.py --daemon").
+# Cron definitions and exclude_days are taken from "cron" section of config.json, which is checked for changes
+# every minute, so tasks can be added, changed or disabled without restart. Due tasks are executed in thread pool
+# of long-running process, so Chatwork and Github connections, caches and config stay warm between runs.
+# Runs of the same task never overlap: task is locked inside the process and by lock file, which is also taken
+# by single runs of cron.py (for example, launched by crontab).
+
+import concurrent.futures
+import datetime
+import fcntl
+import logging
+import os
+import re
+import threading
+import traceback
+
+# Field ranges of cron definition: (name, min value, max value)
+FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+# Names, allowed in month and weekday fields
+MONTH_NAMES = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+WEEKDAY_NAMES = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+# Macro definitions
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+
+class CronError(Exception):
+    """
+    Cron definition is malformed.
+    """
+    pass
+
+
+class CronExpression:
+    """
+    Parsed cron definition of 5 fields (minute, hour, day of month, month, day of week).
+    Supports "*", values, ranges "1-5", steps "*/15" and "1-30/5", lists "1,3,5", month and weekday names
+    and macros (@hourly, @daily etc). As in cron, if both day of month and day of week are restricted
+    (field does not start with "*", so "*/2" is unrestricted like in Vixie cron), task runs when either of them matches.
+    """
+
+    def __init__(self, definition):
+        """
+        :param definition: String - Cron definition (for example, "*/30 10,11,12 * * 1,2,3,4,5")
+        :raise CronError: if definition is malformed
+        """
+        self.definition = definition
+        fields = MACROS.get(definition.strip().lower(), definition).split()
+        if len(fields) != 5:
+            raise CronError('Cron definition "' + definition + '" must have 5 fields')
+
+        values = []
+        for field, (name, min_value, max_value) in zip(fields, FIELDS):
+            names = MONTH_NAMES if name == "month" else WEEKDAY_NAMES if name == "weekday" else ()
+            values.append(self._parseField(field.lower(), name, min_value, max_value, names))
+        self.minutes, self.hours, self.days, self.months, self.weekdays = values
+        # Sunday can be defined as 0 or 7
+        if 7 in self.weekdays:
+            self.weekdays = self.weekdays | {0}
+        self.day_restricted = not fields[2].startswith("*")
+        self.weekday_restricted = not fields[4].startswith("*")
+
+    def _parseValue(self, value, name, names):
+        """
+        Convert field value (number or name) to number.
+        """
+        if value in names:
+            # Months are numbered from 1, weekdays from 0
+            return names.index(value) + (1 if name == "month" else 0)
+        if not value.isdigit():
+            raise CronError('Value "' + value + '" of field ' + name + ' is invalid in "' + self.definition + '"')
+        return int(value)
+
+    def _parseField(self, field, name, min_value, max_value, names):
+        """
+        Convert field to set of allowed values.
+        :return: Frozenset - Allowed values
+        """
+        allowed = set()
+        for part in field.split(","):
+            match = re.match(r'^(\*|[a-z0-9]+)(?:-([a-z0-9]+))?(?:/(\d+))?$', part)
+            if not match:
+                raise CronError('Field ' + name + ' is invalid in "' + self.definition + '"')
+            if match.group(1) == "*":
+                start, end = min_value, max_value
+            else:
+                start = self._parseValue(match.group(1), name, names)
+                end = self._parseValue(match.group(2), name, names) if match.group(2) else start
+                # Single value with step ("5/15") means range from value to max
+                if match.group(3) and not match.group(2):
+                    end = max_value
+            step = int(match.group(3)) if match.group(3) else 1
+            if not min_value <= start <= end <= max_value or step < 1:
+                raise CronError('Field ' + name + ' is out of range in "' + self.definition + '"')
+            allowed.update(range(start, end + 1, step))
+        return frozenset(allowed)
+
+    def matches(self, moment):
+        """
+        Check if task is due at the minute.
+        :param moment: Object of class datetime.datetime
+        :return: Bool
+        """
+        if moment.minute not in self.minutes or moment.hour not in self.hours or moment.month not in self.months:
+            return False
+        day_matches = moment.day in self.days
+        # Python weekday: Monday is 0, cron weekday: Sunday is 0
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+
+class TaskLock:
+    """
+    Non-blocking lock of cron task, shared by all processes (lock file is locked with flock).
+    """
+
+    def __init__(self, path):
+        """
+        :param path: String - Path to lock file
+        """
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """
+        Try to lock task.
+        :return: Bool - True if lock is taken, False if task is already running
+        """
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def release(self):
+        """
+        Unlock task.
+        """
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class CronScheduler:
+    """
+    Runs due cron tasks every minute in thread pool.
+    """
+
+    # Max count of simultaneously running tasks
+    max_workers = 2
+
+    def __init__(self, load_config, run_task, lock_path, max_workers=2):
+        """
+        :param load_config: Callable - Function without arguments, which returns current config (see gcconfig.loadConfig)
+        :param run_task: Callable - Function (config, task name, task params), which executes task
+        :param lock_path: String - Directory of task lock files
+        :param max_workers: Int - Max count of simultaneously running tasks
+        """
+        self.load_config = load_config
+        self.run_task = run_task
+        self.lock_path = lock_path
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        # Parsed definitions in format {"cron definition": CronExpression, ...}
+        self._expressions = {}
+        # Tasks, running in this process
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def getExpression(self, definition):
+        """
+        Get parsed cron definition (definitions are parsed once).
+        :param definition: String - Cron definition
+        :return: Object of class CronExpression
+        """
+        if definition not in self._expressions:
+            self._expressions[definition] = CronExpression(definition)
+        return self._expressions[definition]
+
+    def getDueTasks(self, config, moment):
+        """
+        Get tasks, which must be started at the minute.
+        :param config: Object of class ConfigSnapshot
+        :param moment: Object of class datetime.datetime
+        :return: List - Task names
+        """
+        due = []
+        for cron_task_name, cron_task in config.get("cron", {}).items():
+            if not cron_task.get("active", True):
+                continue
+            if moment.strftime("%Y.%m.%d") in cron_task["exclude_days"]:
+                continue
+            try:
+                expression = self.getExpression(cron_task["cron_definition"])
+            except CronError as e:
+                logging.error('Cron task ' + cron_task_name + ' is skipped: ' + str(e))
+                continue
+            if expression.matches(moment):
+                due.append(cron_task_name)
+        return due
+
+    def start(self, config, cron_task_name):
+        """
+        Start task in thread pool, if it is not running already.
+        :param config: Object of class ConfigSnapshot
+        :param cron_task_name: String - Task name
+        :return: Bool - True if task is started
+        """
+        with self._running_lock:
+            if cron_task_name in self._running:
+                logging.warning('Cron task ' + cron_task_name + ' is still running, run is skipped.')
+                return False
+            self._running.add(cron_task_name)
+        self._executor.submit(self._run, config, cron_task_name)
+        return True
+
+    def _run(self, config, cron_task_name):
+        """
+        Execute task under lock.
+        """
+        lock = TaskLock(os.path.join(self.lock_path, "cron_" + cron_task_name + ".lock"))
+        try:
+            if not lock.acquire():
+                logging.warning('Cron task ' + cron_task_name + ' is running in other process, run is skipped.')
+                return
+            try:
+                result = self.run_task(config, cron_task_name, config["cron"][cron_task_name])
+                logging.info('Cron task ' + cron_task_name + ' is finished: ' + str(result)[:200])
+            except SystemExit:
+                pass
+            except Exception:
+                logging.error('Cron task ' + cron_task_name + ' failed: ' + traceback.format_exc())
+            finally:
+                lock.release()
+        finally:
+            with self._running_lock:
+                self._running.discard(cron_task_name)
+
+    def stop(self):
+        """
+        Stop scheduling (running tasks are finished).
+        """
+        self._stopping.set()
+
+    def run(self):
+        """
+        Schedule tasks every minute until stop() is called.
+        """
+        moment = datetime.datetime.now().replace(second=0, microsecond=0)
+        while not self._stopping.is_set():
+            try:
+                config = self.load_config()
+                for cron_task_name in self.getDueTasks(config, moment):
+                    self.start(config, cron_task_name)
+            except Exception:
+                logging.error('Cron scheduler error: ' + traceback.format_exc())
+
+            # Wait for the next minute. If process was suspended, missed minutes are not caught up.
+            moment += datetime.timedelta(minutes=1)
+            now = datetime.datetime.now()
+            if now - moment >= datetime.timedelta(minutes=1):
+                moment = now.replace(second=0, microsecond=0)
+            else:
+                self._stopping.wait(max(0.0, (moment - now).total_seconds()))
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of DeliveryDeduplicator class
+import collections
+import sqlite3
+import threading
+import time
+
+
+class DeliveryDeduplicator:
+    """
+    Filter of repeated Github webhook deliveries by X-GitHub-Delivery header.
+    Github resends delivery after timeout and on "Redeliver" button click with the same delivery id,
+    so processed ids are remembered for ttl seconds and repeated deliveries are dropped before payload is parsed.
+
+    Ids, recently registered by the process, are kept in its bounded in-memory LRU, all ids are kept
+    in SQLite database (WAL mode), shared by all web server processes. Id is registered atomically, so when several processes
+    get the same delivery simultaneously, only one of them processes it.
+    """
+
+    # Path to SQLite database file
+    path = ""
+    # Seconds, during which delivery id is remembered
+    ttl = 86400
+    # Count of ids, kept in memory of process
+    lru_size = 1024
+    # Expired ids are removed from database once per this count of registered ids
+    prune_interval = 1000
+
+    def __init__(self, path, ttl=86400, lru_size=1024):
+        """
+        Open (and create if needed) deduplication database.
+        :param path: String - Path to SQLite database file
+        :param ttl: Int - Seconds, during which delivery id is remembered
+        :param lru_size: Int - Count of ids, kept in memory of process
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self._lock = threading.Lock()
+        # Recently seen ids in format {"delivery id": seen time, ...} (the oldest first)
+        self._recent = collections.OrderedDict()
+        self._registered = 0
+        self._connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries (id TEXT PRIMARY KEY, seen_at REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def isDuplicate(self, delivery_id):
+        """
+        Check delivery id and register it, if it is new.
+        :param delivery_id: String - X-GitHub-Delivery header value
+        :return: Bool - True if delivery is already registered (by this or other process) and must be dropped
+        """
+        now = time.time()
+        with self._lock:
+            seen_at = self._recent.get(delivery_id)
+            if seen_at is not None and seen_at > now - self.ttl:
+                self._recent.move_to_end(delivery_id)
+                return True
+
+            # Insert new id or take over expired one. No row is changed, if id is registered and not expired.
+            cursor = self._connection.execute(
+                "INSERT INTO deliveries (id, seen_at) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET seen_at = excluded.seen_at WHERE seen_at <= ?",
+                (delivery_id, now, now - self.ttl)
+            )
+            duplicate = cursor.rowcount == 0
+
+            # Only ids, registered by this process, are cached, so forget() of other process is not hidden by cache
+            if not duplicate:
+                self._recent[delivery_id] = now
+                if len(self._recent) > self.lru_size:
+                    self._recent.popitem(last=False)
+                self._registered += 1
+                if self._registered % self.prune_interval == 0:
+                    self._connection.execute("DELETE FROM deliveries WHERE seen_at <= ?", (now - self.ttl,))
+        return duplicate
+
+    def forget(self, delivery_id):
+        """
+        Unregister delivery id, so redelivery is processed (if processing of delivery failed).
+        :param delivery_id: String - X-GitHub-Delivery header value
+        """
+        with self._lock:
+            self._recent.pop(delivery_id, None)
+            self._connection.execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
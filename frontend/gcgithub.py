@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of GithubClient class
+import concurrent.futures
+import hashlib
+import json
+import math
+import re
+import threading
+import urllib.parse
+import cwtransport
+import gcmetrics
+
+
+class GithubClient:
+    """
+    Minimal Github REST API client for cron tasks, working through pooled cwtransport sessions.
+
+    Issue search is batched: search terms are combined with OR into the fewest queries, allowed by Github
+    (max 5 AND/OR/NOT operators and 256 characters of search text per query), all queries and all pages
+    of results are fetched concurrently and items are deduplicated by url. Search API allows 30 requests
+    per minute, so count of requests does not grow with count of search terms.
+
+    If cache (object of class HttpCache) is set, requests are conditional: unchanged responses are answered
+    by Github with "304 Not Modified", which is not counted against rate limit, and taken from the cache.
+    """
+
+    # Github API url
+    api_url = "https://api.github.com"
+    # Request timeout in seconds
+    timeout = 30
+    # Results per page (max allowed by Github)
+    per_page = 100
+    # Max count of AND/OR/NOT operators in search query
+    max_query_operators = 5
+    # Max length of search text (qualifiers, such as "repo:", are not counted)
+    max_query_length = 256
+    # Max count of search results, returned by Github for one query
+    max_search_results = 1000
+    # Max count of simultaneous requests
+    max_workers = 4
+
+    def __init__(self, token, api_url="https://api.github.com", timeout=30, metric_labels=None, cache=None):
+        """
+        :param token: String - Github API token
+        :param api_url: String - Github API url
+        :param timeout: Int - Request timeout in seconds
+        :param metric_labels: Dict - Labels of request metrics (for example, {"task": "ready_pr"})
+        :param cache: Object of class HttpCache or None
+        """
+        self.token = token
+        self.api_url = api_url
+        self.timeout = timeout
+        self.metric_labels = dict(metric_labels or {})
+        self.cache = cache
+        # Count of requests, sent by this client
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def request(self, path, params=None, use_cache=True):
+        """
+        Send GET request to Github API.
+        :param path: String - API path (for example, "/search/issues")
+        :param params: Dict - Query parameters
+        :param use_cache: Bool - Send conditional request, if cache is set
+        :return: Dict - Decoded response
+        """
+        headers = {
+            "Authorization": "token " + self.token,
+            "Accept": "application/vnd.github+json"
+        }
+        cache_key = None
+        if self.cache is not None and use_cache:
+            # Responses depend on token permissions (token itself is not stored)
+            cache_key = hashlib.sha1(self.token.encode('utf-8')).hexdigest()[:16] + " " + self.api_url + path + \
+                "?" + urllib.parse.urlencode(sorted((params or {}).items()))
+            headers.update(self.cache.getValidators(cache_key))
+
+        with self._calls_lock:
+            self.calls += 1
+        with gcmetrics.timer("gcbot_github_request_duration_seconds", self.metric_labels):
+            response = cwtransport.request("GET", self.api_url + path, self.timeout, params=params, headers=headers)
+        gcmetrics.inc("gcbot_github_requests_total", self.metric_labels)
+
+        if cache_key is not None:
+            if response.status_code == 304:
+                body = self.cache.hit(cache_key)
+                gcmetrics.inc("gcbot_github_cache_total", {"result": "hit"})
+                if body is not None:
+                    return json.loads(body)
+                # Entry is removed meanwhile, request full response
+                return self.request(path, params, False)
+            response.raise_for_status()
+            self.cache.store(cache_key, response.headers, response.content)
+            gcmetrics.inc("gcbot_github_cache_total", {"result": "miss"})
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def _isSingleTerm(term):
+        """
+        Check if search term can be combined with others by OR without changing its meaning
+        (term without spaces or quoted phrase, which is not operator itself).
+        :param term: String - Search term
+        :return: Bool
+        """
+        if term.upper() in ("AND", "OR", "NOT"):
+            return False
+        return bool(re.match(r'^(?:"[^"]*"|[^\s"]+)$', term))
+
+    def buildSearchQueries(self, terms, qualifiers):
+        """
+        Combine search terms with OR into the fewest queries.
+        :param terms: List - Search terms (for example, ["[ready]", "[review]"])
+        :param qualifiers: String - Qualifiers, added to every query (for example, "is:pr is:open repo:owner/name")
+        :return: List - Search queries
+        """
+        queries = []
+        group = []
+        for term in terms:
+            term = term.strip()
+            if not term:
+                continue
+            # Term of several words can not be combined: OR would bind only to its last word
+            if not self._isSingleTerm(term):
+                queries.append(term + " " + qualifiers)
+                continue
+            text = " OR ".join(group + [term])
+            if group and (len(group) > self.max_query_operators or len(text) > self.max_query_length):
+                queries.append(" OR ".join(group) + " " + qualifiers)
+                group = []
+            group.append(term)
+        if group:
+            queries.append(" OR ".join(group) + " " + qualifiers)
+        return queries
+
+    def searchIssues(self, queries):
+        """
+        Search issues and pull requests by several queries. All pages are fetched concurrently.
+        :param queries: List - Search queries (see buildSearchQueries)
+        :return: List - Found items (issue objects of Github API), deduplicated by "html_url" and sorted by it
+        """
+        items = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            first_pages = list(executor.map(lambda query: self._searchPage(query, 1), queries))
+
+            # Count of pages is known from the first page of every query
+            futures = []
+            for query, first_page in zip(queries, first_pages):
+                total = min(first_page.get("total_count", 0), self.max_search_results)
+                for page in range(2, int(math.ceil(total / float(self.per_page))) + 1):
+                    futures.append(executor.submit(self._searchPage, query, page))
+
+            pages = first_pages + [future.result() for future in futures]
+
+        for page in pages:
+            for item in page.get("items", []):
+                items[item["html_url"]] = item
+        return [items[url] for url in sorted(items)]
+
+    def _searchPage(self, query, page):
+        """
+        Fetch one page of search results.
+        :param query: String - Search query
+        :param page: Int - Page number (starting from 1)
+        :return: Dict - Search response {"total_count", "items"}
+        """
+        return self.request("/search/issues", {"q": query, "per_page": self.per_page, "page": page})
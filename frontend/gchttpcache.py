@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of HttpCache class
+import sqlite3
+import threading
+import time
+
+
+class HttpCache:
+    """
+    On-disk cache of HTTP responses for conditional requests (SQLite database in WAL mode).
+    Response is stored with its ETag / Last-Modified validators, next request for the same url is sent with
+    If-None-Match / If-Modified-Since headers and "304 Not Modified" response is answered from the cache
+    (Github does not count 304 responses against rate limit).
+
+    Entries, which were not used for ttl seconds, are removed. If total size of stored bodies exceeds max_size,
+    least recently used entries are removed.
+    """
+
+    # Path to SQLite database file
+    path = ""
+    # Seconds, after which unused entry is removed
+    ttl = 86400
+    # Max total size of stored bodies in bytes
+    max_size = 50 * 1024 * 1024
+
+    def __init__(self, path, ttl=86400, max_size=50 * 1024 * 1024):
+        """
+        Open (and create if needed) cache database.
+        :param path: String - Path to SQLite database file
+        :param ttl: Int - Seconds, after which unused entry is removed
+        :param max_size: Int - Max total size of stored bodies in bytes
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        # Count of requests, answered from the cache (304 responses), and requests, which got full response
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, etag TEXT NOT NULL, last_modified TEXT NOT NULL, body BLOB NOT NULL, "
+            "size INTEGER NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used_at)")
+        self.prune()
+
+    def getValidators(self, key):
+        """
+        Get conditional request headers for stored response.
+        :param key: String - Request key (url with query string and credentials identifier)
+        :return: Dict - Headers {"If-None-Match": ..., "If-Modified-Since": ...}, empty if response is not stored
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified FROM entries WHERE key = ? AND used_at > ?", (key, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return {}
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def hit(self, key):
+        """
+        Get stored body for "304 Not Modified" response.
+        :param key: String - Request key
+        :return: Bytes - Stored response body or None, if entry is removed meanwhile
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT body FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE entries SET used_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return bytes(row[0])
+
+    def store(self, key, headers, body):
+        """
+        Store full response, if it has validators.
+        :param key: String - Request key
+        :param headers: Dict - Response headers
+        :param body: Bytes - Response body
+        """
+        etag = headers.get("ETag", "")
+        last_modified = headers.get("Last-Modified", "")
+        with self._lock:
+            self.misses += 1
+            if (not etag and not last_modified) or len(body) > self.max_size:
+                return
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, etag, last_modified, body, size, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, etag, last_modified, body, len(body), time.time())
+            )
+        self.prune()
+
+    def prune(self):
+        """
+        Remove expired entries and least recently used entries over max_size.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM entries WHERE used_at <= ?", (time.time() - self.ttl,))
+            total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_size:
+                return
+            removed = []
+            for key, size in self._connection.execute("SELECT key, size FROM entries ORDER BY used_at"):
+                if total <= self.max_size:
+                    break
+                removed.append((key,))
+                total -= size
+            self._connection.executemany("DELETE FROM entries WHERE key = ?", removed)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of AccountIndex class
+import types
+import gcmention
+
+
+class AccountIndex:
+    """
+    Immutable lookup index, compiled once from chatwork_github_account_map
+    (format {"github account": {"chatwork_account": "123456", "chatwork_rooms": ["36410221", ...]}, ...}).
+    Replaces linear scans over account map with dictionary lookups.
+    """
+
+    # Account map, from which index is compiled (used to detect map replacement)
+    source = None
+    # Account settings in format {"github account": {"chatwork_account": ..., "chatwork_rooms": ...}, ...}
+    settings_by_github = types.MappingProxyType({})
+    # Chatwork user ids in format {"github account": "chatwork account id", ...}
+    chatwork_id_by_github = types.MappingProxyType({})
+    # Chatwork "icon+username" codes in format {"github account": "[piconname:123456]", ...}
+    usericon_by_github = types.MappingProxyType({})
+    # Personal Chatwork rooms in format {"chatwork account id": ("36410221", ...), ...}
+    rooms_by_chatwork_id = types.MappingProxyType({})
+    # Extractor of @mentions of accounts from this map
+    mention_extractor = None
+    # True if at least one account has personal rooms (messages of any repository can be routed to them)
+    has_account_rooms = False
+
+    def __init__(self, chatwork_github_account_map):
+        """
+        Compile index.
+        :param chatwork_github_account_map: Dict - Account map from config.json
+        """
+        settings_by_github = {}
+        chatwork_id_by_github = {}
+        usericon_by_github = {}
+        rooms_by_chatwork_id = {}
+
+        for github_account, account_settings in chatwork_github_account_map.items():
+            chatwork_account = account_settings['chatwork_account']
+            settings_by_github[github_account] = types.MappingProxyType(dict(account_settings))
+            chatwork_id_by_github[github_account] = chatwork_account
+            usericon_by_github[github_account] = '[piconname:' + str(chatwork_account) + ']'
+            rooms_by_chatwork_id[chatwork_account] = rooms_by_chatwork_id.get(chatwork_account, ()) + \
+                tuple(str(room_id) for room_id in account_settings.get('chatwork_rooms', []))
+
+        self.source = chatwork_github_account_map
+        self.settings_by_github = types.MappingProxyType(settings_by_github)
+        self.chatwork_id_by_github = types.MappingProxyType(chatwork_id_by_github)
+        self.usericon_by_github = types.MappingProxyType(usericon_by_github)
+        self.rooms_by_chatwork_id = types.MappingProxyType(rooms_by_chatwork_id)
+        self.has_account_rooms = any(rooms_by_chatwork_id.values())
+        self.mention_extractor = gcmention.MentionExtractor(settings_by_github.keys())
+
+
+# Last compiled index. Long-running processes (worker, cron scheduler) reuse the same account map object,
+# so index is compiled once per process.
+_last_index = None
+
+
+def getAccountIndex(chatwork_github_account_map):
+    """
+    Get compiled index of account map. Index is compiled again only if another map object is passed.
+    :param chatwork_github_account_map: Dict - Account map from config.json
+    :return: Object of class AccountIndex
+    """
+    global _last_index
+    index = _last_index
+    if index is None or index.source is not chatwork_github_account_map:
+        index = AccountIndex(chatwork_github_account_map)
+        _last_index = index
+    return index
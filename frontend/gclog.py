@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Non-blocking logging of all entry points (index.py, worker.py, cron.py, deadletter.py).
+# Log records are put to in-memory queue by calling thread, formatting and file writes are done by listener thread,
+# so disk I/O is not on request path. Lines are JSON objects with time, level, message and fields
+# (event, delivery id, repository, timings etc, see GithubChatworkBot._log), or text lines ("format": "text").
+# Log file is rotated by size and time. Several processes may write the same file: rotation is done under file lock
+# by one of them, others reopen the file, when they notice that it is moved.
+# Payloads are kept by payload archive (see gcarchive.py). If archive is disabled, full payloads are logged
+# only for "payload_sample_rate" share of deliveries (see capturePayload()).
+#
+# Usage:
+#   gclog.configure(log_path, config.get("log", {}))
+#   logging.info("Message is sent.", extra={"fields": {"room": room_id, "duration_ms": 12}})
+
+import atexit
+import copy
+import fcntl
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+# Share of deliveries, which payloads are logged (0 - payloads are not logged, 1 - every payload)
+payload_sample_rate = 0.0
+
+# Current settings, queue listener and file handler
+_settings = None
+_listener = None
+_handler = None
+# Guards reconfiguration: request threads of the same process call configure() simultaneously
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats record as one-line JSON object {"time", "level", "message", "process", ...fields}.
+    """
+
+    def format(self, record):
+        line = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + ".%03d" % record.msecs +
+                    time.strftime("%z", time.localtime(record.created)),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if record.name != "root":
+            line["logger"] = record.name
+        line.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler, which leaves formatting to listener thread. Only message arguments are merged on calling thread
+    (caller may change them after logging call), exception info is passed as is, so traceback is formatted
+    by listener thread and JsonFormatter writes it as "exception" field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Formats record as text line "time level message key=value ...".
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(key + "=" + json.dumps(value, ensure_ascii=False, default=str) for key, value in fields.items())
+        return text
+
+
+class RotatingLogHandler(logging.handlers.WatchedFileHandler):
+    """
+    Log file handler, which rotates file when it exceeds max_bytes or when rotate_interval period is over
+    (periods are aligned to local midnight). Rotated files are named "log.txt.YYYYmmdd-HHMMSS",
+    only backup_count newest of them are kept.
+    """
+
+    def __init__(self, filename, max_bytes=0, rotate_interval=0, backup_count=7):
+        """
+        :param filename: String - Path to log file
+        :param max_bytes: Int - Max file size in bytes (0 - file is not rotated by size)
+        :param rotate_interval: Int - Rotation period in seconds (0 - file is not rotated by time)
+        :param backup_count: Int - Count of kept rotated files
+        """
+        super().__init__(filename, encoding="utf-8")
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.rollover_at = self._getRolloverAt(self._getFileTime())
+
+    def _getFileTime(self):
+        """
+        Get time of the last write into current file (now for new file).
+        """
+        stat = os.fstat(self.stream.fileno())
+        return stat.st_mtime if stat.st_size else time.time()
+
+    def _getRolloverAt(self, moment):
+        """
+        Get end of rotation period, which includes the moment.
+        :param moment: Float - Timestamp
+        :return: Float - Timestamp or None, if file is not rotated by time
+        """
+        if not self.rotate_interval:
+            return None
+        local = time.localtime(moment)
+        midnight = moment - (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec)
+        return midnight + (int((moment - midnight) // self.rotate_interval) + 1) * self.rotate_interval
+
+    def _shouldRollover(self):
+        """
+        Check if current file must be rotated.
+        """
+        if self.stream is None:
+            return False
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(self.max_bytes) and os.fstat(self.stream.fileno()).st_size >= self.max_bytes
+
+    def _rollover(self):
+        """
+        Rename current file (unless other process has already done it) and open new one.
+        """
+        with open(self.baseFilename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    moved = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+                except FileNotFoundError:
+                    moved = True
+                if not moved:
+                    name = self.baseFilename + "." + time.strftime("%Y%m%d-%H%M%S")
+                    suffix = 1
+                    while os.path.exists(name + ("-" + str(suffix) if suffix > 1 else "")):
+                        suffix += 1
+                    os.rename(self.baseFilename, name + ("-" + str(suffix) if suffix > 1 else ""))
+                    self._removeBackups()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self.stream.close()
+        self.stream = self._open()
+        self._statstream()
+        self.rollover_at = self._getRolloverAt(time.time())
+
+    def _removeBackups(self):
+        """
+        Remove rotated files over backup_count (oldest first).
+        """
+        directory, name = os.path.split(self.baseFilename)
+        pattern = re.compile(re.escape(name) + r'\.\d{8}-\d{6}(-\d+)?$')
+        backups = sorted(
+            (os.path.join(directory, file_name) for file_name in os.listdir(directory or ".") if pattern.match(file_name)),
+            key=os.path.getmtime
+        )
+        for backup in backups[:max(0, len(backups) - self.backup_count)]:
+            os.remove(backup)
+
+    def emit(self, record):
+        try:
+            if self._shouldRollover():
+                self._rollover()
+        except Exception:
+            self.handleError(record)
+        super().emit(record)
+
+
+def configure(log_path, log_config):
+    """
+    Route records of root logger through queue to log file. Called again with the same settings, does nothing,
+    so it can be called for every request or worker loop.
+    :param log_path: String - Path to log file
+    :param log_config: Dict - "log" section of config.json {"format": "json", "level": "INFO", "max_bytes": 10485760,
+                       "rotate_interval": 86400, "backup_count": 14, "payload_sample_rate": 0}
+    """
+    global payload_sample_rate, _settings, _listener, _handler
+    payload_sample_rate = log_config.get("payload_sample_rate", 0.0)
+    settings = (
+        log_path, log_config.get("format", "json"), log_config.get("level", "INFO"), log_config.get("max_bytes", 10 * 1024 * 1024),
+        log_config.get("rotate_interval", 86400), log_config.get("backup_count", 14)
+    )
+    if settings == _settings:
+        return
+
+    with _lock:
+        # Other thread may have applied the same settings, while this one waited for the lock
+        if settings == _settings:
+            return
+
+        log_format, level, max_bytes, rotate_interval, backup_count = settings[1:]
+        handler = RotatingLogHandler(log_path, max_bytes, rotate_interval, backup_count)
+        handler.setFormatter(TextFormatter() if log_format == "text" else JsonFormatter())
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        if _listener is None:
+            # Records are formatted to text by listener thread, calling thread only puts them to the queue
+            records = queue.SimpleQueue()
+            for previous_handler in list(root.handlers):
+                root.removeHandler(previous_handler)
+            root.addHandler(RecordQueueHandler(records))
+            _listener = logging.handlers.QueueListener(records, handler)
+            _listener.start()
+            # Queued records are written before process exit
+            atexit.register(stop)
+        else:
+            # Records, queued before reconfiguration, are written by previous handler
+            _listener.stop()
+            _handler.close()
+            _listener.handlers = (handler,)
+            _listener.start()
+        _handler = handler
+        _settings = settings
+
+
+def ensureConfigured(log_path):
+    """
+    Route records to log file with default settings, unless logging is already configured
+    (entry points call it before config is loaded, so config errors are logged too).
+    :param log_path: String - Path to log file
+    """
+    if _settings is None:
+        configure(log_path, {})
+
+
+def stop():
+    """
+    Write queued records and stop listener thread.
+    """
+    global _settings, _listener, _handler
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _handler.close()
+            for handler in list(logging.getLogger().handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    logging.getLogger().removeHandler(handler)
+            _settings = _listener = _handler = None
+
+
+def capturePayload(payload_json, fields=None):
+    """
+    Log full payload of sampled delivery (see payload_sample_rate).
+    :param payload_json: String or Bytes - Payload json, incoming from Github
+    :param fields: Dict - Log fields (event, delivery id etc)
+    :return: Bool - True if payload is logged
+    """
+    if not payload_sample_rate or random.random() >= payload_sample_rate:
+        return False
+    if isinstance(payload_json, bytes):
+        payload_json = payload_json.decode('utf-8', 'replace')
+    logging.info('Payload sample.', extra={"fields": dict(fields or {}, payload=payload_json)})
+    return True
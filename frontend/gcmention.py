@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of MentionExtractor class
+import re
+
+# Characters of github login (Github allows letters, digits and hyphens, account maps also contain underscores).
+# Other characters, which are used in logins of account map, are added to them by MentionExtractor.
+LOGIN_CHARACTERS = "A-Za-z0-9_-"
+# Github @mention token ({characters} are login characters).
+# "@" must not be glued to latin word, url path or e-mail ("bob@example.com", "medium.com/@bob"), login takes all
+# following login characters, so "@bob" does not match inside "@bobby" or "@bob_acme".
+# Pattern has one quantifier over one character class, so scan is linear in text length.
+MENTION_PATTERN = r'(?<![A-Za-z0-9_.@/+-])@([{characters}]+)'
+
+
+class MentionExtractor:
+    """
+    Finds @login mentions of known github accounts in text with one pass of MENTION_PATTERN.
+    Found tokens are checked against account dictionary, so cost does not depend on count of accounts.
+    """
+
+    # Known github accounts in format {"lowercase login": "login as written in account map", ...}
+    _accounts = {}
+    # Compiled MENTION_PATTERN with login characters of known accounts
+    _pattern = None
+
+    def __init__(self, github_accounts):
+        """
+        :param github_accounts: Iterable - Github account names from chatwork_github_account_map
+        """
+        # Github logins are case-insensitive
+        self._accounts = {github_account.lower(): github_account for github_account in github_accounts}
+        # Characters of mapped logins, which are not usual login characters (both cases, text may differ in case)
+        extra_characters = set(re.sub(r'[A-Za-z0-9_-]', '', "".join(self._accounts.values()) + "".join(self._accounts)))
+        extra_characters |= {character.upper() for character in extra_characters}
+        self._pattern = re.compile(MENTION_PATTERN.format(
+            characters=LOGIN_CHARACTERS + "".join(re.escape(character) for character in sorted(extra_characters))
+        ))
+
+    def extract(self, text):
+        """
+        Find mentioned known github accounts.
+        :param text: String - Contents of comment, issue or PR body
+        :return: List - Github account names (as written in account map) in order of first mention, without duplicates
+        """
+        if not text or '@' not in text:
+            return []
+
+        mentioned = {}
+        for match in self._pattern.finditer(text):
+            login = match.group(1).lower()
+            # Login may be followed by punctuation, which is also login character (for example, "@bob_.")
+            github_account = self._accounts.get(login) or self._accounts.get(login.rstrip("_-."))
+            if github_account is not None:
+                mentioned[github_account] = True
+        return list(mentioned)
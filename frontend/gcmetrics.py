@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Latency and throughput metrics of webhook and cron processing, exposed in Prometheus text format
+# (see "/metrics" route in mod.wsgi).
+#
+# Every process accumulates metrics in memory and periodically adds them to shared SQLite database (see configure()),
+# so metrics of all web server processes, worker and cron runs are summed up. Without configure() metrics
+# are only kept in memory of current process.
+#
+# Usage:
+#   with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "parse"}):
+#       ...
+#   gcmetrics.inc("gcbot_chatwork_requests_total", {"transport": "api", "result": "success"})
+
+import atexit
+import sqlite3
+import threading
+import time
+
+# Metric definitions in format {"name": ("counter" or "histogram", "help text"), ...}
+METRICS = {
+    "gcbot_webhook_duration_seconds": ("histogram", "Webhook processing duration by event type"),
+    "gcbot_webhook_events_total": ("counter", "Processed webhook events by event type and result"),
+    "gcbot_webhook_rejected_total": ("counter", "Webhook events, rejected before payload decoding, by reason"),
+    "gcbot_webhook_duplicates_total": ("counter", "Github redeliveries, dropped by X-GitHub-Delivery header"),
+    "gcbot_stage_duration_seconds": ("histogram", "Duration of webhook and cron processing stages"),
+    "gcbot_chatwork_request_duration_seconds": ("histogram", "Chatwork request duration by transport (ui/api) and room"),
+    "gcbot_chatwork_requests_total": ("counter", "Chatwork requests by transport (ui/api) and result"),
+    "gcbot_chatwork_ratelimit_wait_seconds": ("histogram", "Time, spent waiting for Chatwork rate limit budget"),
+    "gcbot_chatwork_retries_total": ("counter", "Retried Chatwork requests by failure kind"),
+    "gcbot_chatwork_dead_letters_total": ("counter", "Chatwork requests, moved to dead letter store, by failure kind"),
+    "gcbot_chatwork_login_duration_seconds": ("histogram", "Chatwork UI login and access token refresh duration"),
+    "gcbot_github_request_duration_seconds": ("histogram", "Github API request duration by cron task"),
+    "gcbot_github_requests_total": ("counter", "Github API requests by cron task"),
+    "gcbot_github_cache_total": ("counter", "Github conditional requests by result (hit - 304 response, miss - full response)"),
+    "gcbot_cron_task_duration_seconds": ("histogram", "Cron task duration"),
+}
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Path to shared SQLite database ("" - metrics are kept in memory only)
+path = ""
+# Min interval in seconds between writes to shared database
+flush_interval = 5
+
+# Not flushed values in format {(sample name, labels string, "le" value): value, ...}
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = time.time()
+_connection = None
+
+
+def configure(metrics_path, metrics_flush_interval=5):
+    """
+    Set shared database. Pending values are also written on process exit.
+    :param metrics_path: String - Path to SQLite database file
+    :param metrics_flush_interval: Int - Min interval in seconds between writes
+    """
+    global path, flush_interval, _connection
+    if metrics_path == path:
+        return
+    path = metrics_path
+    flush_interval = metrics_flush_interval
+    _connection = None
+    atexit.register(flush, True)
+
+
+def _labelString(labels):
+    """
+    Convert labels to Prometheus format.
+    :param labels: Dict - Labels {"name": "value", ...}
+    :return: String - Labels string (example: 'event="issues",stage="parse"')
+    """
+    if not labels:
+        return ""
+    return ",".join(
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in sorted(labels.items())
+    )
+
+
+def inc(name, labels=None, value=1):
+    """
+    Increase counter.
+    :param name: String - Counter name (see METRICS)
+    :param labels: Dict - Labels {"name": "value", ...}
+    :param value: Int - Increment
+    """
+    key = (name, _labelString(labels), "")
+    with _pending_lock:
+        _pending[key] = _pending.get(key, 0) + value
+
+
+def observe(name, seconds, labels=None):
+    """
+    Add observation to histogram.
+    :param name: String - Histogram name (see METRICS)
+    :param seconds: Float - Observed duration
+    :param labels: Dict - Labels {"name": "value", ...}
+    """
+    label_string = _labelString(labels)
+    with _pending_lock:
+        for bucket in BUCKETS:
+            if seconds <= bucket:
+                key = (name + "_bucket", label_string, repr(bucket))
+                _pending[key] = _pending.get(key, 0) + 1
+        for key, value in (((name + "_bucket", label_string, "+Inf"), 1),
+                           ((name + "_count", label_string, ""), 1),
+                           ((name + "_sum", label_string, ""), seconds)):
+            _pending[key] = _pending.get(key, 0) + value
+
+
+class timer:
+    """
+    Context manager, which observes duration of its block in histogram.
+    Labels can be added inside the block: with timer(...) as t: t.labels["event"] = "issues"
+    """
+
+    def __init__(self, name, labels=None):
+        """
+        :param name: String - Histogram name (see METRICS)
+        :param labels: Dict - Labels {"name": "value", ...}
+        """
+        self.name = name
+        self.labels = dict(labels or {})
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+def _connect():
+    """
+    Open shared database once per process.
+    :return: Object of class sqlite3.Connection
+    """
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "name TEXT NOT NULL, labels TEXT NOT NULL, le TEXT NOT NULL, value REAL NOT NULL, "
+            "PRIMARY KEY (name, labels, le))"
+        )
+    return _connection
+
+
+def flush(force=False):
+    """
+    Add pending values to shared database (not more often than flush_interval, unless forced).
+    :param force: Bool - Write regardless of flush_interval
+    """
+    global _pending, _last_flush
+    if not path or not _pending:
+        return
+    if not force and time.time() - _last_flush < flush_interval:
+        return
+
+    with _pending_lock:
+        pending = _pending
+        _pending = {}
+        _last_flush = time.time()
+
+    try:
+        connection = _connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT INTO samples (name, labels, le, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value",
+                [key + (value,) for key, value in pending.items()]
+            )
+    except sqlite3.Error:
+        # Keep values for next try
+        with _pending_lock:
+            for key, value in pending.items():
+                _pending[key] = _pending.get(key, 0) + value
+
+
+def _sampleOrder(sample):
+    """
+    Sort key of sample: buckets in ascending order of upper bound, "+Inf" last.
+    """
+    name, labels, le, value = sample
+    return name, labels, float(le) if le else 0.0
+
+
+def render():
+    """
+    Render all metrics in Prometheus text exposition format.
+    :return: String - Metrics text
+    """
+    flush(True)
+    if path:
+        samples = _connect().execute("SELECT name, labels, le, value FROM samples").fetchall()
+    else:
+        with _pending_lock:
+            samples = [key + (value,) for key, value in _pending.items()]
+
+    lines = []
+    for name, (metric_type, help_text) in sorted(METRICS.items()):
+        if metric_type == "histogram":
+            names = (name + "_bucket", name + "_count", name + "_sum")
+        else:
+            names = (name,)
+        metric_samples = sorted((sample for sample in samples if sample[0] in names), key=_sampleOrder)
+        if not metric_samples:
+            continue
+
+        lines.append("# HELP " + name + " " + help_text)
+        lines.append("# TYPE " + name + " " + metric_type)
+        for sample_name, labels, le, value in metric_samples:
+            if le:
+                labels = (labels + "," if labels else "") + 'le="' + le + '"'
+            lines.append(sample_name + ("{" + labels + "}" if labels else "") + " " + repr(float(value)))
+    return "\n".join(lines) + "\n"
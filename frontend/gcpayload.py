@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Github webhook payload ingestion.
+# Request body is read from WSGI input by chunks with hard size cap, accepted as "application/json"
+# (recommended Github webhook content type) or "application/x-www-form-urlencoded" ("payload" field).
+# Only keys, used by GithubChatworkBot handlers, are kept in parsed payload: large unused parts
+# (commits, diffs, nested repository objects etc) are dropped right after payload is decoded.
+# Payload is decoded by plain json.loads (object hook, called for every object, is slower) and pruning walks
+# only kept keys.
+
+import json
+import re
+import urllib.parse
+
+# Keys, which are kept in parsed payload (on every nesting level)
+PAYLOAD_KEYS = frozenset((
+    "action", "issue", "pull_request", "comment", "repository", "sender", "assignee", "assignees",
+    "body", "commit_id", "html_url", "login", "name", "title", "user", "number", "merged",
+))
+# Leading "action" key of payload (Github puts it first)
+ACTION_PATTERN = re.compile(rb'\s*\{\s*"action"\s*:\s*"([a-z_]{1,64})"')
+# Name of top-level repository object (it is placed before nested objects of repository, such as "owner")
+REPOSITORY_NAME_PATTERN = re.compile(rb'"repository"\s*:\s*\{[^{}]*?"name"\s*:\s*"((?:[^"\\]|\\.){1,256})"')
+# Supported content types
+JSON_CONTENT_TYPE = "application/json"
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+# Max request body size in bytes
+max_size = 5 * 1024 * 1024
+# Size of chunks, by which body is read
+chunk_size = 64 * 1024
+
+
+class PayloadError(Exception):
+    """
+    Request body is too large, malformed or has unsupported format.
+    """
+    pass
+
+
+def configure(ingest_config):
+    """
+    Apply "ingest" section of config.json.
+    :param ingest_config: Dict - Ingest settings {"max_size": 5242880}
+    """
+    global max_size
+    max_size = ingest_config.get("max_size", max_size)
+
+
+def getContentType(env):
+    """
+    Get request content type without parameters.
+    :param env: Dict - WSGI environment
+    :return: String - Content type in lower case (example: "application/json")
+    """
+    return env.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+
+
+def readBody(env):
+    """
+    Read request body. Reading is stopped as soon as max_size is exceeded.
+    :param env: Dict - WSGI environment
+    :return: Bytes - Request body
+    :raise PayloadError: if body is larger than max_size
+    """
+    try:
+        content_length = int(env.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise PayloadError('Content-Length is malformed')
+    if content_length > max_size:
+        raise PayloadError('Payload size ' + str(content_length) + ' exceeds ' + str(max_size) + ' bytes')
+
+    stream = env['wsgi.input']
+    chunks = []
+    size = 0
+    # Without Content-Length body is read until end of stream (but not more than max_size)
+    left = content_length if content_length else max_size + 1
+    while left > 0:
+        chunk = stream.read(min(chunk_size, left))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        left -= len(chunk)
+    if size > max_size:
+        raise PayloadError('Payload size exceeds ' + str(max_size) + ' bytes')
+    return b"".join(chunks)
+
+
+def _unquoteFormValue(value):
+    """
+    Decode form field value by chunks (urllib decodes whole value at once through list of small pieces,
+    which takes many times more memory than value itself).
+    :param value: Bytes - Percent-encoded value
+    :return: Bytes - Decoded value
+    """
+    parts = []
+    start = 0
+    while start < len(value):
+        end = min(start + chunk_size, len(value))
+        if end < len(value):
+            # Do not split escape sequence "%XX" between chunks
+            escape = value.rfind(b"%", end - 2, end)
+            if escape != -1:
+                end = escape
+        parts.append(urllib.parse.unquote_to_bytes(value[start:end].replace(b"+", b" ")))
+        start = end
+    return b"".join(parts)
+
+
+def extractPayloadJson(content_type, body):
+    """
+    Get payload json from request body.
+    :param content_type: String - Request content type (see getContentType())
+    :param body: Bytes - Request body
+    :return: Bytes - Payload json or None, if body does not contain payload
+    :raise PayloadError: if content type is not supported
+    """
+    if content_type == JSON_CONTENT_TYPE:
+        return body or None
+    if content_type == FORM_CONTENT_TYPE:
+        # Fields are scanned in place, body is not split into copies
+        start = 0
+        while start < len(body):
+            end = body.find(b"&", start)
+            if end == -1:
+                end = len(body)
+            if body.startswith(b"payload=", start, end):
+                return _unquoteFormValue(body[start + len(b"payload="):end])
+            start = end + 1
+        return None
+    raise PayloadError('Content type "' + content_type + '" is not supported')
+
+
+def peekAction(payload_json):
+    """
+    Get payload action without json decoding.
+    :param payload_json: Bytes - Payload json
+    :return: String - Action or None, if it is not found at the beginning of payload
+    """
+    match = ACTION_PATTERN.match(payload_json, 0, 256)
+    if match is None:
+        return None
+    return match.group(1).decode('ascii')
+
+
+def peekRepositoryName(payload_json):
+    """
+    Get repository name without json decoding.
+    :param payload_json: Bytes - Payload json
+    :return: String - Repository name or None, if it is not found
+    """
+    match = REPOSITORY_NAME_PATTERN.search(payload_json)
+    if match is None:
+        return None
+    try:
+        return json.loads(b'"' + match.group(1) + b'"')
+    except ValueError:
+        return None
+
+
+def _prune(value):
+    """
+    Keep only keys, used by handlers, in decoded json value and its kept children.
+    :param value: Any - Decoded json value
+    :return: Any - Pruned value
+    """
+    if isinstance(value, dict):
+        return {key: _prune(child) for key, child in value.items() if key in PAYLOAD_KEYS}
+    if isinstance(value, list):
+        return [_prune(child) for child in value]
+    return value
+
+
+def parsePayload(payload_json):
+    """
+    Decode payload json, keeping only keys, used by handlers.
+    :param payload_json: String or Bytes - Payload json, incoming from Github
+    :return: Dict - Pruned payload
+    :raise PayloadError: if payload is not valid json object
+    """
+    try:
+        payload = json.loads(payload_json)
+    except ValueError as e:
+        raise PayloadError('Payload is not valid json: ' + str(e))
+    if not isinstance(payload, dict):
+        raise PayloadError('Payload is not json object')
+    return _prune(payload)
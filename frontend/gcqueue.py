@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Dependencies of DeliveryQueue class
+import sqlite3
+import threading
+import time
+
+
+class DeliveryQueue:
+    """
+    Crash-safe on-disk queue of Github webhook deliveries (SQLite database in WAL mode).
+    Webhook entry point (index.py) only appends deliveries with put() and answers Github immediately,
+    worker.py drains them with claim() and passes them to GithubChatworkBot.
+
+    Claimed delivery is hidden from other workers for lease_timeout seconds. If worker crashes before
+    ack() or fail() is called, delivery becomes available again after lease expiration. Delivery, which lease
+    expires after max_attempts claims (for example, delivery kills worker every time), is marked as failed.
+    Failed deliveries are kept for inspection (see deliveries.py) until they are requeued or purged.
+    """
+
+    # Delivery statuses
+    PENDING = "pending"
+    FAILED = "failed"
+
+    # Path to SQLite database file
+    path = ""
+    # Seconds, during which claimed delivery is invisible for other workers
+    lease_timeout = 300
+    # Count of failed attempts, after which delivery is marked as failed and not claimed anymore
+    max_attempts = 5
+    # Delay in seconds before failed delivery is retried (multiplied by attempts count)
+    retry_delay = 30
+    # SQLite "synchronous" pragma value. FULL survives power loss, NORMAL survives process crash only.
+    synchronous = "FULL"
+
+    def __init__(self, path, lease_timeout=300, max_attempts=5):
+        """
+        Open (and create if needed) queue database.
+        :param path: String - Path to SQLite database file
+        :param lease_timeout: Int - Seconds, during which claimed delivery is invisible for other workers
+        :param max_attempts: Int - Count of failed attempts, after which delivery is not claimed anymore
+        """
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=" + self.synchronous)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "event TEXT NOT NULL DEFAULT '', "
+            "payload TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "available_at REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "last_error TEXT NOT NULL DEFAULT '')"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS deliveries_available ON deliveries (status, available_at)"
+        )
+
+    def put(self, payload, event=""):
+        """
+        Append delivery to the queue.
+        :param payload: String - Raw payload json, incoming from Github
+        :param event: String - Github event name (X-GitHub-Event header), if known
+        :return: Int - Delivery id inside queue
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO deliveries (event, payload, created_at, available_at) VALUES (?, ?, ?, ?)",
+                (event, payload, now, now)
+            )
+        return cursor.lastrowid
+
+    def claim(self):
+        """
+        Take oldest available delivery and hide it from other workers for lease_timeout seconds.
+        Deliveries, which leases expired after max_attempts claims, are marked as failed instead.
+        :return: Dict - Delivery {"id", "event", "payload", "attempts"} or None, if queue is empty
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                # fail() marks such deliveries itself, so these are deliveries of crashed workers
+                self._connection.execute(
+                    "UPDATE deliveries SET status = 'failed', last_error = 'Lease expired after ' || attempts || ' attempts' "
+                    "WHERE status = 'pending' AND available_at <= ? AND attempts >= ?",
+                    (now, self.max_attempts)
+                )
+                row = self._connection.execute(
+                    "SELECT id, event, payload, attempts FROM deliveries "
+                    "WHERE status = 'pending' AND available_at <= ? ORDER BY available_at, id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row:
+                    self._connection.execute(
+                        "UPDATE deliveries SET available_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        (now + self.lease_timeout, row[0])
+                    )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        if not row:
+            return None
+        return {"id": row[0], "event": row[1], "payload": row[2], "attempts": row[3] + 1}
+
+    def ack(self, delivery_id):
+        """
+        Remove successfully processed delivery from the queue.
+        :param delivery_id: Int - Delivery id, returned by claim()
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
+
+    def fail(self, delivery_id, error):
+        """
+        Return delivery to the queue for later retry or mark it as failed, if max_attempts is exceeded.
+        :param delivery_id: Int - Delivery id, returned by claim()
+        :param error: String - Error description
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE deliveries SET "
+                "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "available_at = ? + attempts * ?, last_error = ? WHERE id = ?",
+                (self.max_attempts, now, self.retry_delay, str(error), delivery_id)
+            )
+
+    def size(self):
+        """
+        Count deliveries waiting for processing.
+        :return: Int - Count of pending deliveries
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM deliveries WHERE status = 'pending'").fetchone()[0]
+
+    def count(self):
+        """
+        Count deliveries by status.
+        :return: Dict - {"pending": count, "failed": count}
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall()
+        counts = {self.PENDING: 0, self.FAILED: 0}
+        counts.update(rows)
+        return counts
+
+    def get(self, delivery_id):
+        """
+        Get delivery with payload.
+        :param delivery_id: Int - Delivery id inside queue
+        :return: Dict - Delivery {"id", "event", "payload", "created_at", "attempts", "status", "last_error"} or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, event, payload, created_at, attempts, status, last_error FROM deliveries WHERE id = ?",
+                (delivery_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return dict(zip(("id", "event", "payload", "created_at", "attempts", "status", "last_error"), row))
+
+    def listFailed(self, limit=50):
+        """
+        Get failed deliveries (without payload), newest first.
+        :param limit: Int - Max count of deliveries
+        :return: List - Deliveries {"id", "event", "created_at", "attempts", "last_error"}
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, event, created_at, attempts, last_error FROM deliveries WHERE status = 'failed' "
+                "ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(("id", "event", "created_at", "attempts", "last_error"), row)) for row in rows]
+
+    def requeue(self, delivery_ids=None):
+        """
+        Return failed deliveries to the queue with reset attempts count.
+        :param delivery_ids: List - Delivery ids or None for all failed deliveries
+        :return: Int - Count of requeued deliveries
+        """
+        now = time.time()
+        query = "UPDATE deliveries SET status = 'pending', attempts = 0, available_at = ? WHERE status = 'failed'"
+        with self._lock:
+            if delivery_ids is None:
+                cursor = self._connection.execute(query, (now,))
+            else:
+                cursor = self._connection.executemany(query + " AND id = ?", [(now, delivery_id) for delivery_id in delivery_ids])
+        return cursor.rowcount
+
+    def purgeFailed(self, delivery_ids=None, before=None):
+        """
+        Remove failed deliveries.
+        :param delivery_ids: List - Delivery ids or None for all failed deliveries
+        :param before: Float - Remove only deliveries, queued before timestamp
+        :return: Int - Count of removed deliveries
+        """
+        query = "DELETE FROM deliveries WHERE status = 'failed' AND (? IS NULL OR created_at < ?)"
+        with self._lock:
+            if delivery_ids is None:
+                cursor = self._connection.execute(query, (before, before))
+            else:
+                cursor = self._connection.executemany(query + " AND id = ?", [(before, before, delivery_id) for delivery_id in delivery_ids])
+        return cursor.rowcount
@@ -4,42 +4,246 @@
 # Bot entry script.
 # Set url to this script as "Payload url" on Github repository configuration page "Webhooks & Services" tab.
 # See detailed documentation inside gcbot.py script.
+#
+# If "delivery_queue" is active in config.json, this script only validates payload and appends it
+# to delivery queue, so Github gets response immediately. Queue is drained by worker.py process.
+#
+# Webhook content type can be "application/json" (recommended) or "application/x-www-form-urlencoded".
+# Events, which are not handled (see gcbot.WEBHOOK_HANDLERS), and events of repositories, messages of which
+# can not be routed anywhere, are rejected before payload json is decoded.
 
 import logging
-import cgi
 import gcbot
+import cwtransport
+import gcqueue
+import gcdedup
+import gcconfig
+import gcmetrics
+import gcpayload
+import gclog
+import gcarchive
 import json
 import os
 
 here = os.path.dirname(__file__)
 config_path = os.path.normpath(here+'/../config.json')
+root_path = os.path.normpath(here+'/../')
 log_path = os.path.join(here, '../logs/log.txt')
 
-# Logger format and rooting
-logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", filename=log_path, filemode="a", level=logging.INFO)
+# Delivery queue exemplar, shared between requests of the same process
+delivery_queue = None
+# Delivery deduplicator exemplar, shared between requests of the same process
+deduplicator = None
+# Payload archive exemplar, shared between requests of the same process
+payload_archive = None
 
-def main(env):
+
+def getDeliveryQueue(queue_config):
+    """
+    Open delivery queue once per process.
+    :param queue_config: Dict - "delivery_queue" section of config
+    :return: Object of class DeliveryQueue
+    """
+    global delivery_queue
+    if delivery_queue is None:
+        delivery_queue = gcqueue.DeliveryQueue(
+            os.path.join(root_path, queue_config.get("path", "logs/queue.db")),
+            queue_config.get("lease_timeout", 300),
+            queue_config.get("max_attempts", 5)
+        )
+    return delivery_queue
+
+
+def getDeduplicator(dedup_config):
+    """
+    Open delivery deduplicator once per process.
+    :param dedup_config: Dict - "deduplication" section of config
+    :return: Object of class DeliveryDeduplicator
+    """
+    global deduplicator
+    if deduplicator is None:
+        deduplicator = gcdedup.DeliveryDeduplicator(
+            os.path.join(root_path, dedup_config.get("path", "logs/dedup.db")),
+            dedup_config.get("ttl", 86400),
+            dedup_config.get("lru_size", 1024)
+        )
+    return deduplicator
+
+
+def getPayloadArchive(archive_config):
+    """
+    Open payload archive once per process.
+    :param archive_config: Dict - "archive" section of config
+    :return: Object of class PayloadArchive
+    """
+    global payload_archive
+    if payload_archive is None:
+        payload_archive = gcarchive.openArchive(root_path, archive_config)
+    return payload_archive
+
+
+def archivePayload(env, config, payload_json, action, repository):
+    """
+    Queue accepted (successfully parsed) payload for archive writer thread (or log it, if it is sampled
+    and archive is disabled). Archive errors are logged, delivery is processed anyway.
+    :param env: Dict - WSGI environment
+    :param config: Object of class ConfigSnapshot
+    :param payload_json: Bytes - Raw payload json
+    :param action: String - Event action or None
+    :param repository: String - Repository name or None
+    """
+    event = env.get('HTTP_X_GITHUB_EVENT', '')
+    delivery_id = env.get('HTTP_X_GITHUB_DELIVERY', '')
+    archive_config = config.get("archive", {})
+    if not archive_config.get("active", False):
+        gclog.capturePayload(payload_json, {"event": event, "delivery_id": delivery_id})
+        return
+    try:
+        getPayloadArchive(archive_config).appendLater(payload_json, delivery_id, event, repository or "", action or "")
+    except Exception as e:
+        logging.error('Payload is not archived: ' + repr(e))
+
+
+def enqueuePayload(env, queue_config, payload):
+    """
+    Validate payload and append it to delivery queue.
+    :param env: Dict - WSGI environment
+    :param queue_config: Dict - "delivery_queue" section of config
+    :param payload: Dict - Parsed payload (see gcpayload.parsePayload)
+    :return: Bool - True if payload is queued
+    """
+    if 'repository' not in payload or 'sender' not in payload:
+        logging.warning('Payload format is wrong, skipped.')
+        return False
+
+    # Pruned payload is queued, so worker does not parse unused parts again
+    getDeliveryQueue(queue_config).put(json.dumps(payload), env.get('HTTP_X_GITHUB_EVENT', ''))
+    return True
+
+
+def rejectEvent(reason, description):
+    """
+    Log and count event, which is skipped before payload decoding.
+    :param reason: String - Rejection reason for metrics ("event", "action" or "repository")
+    :param description: String - Log message
+    """
+    logging.info(description + ', skipped.')
+    gcmetrics.inc("gcbot_webhook_rejected_total", {"reason": reason})
+
+
+def readPayload(env, config):
+    """
+    Read payload from request body (only keys, used by handlers, are kept).
+    Unhandled actions and repositories without rooms are rejected before json decoding.
+    :param env: Dict - WSGI environment
+    :param config: Object of class ConfigSnapshot
+    :return: Dict - Parsed payload or None, if request does not contain payload or is rejected
+    """
+    content_type = gcpayload.getContentType(env)
+    if content_type not in (gcpayload.JSON_CONTENT_TYPE, gcpayload.FORM_CONTENT_TYPE):
+        return None
+    try:
+        payload_json = gcpayload.extractPayloadJson(content_type, gcpayload.readBody(env))
+        if payload_json is None:
+            return None
+
+        event = env.get('HTTP_X_GITHUB_EVENT', '')
+        action = gcpayload.peekAction(payload_json)
+        if action is not None and not gcbot.isHandledEvent(event, action):
+            rejectEvent("action", 'Event "' + event + '" with action "' + action + '" is not handled')
+            return None
+        # Message of unmapped repository is still sent to personal rooms of addressees, if any
+        repository = gcpayload.peekRepositoryName(payload_json)
+        if repository is not None and repository not in config["repository_room_map"] \
+                and not config.account_index.has_account_rooms:
+            rejectEvent("repository", 'Repository "' + repository + '" has no rooms')
+            return None
+
+        payload = gcpayload.parsePayload(payload_json)
+        archivePayload(env, config, payload_json, action, repository)
+        return payload
+    except gcpayload.PayloadError as e:
+        logging.warning(str(e) + ', skipped.')
+        return None
+
+
+def metrics():
+    """
+    Render metrics of all processes (for "/metrics" route).
+    :return: String - Metrics in Prometheus text format
+    """
+    gclog.ensureConfigured(log_path)
+    gcconfig.configureMetrics(root_path, gcconfig.loadConfig(config_path))
+    return gcmetrics.render()
+
+
+def processRequest(env, config, event, delivery_id):
+    """
+    Read payload and queue it or pass it to GithubChatworkBot webhook handler.
+    :param env: Dict - WSGI environment
+    :param config: Object of class ConfigSnapshot
+    :param event: String - Github event name (X-GitHub-Event header)
+    :param delivery_id: String - Github delivery id (X-GitHub-Delivery header)
+    """
     # Check incoming POST data.
-    # If "payload" key exists in POST data, then this is request from Github.
-    post_env = env.copy()
-    post_env['QUERY_STRING'] = ''
-    post_data = cgi.FieldStorage(
-        fp=env['wsgi.input'],
-        environ=post_env,
-        keep_blank_values=True
-    )
-    if "payload" in post_data:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-
-        botInstance = gcbot.GithubChatworkBot()
-        botInstance.setPayload(post_data)
-        botInstance.chatwork_token = config["chatwork_token"]
-        botInstance.logging = config["logging"]
-        botInstance.chatwork_github_account_map = config["chatwork_github_account_map"]
-        botInstance.repository_room_map = config["repository_room_map"]
-        botInstance.ui_login_email = config["ui"]["login_email"]
-        botInstance.ui_login_id = config["ui"]["login_id"]
-        botInstance.ui_login_password = config["ui"]["login_password"]
-        botInstance.executeWebhookHandler()
+    # If body contains payload (json body or "payload" form field), then this is request from Github.
+    gcpayload.configure(config.get("ingest", {}))
+    with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "ingest"}):
+        payload = readPayload(env, config)
+    if payload is None:
+        return
+
+    cwtransport.configure(config.get("http", {}))
+    gcconfig.configureRateLimit(root_path, config)
+    gcconfig.configureRetry(root_path, config)
+
+    # Ingest mode: answer Github immediately, worker.py will do the rest.
+    queue_config = config.get("delivery_queue", {})
+    if queue_config.get("active"):
+        with gcmetrics.timer("gcbot_stage_duration_seconds", {"stage": "enqueue"}):
+            enqueuePayload(env, queue_config, payload)
+        return
+
+    botInstance = gcbot.GithubChatworkBot()
+    botInstance.setConfig(config)
+    botInstance.delivery_id = delivery_id
+    botInstance.setEvent(event)
+    botInstance.setPayloadData(payload)
+    botInstance.executeWebhookHandler()
+
+
+def main(env):
+    # Log file is opened by the first request, not on import (settings of "log" section are applied, when config is loaded)
+    gclog.ensureConfigured(log_path)
+    config = gcconfig.loadConfig(config_path)
+    gclog.configure(log_path, config.get("log", {}))
+    gcconfig.configureMetrics(root_path, config)
+
+    # Reject unhandled events (ping, push, status etc) before request body is read
+    event = env.get('HTTP_X_GITHUB_EVENT', '')
+    if event and not gcbot.isHandledEvent(event):
+        rejectEvent("event", 'Event "' + event + '" is not handled')
+        gcmetrics.flush()
+        return "ok"
+
+    # Drop Github redelivery (timeout retry or "Redeliver" button) before request body is parsed
+    delivery_id = env.get('HTTP_X_GITHUB_DELIVERY', '')
+    dedup_config = {}
+    if delivery_id:
+        dedup_config = config.get("deduplication", {})
+        if dedup_config.get("active", True) and getDeduplicator(dedup_config).isDuplicate(delivery_id):
+            logging.info('Delivery ' + delivery_id + ' is already processed, skipped.')
+            gcmetrics.inc("gcbot_webhook_duplicates_total")
+            gcmetrics.flush()
+            return "ok"
+
+    try:
+        processRequest(env, config, event, delivery_id)
+    except Exception:
+        # Delivery id is already remembered: let Github redelivery of failed (for example, not queued) delivery be processed
+        if delivery_id and dedup_config.get("active", True):
+            getDeduplicator(dedup_config).forget(delivery_id)
+        raise
+    finally:
+        gcmetrics.flush()
     return "ok"
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Delivery queue worker. Drains webhook deliveries, queued by index.py, and sends them to Chatwork.
+# Used only if "delivery_queue" is active in config.json.
+# To start worker, use this command in script root directory: python3 frontend/worker.py
+# To process queued deliveries once and exit (for example, from crontab): python3 frontend/worker.py --once
+# Several workers can drain the same queue simultaneously.
+# If "coalesce" is active in config.json, messages about the same issue/PR are merged per room (see gccoalesce.py).
+# Stop worker with SIGTERM or Ctrl+C, so buffered messages are sent before exit.
+
+import sys
+import logging
+import traceback
+import gcbot
+import cwtransport
+import cwretry
+import gcqueue
+import gcconfig
+import gcmetrics
+import gclog
+import gccoalesce
+import os
+import signal
+import time
+
+# Set to True by SIGTERM handler
+stopping = False
+# Interval in seconds, with which failed deliveries are purged and reported
+purge_interval = 3600
+
+
+def processDelivery(config, delivery, coalescer=None):
+    """
+    Pass delivery through GithubChatworkBot webhook handler.
+    :param config: Object of class ConfigSnapshot
+    :param delivery: Dict - Delivery, returned by DeliveryQueue.claim()
+    :param coalescer: Object of class MessageCoalescer or None
+    """
+    botInstance = gcbot.GithubChatworkBot()
+    botInstance.setConfig(config)
+    botInstance.coalescer = coalescer
+    botInstance.delivery_queue_id = delivery["id"]
+    # Event is empty for deliveries, queued without X-GitHub-Event header (it is guessed by payload then)
+    botInstance.setEvent(delivery["event"])
+    try:
+        botInstance.setPayloadJson(delivery["payload"])
+        botInstance.executeWebhookHandler()
+    except gcbot.ExecutionError as e:
+        # Delivery can not be processed: it is failed, not acknowledged
+        raise RuntimeError('Execution is stopped: ' + e.message) from e
+    except SystemExit:
+        # Handler stops execution with sys.exit() when event is processed (for example, chatwork task is created)
+        pass
+
+
+def retryDeadLetters(config):
+    """
+    Send requests of dead letter store, which are due for retry.
+    :param config: Object of class ConfigSnapshot
+    """
+    botInstance = gcbot.GithubChatworkBot()
+    botInstance.setConfig(config)
+    sent, failed = cwretry.retryDeadLetters(botInstance.strictChatworkRequest)
+    if sent or failed:
+        logging.info('Dead letters retried: ' + str(sent) + ' sent, ' + str(failed) + ' failed.')
+
+
+def purgeFailedDeliveries(queue, queue_config):
+    """
+    Remove failed deliveries, which are older than "failed_retention_days", and report the rest.
+    :param queue: Object of class DeliveryQueue
+    :param queue_config: Dict - "delivery_queue" section of config
+    """
+    retention_days = queue_config.get("failed_retention_days", 14)
+    removed = queue.purgeFailed(before=time.time() - retention_days * 86400)
+    if removed:
+        logging.info('Failed deliveries older than ' + str(retention_days) + ' days are removed: ' + str(removed) + '.')
+    failed = queue.count()[queue.FAILED]
+    if failed:
+        logging.warning('Failed deliveries in queue: ' + str(failed) + ' (see python3 frontend/deliveries.py list).')
+
+
+def createCoalescer(config_path, queue_config, coalesce_config):
+    """
+    Create burst coalescer, if "coalesce" is active in config.
+    :param config_path: String - Path to config.json
+    :param queue_config: Dict - "delivery_queue" section of config
+    :param coalesce_config: Dict - "coalesce" section of config
+    :return: Object of class MessageCoalescer or None
+    """
+    if not coalesce_config.get("active"):
+        return None
+
+    def send(room_id, body):
+        botInstance = gcbot.GithubChatworkBot()
+        botInstance.setConfig(gcconfig.loadConfig(config_path))
+        return botInstance.sendMessageToRoom(room_id, body)
+
+    # Deliveries are acknowledged after their messages are sent, so window must be shorter than lease
+    window = min(coalesce_config.get("window", 60), queue_config.get("lease_timeout", 300) / 2)
+    return gccoalesce.MessageCoalescer(send, window, coalesce_config.get("max_messages", 10))
+
+
+def stop(signum, frame):
+    """
+    SIGTERM handler: finish current delivery, send buffered messages and exit.
+    """
+    global stopping
+    stopping = True
+
+
+def main():
+    once = "--once" in sys.argv[1:]
+
+    here = os.path.dirname(__file__)
+    config_path = os.path.normpath(here+'/../config.json')
+    root_path = os.path.normpath(here+'/../')
+    log_path = os.path.join(here, '../logs/log.txt')
+
+    gclog.configure(log_path, {})
+
+    config = gcconfig.loadConfig(config_path)
+    cwtransport.configure(config.get("http", {}))
+
+    queue_config = config.get("delivery_queue", {})
+    queue = gcqueue.DeliveryQueue(
+        os.path.join(root_path, queue_config.get("path", "logs/queue.db")),
+        queue_config.get("lease_timeout", 300),
+        queue_config.get("max_attempts", 5)
+    )
+    poll_interval = queue_config.get("poll_interval", 1)
+    coalescer = createCoalescer(config_path, queue_config, config.get("coalesce", {}))
+    signal.signal(signal.SIGTERM, stop)
+
+    processed = 0
+    purge_at = 0
+    try:
+        while not stopping:
+            # Config changes are picked up without restart (file is parsed again only if it is changed)
+            config = gcconfig.loadConfig(config_path)
+            gclog.configure(log_path, config.get("log", {}))
+            gcconfig.configureMetrics(root_path, config)
+            gcconfig.configureRateLimit(root_path, config)
+            gcconfig.configureRetry(root_path, config)
+            gcmetrics.flush()
+            retryDeadLetters(config)
+            if time.time() >= purge_at:
+                purgeFailedDeliveries(queue, queue_config)
+                purge_at = time.time() + purge_interval
+            if coalescer is not None:
+                for delivery_id in coalescer.flushDue():
+                    queue.ack(delivery_id)
+
+            delivery = queue.claim()
+            if delivery is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            try:
+                processDelivery(config, delivery, coalescer)
+            except Exception:
+                logging.error('Delivery ' + str(delivery["id"]) + ' failed (attempt ' + str(delivery["attempts"]) + '): ' + traceback.format_exc())
+                queue.fail(delivery["id"], traceback.format_exc(limit=1))
+                if delivery["attempts"] >= queue.max_attempts:
+                    logging.error('Delivery ' + str(delivery["id"]) + ' is failed after ' + str(delivery["attempts"]) +
+                                  ' attempts and is not retried (see python3 frontend/deliveries.py).')
+            else:
+                processed += 1
+                # Delivery with buffered messages is acknowledged after they are sent
+                if coalescer is None or not coalescer.isPending(delivery["id"]):
+                    queue.ack(delivery["id"])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if coalescer is not None:
+            for delivery_id in coalescer.flushAll():
+                queue.ack(delivery_id)
+
+    return "Processed deliveries: " + str(processed)
+
+if __name__ == "__main__":
+    print(main())